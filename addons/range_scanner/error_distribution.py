@@ -2,5 +2,28 @@ import numpy as np
 
 # for more distributions see: https://numpy.org/doc/stable/reference/random/generator.html#distributions
 
-def applyNoise(mu, sigma):
-    return np.random.default_rng().normal(mu, sigma, None)
\ No newline at end of file
+# the noise types of the user interface (see ui/user_interface.py, noiseType)
+# mu and sigma can be scalars or arrays with one value per hit
+noiseDistributions = {
+    'gaussian': lambda generator, mu, sigma, size: generator.normal(mu, sigma, size),
+}
+
+# one generator is used for the whole scan, so the noise of all hits can be drawn at once
+# and a scan can be reproduced from its seed
+class NoiseGenerator:
+    def __init__(self, seed=0):
+        if seed == 0:
+            # no seed given, pick a random one which is reported with the results
+            # it has to fit into the seed property of the user interface (1 to 2^31 - 1)
+            # see: https://numpy.org/doc/stable/reference/random/generated/numpy.random.SeedSequence.html
+            seed = int(np.random.SeedSequence().generate_state(1)[0]) % (2**31 - 1) + 1
+
+        self.seed = seed
+        self.generator = np.random.default_rng(seed)
+
+    def getNoise(self, noiseType, mu, sigma, size):
+        if noiseType not in noiseDistributions:
+            print("WARNING: Unknown noise type %s, using gaussian noise!" % noiseType)
+            noiseType = 'gaussian'
+
+        return noiseDistributions[noiseType](self.generator, mu, sigma, size)
@@ -17,20 +17,14 @@ def export(filePath, fileName, data, depthMinDistance, depthMaxDistance, width,
 
     pixels = np.full(width * height, 0) 
 
-    for hit in data:
-        distance = hit.distance
-
-        # map the values the same way, the Kinect does it
-        # 0 means outside range
-        if distance < depthMinDistance:
-            intensity = 0
-        elif distance > depthMaxDistance:
-            intensity = 0
-        else:
-            # else, map the values to the given interval
-            intensity = distance / depthMaxDistance
-
-        pixels[(hit.y * width) + hit.x] = intensity * scalingFactor # scale to 16 bit
+    distances = data['distance']
+
+    # map the values the same way, the Kinect does it
+    # 0 means outside range, else, map the values to the given interval
+    inRange = (distances >= depthMinDistance) & (distances <= depthMaxDistance)
+    intensities = np.where(inRange, distances / depthMaxDistance, 0.0)
+
+    pixels[(data['pixelY'].astype(np.int64) * width) + data['pixelX']] = intensities * scalingFactor # scale to 16 bit
 
     f = open(os.path.join(filePath, "%s_image_depthmap.png" % fileName), 'wb') 
     w = png.Writer(width, height, greyscale=True, bitdepth=bitdepth)
@@ -13,6 +13,8 @@ def createDataset(handle, attribute, data):
     dset = handle.create_dataset(attribute, (1,), dtype=dt, maxshape=(None,))
 
     # set data
+    # the columns of the hit buffer are written as they are, h5py converts them to
+    # double precision while writing, so no copy of the columns is made before
     handle[attribute][...] = data
 
     # write column name
@@ -23,75 +25,113 @@ def appendData(handle, attribute, data):
 
     # add a new line
     handle[attribute].resize((handle[attribute].shape[0] + 1), axis = 0)
-    
+
     # write data at the end
     handle[attribute][-1] = data
 
-def export(filePath, fileName, data, exportNoiseData):
-    print("Exporting data into .hdf format...") 
+def getNoiseSeedRow(exportNoiseData, noiseSeed):
+    if exportNoiseData and noiseSeed is not None:
+        return np.array([noiseSeed], dtype=np.float64)
 
-    # in contrast to the other export methods, we only have ONE
-    # file to export all data
-    filePath = os.path.join(filePath, "%s.hdf5" % fileName)
+    return np.empty(0, dtype=np.float64)
+
+def getColumns(data, exportNoiseData):
+    # (attribute, values) of all datasets, the values are views of the hit buffer
+    # category ID
+    yield ("categoryID", data['categoryID'])
+
+    # part ID
+    yield ("partID", data['partID'])
+
+    # real location
+    yield ("location_x", data['location'][:, 0])
+    yield ("location_y", data['location'][:, 1])
+    yield ("location_z", data['location'][:, 2])
+    yield ("distance", data['distance'])
+
+    # noise location
+    if exportNoiseData:
+        yield ("location_noise_x", data['noiseLocation'][:, 0])
+        yield ("location_noise_y", data['noiseLocation'][:, 1])
+        yield ("location_noise_z", data['noiseLocation'][:, 2])
+        yield ("distance_noise", data['noiseDistance'])
 
+    # color
+    yield ("color_r", data['color'][:, 0])
+    yield ("color_g", data['color'][:, 1])
+    yield ("color_b", data['color'][:, 2])
+
+    # intensity
+    yield ("intensity", data['intensity'])
+
+def writeRow(filePath, columns, noiseSeedRow):
+    # the columns are written one after another, so they can also be created one at a time
     hdfFile = Path(filePath)
     if not hdfFile.is_file():
         # the file does not exist yet, so we need to create it
-        with h5py.File(filePath, "w") as f: 
-            # category ID
-            createDataset(f, "categoryID", [data[0]])
-            
-            # part ID
-            createDataset(f, "partID", [data[1]])
-
-            # real location
-            createDataset(f, "location_x", [data[2]])
-            createDataset(f, "location_y", [data[3]])
-            createDataset(f, "location_z", [data[4]])
-            createDataset(f, "distance", [data[5]])
-
-            # noise location
-            if exportNoiseData:
-                createDataset(f, "location_noise_x", [data[10]])
-                createDataset(f, "location_noise_y", [data[11]])
-                createDataset(f, "location_noise_z", [data[12]])
-                createDataset(f, "distance_noise", [data[13]])
-            
-            # color
-            createDataset(f, "color_r", [data[7]])
-            createDataset(f, "color_g", [data[8]])
-            createDataset(f, "color_b", [data[9]])
-
-            # intensity
-            createDataset(f, "intensity", [data[6]])              
+        with h5py.File(filePath, "w") as f:
+            for attribute, values in columns:
+                createDataset(f, attribute, [values])
+
+            # the seed which reproduces the noise of this row, empty without noise
+            createDataset(f, "noise_seed", [noiseSeedRow])
     else:
         # the file already exists, so we want to append it
-        with h5py.File(filePath, "a") as f: 
-            # category ID
-            appendData(f, "categoryID", [data[0]])
-            
-            # part ID
-            appendData(f, "partID", [data[1]])
-
-            # real location
-            appendData(f, "location_x", [data[2]])
-            appendData(f, "location_y", [data[3]])
-            appendData(f, "location_z", [data[4]])
-            appendData(f, "distance", [data[5]])
-
-            # noise location
-            if exportNoiseData:
-                appendData(f, "location_noise_x", [data[10]])
-                appendData(f, "location_noise_y", [data[11]])
-                appendData(f, "location_noise_z", [data[12]])
-                appendData(f, "distance_noise", [data[13]])
-            
-            # color
-            appendData(f, "color_r", [data[7]])
-            appendData(f, "color_g", [data[8]])
-            appendData(f, "color_b", [data[9]])
-
-            # intensity
-            appendData(f, "intensity", [data[6]])  
-        
-    print("Done.")
\ No newline at end of file
+        with h5py.File(filePath, "a") as f:
+            for attribute, values in columns:
+                appendData(f, attribute, [values])
+
+            # the seed which reproduces the noise of this row, each scan appended to the file can have its own seed
+            if not "noise_seed" in f:
+                # files written before the seeds were stored get empty rows for their old data
+                createDataset(f, "noise_seed", [np.empty(0, dtype=np.float64)])
+                f["noise_seed"].resize((f["intensity"].shape[0] - 1,), axis = 0)
+
+            appendData(f, "noise_seed", [noiseSeedRow])
+
+def export(filePath, fileName, data, exportNoiseData, noiseSeed=None):
+    print("Exporting data into .hdf format...")
+
+    # in contrast to the other export methods, we only have ONE
+    # file to export all data
+    filePath = os.path.join(filePath, "%s.hdf5" % fileName)
+
+    writeRow(filePath, getColumns(data, exportNoiseData), getNoiseSeedRow(exportNoiseData, noiseSeed))
+
+    print("Done.")
+
+def getChunkFilePath(filePath, fileName):
+    return os.path.join(filePath, "%s.chunks.hdf5" % fileName)
+
+def removeChunks(filePath, fileName):
+    # chunks left over by a scan which was aborted
+    chunkFilePath = getChunkFilePath(filePath, fileName)
+
+    if os.path.isfile(chunkFilePath):
+        os.remove(chunkFilePath)
+
+def exportChunk(filePath, fileName, data, exportNoiseData):
+    # rows of a .hdf file can't be extended, so the chunks of a streamed scan are collected
+    # in a temporary file and merged into one row when the scan is done (see mergeChunks)
+    writeRow(getChunkFilePath(filePath, fileName), getColumns(data, exportNoiseData), np.empty(0, dtype=np.float64))
+
+def mergeChunks(filePath, fileName, noiseSeedRow):
+    # streamed scans get one row per scan like all other scans
+    chunkFilePath = getChunkFilePath(filePath, fileName)
+
+    if not os.path.isfile(chunkFilePath):
+        return
+
+    print("Merging chunks into .hdf format...")
+
+    with h5py.File(chunkFilePath, "r") as chunks:
+        attributes = [attribute for attribute in chunks if attribute != "noise_seed"]
+
+        # only one column of the whole scan is kept in memory at a time
+        columns = ((attribute, np.concatenate(chunks[attribute][:])) for attribute in attributes)
+
+        writeRow(os.path.join(filePath, "%s.hdf5" % fileName), columns, noiseSeedRow)
+
+    os.remove(chunkFilePath)
+
+    print("Done.")
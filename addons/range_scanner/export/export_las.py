@@ -14,16 +14,16 @@ def export(filePath, fileName, data, exportNoiseData, usePartIDs):
         outfile = laspy.file.File(os.path.join(filePath, "%s_parts.las" % fileName), mode="w", header=hdr)
         
         # assign data
-        outfile.pt_src_id = data[1]
+        outfile.pt_src_id = data['partID']
     else:
         outfile = laspy.file.File(os.path.join(filePath, "%s.las" % fileName), mode="w", header=hdr)
     
         # assign data
-        outfile.pt_src_id = data[0]
+        outfile.pt_src_id = data['categoryID']
 
-    allX = data[2]
-    allY = data[3]
-    allZ = data[4]
+    allX = data['location'][:, 0]
+    allY = data['location'][:, 1]
+    allZ = data['location'][:, 2]
 
     # generate some additional information
     xmin = np.floor(np.min(allX))
@@ -39,11 +39,11 @@ def export(filePath, fileName, data, exportNoiseData, usePartIDs):
     outfile.z = allZ
 
     # for scaling factors see: https://www.asprs.org/wp-content/uploads/2010/12/LAS_1_4_r13.pdf
-    outfile.intensity = data[6] * 65535
+    outfile.intensity = data['intensity'] * 65535
 
-    outfile.red = data[7] * 65535
-    outfile.green = data[8] * 65535
-    outfile.blue = data[9] * 65535
+    outfile.red = data['color'][:, 0] * 65535
+    outfile.green = data['color'][:, 1] * 65535
+    outfile.blue = data['color'][:, 2] * 65535
 
     outfile.close()
 
@@ -53,16 +53,16 @@ def export(filePath, fileName, data, exportNoiseData, usePartIDs):
             outfile = laspy.file.File(os.path.join(filePath, "%s_noise_parts.las" % fileName), mode="w", header=hdr)
             
             # assign data
-            outfile.pt_src_id = data[1]
+            outfile.pt_src_id = data['partID']
         else:
             outfile = laspy.file.File(os.path.join(filePath, "%s_noise.las" % fileName), mode="w", header=hdr)
         
             # assign data
-            outfile.pt_src_id = data[0]
+            outfile.pt_src_id = data['categoryID']
 
-        allX = data[10]
-        allY = data[11]
-        allZ = data[12]
+        allX = data['noiseLocation'][:, 0]
+        allY = data['noiseLocation'][:, 1]
+        allZ = data['noiseLocation'][:, 2]
 
         # generate some additional information
         xmin = np.floor(np.min(allX))
@@ -76,11 +76,11 @@ def export(filePath, fileName, data, exportNoiseData, usePartIDs):
         outfile.y = allY
         outfile.z = allZ
 
-        outfile.intensity = data[6] * 65535
+        outfile.intensity = data['intensity'] * 65535
 
-        outfile.red = data[7] * 65535
-        outfile.green = data[8] * 65535
-        outfile.blue = data[9] * 65535
+        outfile.red = data['color'][:, 0] * 65535
+        outfile.green = data['color'][:, 1] * 65535
+        outfile.blue = data['color'][:, 2] * 65535
 
         outfile.close()
     
@@ -12,13 +12,11 @@ def export(filePath, fileName, data, partIDs, exportPascalVoc, width, height):
     # blank image
     image = bpy.data.images.new("MyImage", width=width, height=height)
 
-    # as the fill value (black) is a tuple, we need some special packing
-    # see: https://stackoverflow.com/a/40711408/13440564
-    value = np.empty((), dtype=object)
-    value[()] = (0.0, 0.0, 0.0, 1.0)
-
-    pixels = np.full(width * height, value) 
-    alphaPixels = np.full(width * height, value) 
+    # one RGBA row per pixel, black by default
+    # foreach_set needs a float32 buffer for the float pixels of an image
+    pixels = np.zeros((width * height, 4), dtype=np.float32)
+    pixels[:, 3] = 1.0
+    alphaPixels = pixels.copy()
 
     # generate some random color for each object to make all pixels
     # of one target the same color
@@ -47,40 +45,31 @@ def export(filePath, fileName, data, partIDs, exportPascalVoc, width, height):
 
         names[partID] = name
 
-    if exportPascalVoc:
-        for hit in data:
-            pixels[((height - hit.y - 1) * width) + hit.x] = colors[hit.partID]
-            alphaPixels[((height - hit.y - 1) * width) + hit.x] = (1.0, 1.0, 1.0, 1.0)
-
-            # read available values
-            minX, minY, maxX, maxY = boundingBoxes[hit.partID]
+    # the image is stored bottom-up
+    pixelIndices = ((height - data['pixelY'].astype(np.int64) - 1) * width) + data['pixelX']
 
-            # update values if necessary
-            if hit.x < minX:
-                minX = hit.x
+    # lookup table partID -> color
+    colorTable = np.zeros((max(colors.keys(), default=-1) + 1, 4), dtype=np.float32)
+    for partID, color in colors.items():
+        colorTable[partID] = color
 
-            if hit.y < minY:
-                minY = hit.y
+    pixels[pixelIndices] = colorTable[data['partID']]
+    alphaPixels[pixelIndices] = (1.0, 1.0, 1.0, 1.0)
 
-            if hit.x > maxX:
-                maxX = hit.x
+    if exportPascalVoc:
+        for partID in np.unique(data['partID']):
+            partHits = data[data['partID'] == partID]
 
-            if hit.y > maxY:
-                maxY = hit.y
+            # the minimum and maximum pixel coordinates of all hits on this part
+            boundingBoxes[int(partID)] = (int(partHits['pixelX'].min()), int(partHits['pixelY'].min()),
+                                     int(partHits['pixelX'].max()), int(partHits['pixelY'].max()))
 
-            # write values back
-            boundingBoxes[hit.partID] = minX, minY, maxX, maxY
-    else:
-        for hit in data:
-            pixels[((height - hit.y - 1) * width) + hit.x] = colors[hit.partID]
-            alphaPixels[((height - hit.y - 1) * width) + hit.x] = (1.0, 1.0, 1.0, 1.0)
-        
     # flatten list
-    pixels = [chan for px in pixels for chan in px]
-    alphaPixels = [chan for px in alphaPixels for chan in px]
+    pixels = pixels.ravel()
+    alphaPixels = alphaPixels.ravel()
 
     # assign pixels
-    image.pixels = pixels
+    image.pixels.foreach_set(pixels)
 
     # write image
     fullFilePath = os.path.join(filePath, "%s_image_segmented.png" % fileName)
@@ -91,7 +80,7 @@ def export(filePath, fileName, data, partIDs, exportPascalVoc, width, height):
 
 
     # assign pixels
-    image.pixels = alphaPixels
+    image.pixels.foreach_set(alphaPixels)
 
     # write image
     fullFilePath = os.path.join(filePath, "%s_image_alpha.png" % fileName)
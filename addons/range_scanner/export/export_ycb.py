@@ -15,13 +15,10 @@ def apply_transform_on_blender(matrix, vertices_co):
     return vertices_co @ mat + loc
 
 
-def export(filePath, fileName, data, exportNoiseData, scannerObject, width, height):
+def export(filePath, fileName, data, targets, exportNoiseData, scannerObject, width, height):
     """
-    hit.categoryID, hit.partID,                                             # 0, 1   
-    hit.location.x, hit.location.y, hit.location.z,                         # 2, 3, 4
-    hit.distance,                                                           # 5
-    hit.intensity,                                                          # 6
-    hit.color[0], hit.color[1], hit.color[2],                               # 7, 8, 9
+    data: structured hit array (see hit_info.hitDataType)
+    targets: scanned objects, indexed by data['targetIndex']
     """
 
     cam_K = M.get_K(scannerObject)
@@ -32,8 +29,13 @@ def export(filePath, fileName, data, exportNoiseData, scannerObject, width, heig
     center = []
     vertmap = np.zeros((height, width, 3), dtype=np.float)
     objs_set = {}
-    for hit in data:
-        obj = hit.target
+
+    # the first hit of each object, in the order the objects were hit
+    (targetIndices, firstHits) = np.unique(data['targetIndex'], return_index=True)
+    order = np.argsort(firstHits)
+
+    for targetIndex, hitIndex in zip(targetIndices[order], firstHits[order]):
+        obj = targets[targetIndex]
         if not obj.get("object_id", None) and not obj.get("cls_index", None):
             continue
         if objs_set.get(obj, None) == None: # if this object is not visited.
@@ -51,7 +53,7 @@ def export(filePath, fileName, data, exportNoiseData, scannerObject, width, heig
                 poses = np.dstack((poses, np.array(cam_RT @ obj.matrix_world)))
 
              # 3D world coordinate to 2D project coordinate: cam_K @ cam_RT @ matrix_world
-            projected_co = apply_transform_on_blender(cam_K @ cam_RT, np.array([hit.location.x, hit.location.y, hit.location.z]))
+            projected_co = apply_transform_on_blender(cam_K @ cam_RT, np.array(data['location'][hitIndex], dtype=np.float64))
             projected_co /= projected_co[2]
             x = int(projected_co[0])
             y = int(projected_co[1])
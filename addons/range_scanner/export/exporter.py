@@ -8,8 +8,17 @@ from . import export_segmented_image
 from . import export_rendered_image
 from . import export_depthmap
 
+def exportNoiseSeed(filePath, fileName, exportNoiseData, noiseSeed):
+    # the .las point format and the .csv columns have no place for the seed of the noise,
+    # so it is written into a small text file next to them (the .hdf file stores it as a row)
+    if not exportNoiseData or noiseSeed is None:
+        return
+
+    with open(os.path.join(filePath, "%s_noise_seed.txt" % fileName), 'w') as seedFile:
+        seedFile.write("%d\n" % noiseSeed)
+
 class Exporter:
-    def __init__(self, filePath, fileName, rawFileName, data, targets, categoryIDs, partIDs, materialMappings, exportNoiseData, width, height):
+    def __init__(self, filePath, fileName, rawFileName, data, targets, categoryIDs, partIDs, materialMappings, exportNoiseData, width, height, noiseSeed=None):
         # we need Blender's custom file path manipulation methods
         # to avoid error because of relative paths
         # see: https://blender.stackexchange.com/a/12153/95167
@@ -17,56 +26,39 @@ class Exporter:
         os.makedirs(self.filePath, exist_ok=True)
         self.fileName = fileName
         self.rawFileName = rawFileName
+        # the data is a slice of the structured hit buffer (see hit_info.hitDataType), all
+        # exporters read its columns as views, so nothing is converted or copied here
         self.data = data
         self.targets = targets
         self.categoryIDs = categoryIDs
         self.partIDs = partIDs
         self.materialMappings = materialMappings
-        self.exportNoiseData = exportNoiseData
+        # the noise columns are only part of buffers which were created with noise
+        self.exportNoiseData = exportNoiseData and 'noiseLocation' in data.dtype.names
         self.width = width
         self.height = height
-
-        # map data tuples to arrays
-        if exportNoiseData:
-            self.mappedData = np.array(list(map(lambda hit: self.tupleToArrayWithNoise(hit), data))).transpose()
-        else:
-            self.mappedData = np.array(list(map(lambda hit: self.tupleToArray(hit), data))).transpose()
-
-    def tupleToArray(self, hit):
-        return np.array([
-            hit.categoryID, hit.partID,                                             # 0, 1   
-            hit.location.x, hit.location.y, hit.location.z,                         # 2, 3, 4
-            hit.distance,                                                           # 5
-            hit.intensity,                                                          # 6
-            hit.color[0], hit.color[1], hit.color[2],                               # 7, 8, 9
-        ])
-
-    def tupleToArrayWithNoise(self, hit):
-        return np.array([
-            hit.categoryID, hit.partID,                                             # 0, 1
-            hit.location.x, hit.location.y, hit.location.z,                         # 2, 3, 4
-            hit.distance,                                                           # 5
-            hit.intensity,                                                          # 6
-            hit.color[0], hit.color[1], hit.color[2],                               # 7, 8, 9
-            hit.noiseLocation.x, hit.noiseLocation.y, hit.noiseLocation.z,          # 10, 11, 12
-            hit.noiseDistance                                                       # 13
-        ])
-
+        # the seed of the noise generator (see error_distribution.NoiseGenerator) is stored
+        # with the data, so the noise can be reproduced
+        self.noiseSeed = noiseSeed
 
     def exportLAS(self):  
         from . import export_las   
         # export using categoryIDs as source ID 
-        export_las.export(self.filePath, self.fileName, self.mappedData, self.exportNoiseData, usePartIDs=False)
+        export_las.export(self.filePath, self.fileName, self.data, self.exportNoiseData, usePartIDs=False)
 
         # export using partIDs as source ID 
-        export_las.export(self.filePath, self.fileName, self.mappedData, self.exportNoiseData, usePartIDs=True)
+        export_las.export(self.filePath, self.fileName, self.data, self.exportNoiseData, usePartIDs=True)
+
+        exportNoiseSeed(self.filePath, self.fileName, self.exportNoiseData, self.noiseSeed)
     
     def exportHDF(self, fileNameExtra=""):
         from . import export_hdf
-        export_hdf.export(self.filePath, self.rawFileName + fileNameExtra, self.mappedData, self.exportNoiseData)
+        export_hdf.export(self.filePath, self.rawFileName + fileNameExtra, self.data, self.exportNoiseData, self.noiseSeed)
 
     def exportCSV(self):
-        export_csv.export(self.filePath, self.fileName, self.mappedData.transpose(), self.exportNoiseData, self.data)
+        export_csv.export(self.filePath, self.fileName, self.data, self.exportNoiseData, self.targets)
+
+        exportNoiseSeed(self.filePath, self.fileName, self.exportNoiseData, self.noiseSeed)
 
     def exportSegmentedImage(self, exportPascalVoc):
         export_segmented_image.export(self.filePath, self.fileName, self.data, self.partIDs, exportPascalVoc, self.width, self.height)
@@ -78,4 +70,75 @@ class Exporter:
         export_depthmap.export(self. filePath, self.fileName, self.data, depthMinDistance, depthMaxDistance, self.width, self.height)
 
     def exportYCB(self, scannerObject):
-        export_ycb.export(self.filePath, self.fileName, self.data, self.exportNoiseData, scannerObject, self.width, self.height)
\ No newline at end of file
+        export_ycb.export(self.filePath, self.fileName, self.data, self.targets, self.exportNoiseData, scannerObject, self.width, self.height)
+
+class ChunkExporter:
+    # exports the hits of a scan chunk by chunk while scanning, so only one chunk
+    # has to be kept in memory instead of the hits of all frames
+    def __init__(self, filePath, fileName, rawFileName, targets, exportNoiseData, exportLAS, exportHDF, exportCSV, fileNameExtra="", noiseSeed=None):
+        self.filePath = bpy.path.abspath(filePath)
+        os.makedirs(self.filePath, exist_ok=True)
+        self.fileName = fileName
+        self.rawFileName = rawFileName
+        self.targets = targets
+        self.exportNoiseData = exportNoiseData
+        self.exportLAS = exportLAS
+        self.exportHDF = exportHDF
+        self.exportCSV = exportCSV
+        self.fileNameExtra = fileNameExtra
+        self.noiseSeed = noiseSeed
+
+        self.numberOfChunks = 0
+        self.numberOfHits = 0
+
+        # the .csv file stays open until all chunks are written
+        self.csvFile = None
+        self.csvWriter = None
+
+        if exportCSV:
+            self.csvFile = open(os.path.join(self.filePath, "%s.csv" % fileName), 'w', newline='')
+            self.csvWriter = export_csv.createWriter(self.csvFile)
+            export_csv.writeHeader(self.csvWriter, exportNoiseData)
+
+        if exportHDF:
+            from . import export_hdf
+            export_hdf.removeChunks(self.filePath, self.rawFileName + self.fileNameExtra)
+
+        # all chunk files of the scan share one seed
+        if exportLAS or exportCSV:
+            exportNoiseSeed(self.filePath, fileName, exportNoiseData, noiseSeed)
+
+    def write(self, data):
+        if len(data) == 0:
+            return
+
+        print("Writing chunk %d with %d hits..." % (self.numberOfChunks, len(data)))
+
+        if self.exportLAS:
+            # laspy can't append points to an existing file, so each chunk gets its own file
+            from . import export_las
+            chunkFileName = "%s_chunk_%d" % (self.fileName, self.numberOfChunks)
+            export_las.export(self.filePath, chunkFileName, data, self.exportNoiseData, usePartIDs=False)
+            export_las.export(self.filePath, chunkFileName, data, self.exportNoiseData, usePartIDs=True)
+
+        if self.exportHDF:
+            # the chunks are merged into one row of the scan when it is closed
+            from . import export_hdf
+            export_hdf.exportChunk(self.filePath, self.rawFileName + self.fileNameExtra, data, self.exportNoiseData)
+
+        if self.exportCSV:
+            export_csv.writeRows(self.csvWriter, data, self.exportNoiseData, self.targets)
+
+        self.numberOfChunks += 1
+        self.numberOfHits += len(data)
+
+    def close(self):
+        if self.csvFile is not None:
+            self.csvFile.close()
+            self.csvFile = None
+
+        if self.exportHDF:
+            from . import export_hdf
+            export_hdf.mergeChunks(self.filePath, self.rawFileName + self.fileNameExtra, export_hdf.getNoiseSeedRow(self.exportNoiseData, self.noiseSeed))
+
+        print("Exported %d hits in %d chunks." % (self.numberOfHits, self.numberOfChunks))
@@ -18,8 +18,9 @@ light direction and the normal to the surface).
 The incidence angle is measured from the normal to the surface and is measured
 in radians.
 
+All routines work for scalars and for arrays of m or of theta_i.
+
 To Do
-    * Make sure routines work for arrays of m or of theta_i
     * fail for positive imaginary refractive indices
     * fail for out-of-range angles to catch degrees/radians error
 
@@ -40,7 +41,8 @@ __all__ = ('brewster',
            'T_par',
            'T_per',
            'R_unpolarized',
-           'T_unpolarized'
+           'T_unpolarized',
+           'T_unpolarized_lookup'
            )
 
 def brewster(m, n_i=1):
@@ -92,9 +94,8 @@ def r_par_amplitude(m, theta_i, n_i=1):
     m2 = (m/n_i)**2
     c = m2 * np.cos(theta_i)
     s = np.sin(theta_i)
-    d = np.sqrt(m2 - s * s, dtype=np.complex) # = m*cos(theta_t)
-    if m.imag == 0:  # choose right branch for dielectrics
-        d = np.conjugate(d)
+    d = np.sqrt(m2 - s * s, dtype=np.complex128) # = m*cos(theta_t)
+    d = np.where(np.imag(m) == 0, np.conjugate(d), d)  # choose right branch for dielectrics
     rp = (c - d) / (c + d)
     return np.real_if_close(rp)
 
@@ -122,9 +123,8 @@ def r_per_amplitude(m, theta_i, n_i=1):
     m2 = (m/n_i)**2
     c = np.cos(theta_i)
     s = np.sin(theta_i)
-    d = np.sqrt(m2 - s * s, dtype=np.complex) # = m*cos(theta_t)
-    if m.imag == 0:  # choose right branch for dielectrics
-        d = np.conjugate(d)
+    d = np.sqrt(m2 - s * s, dtype=np.complex128) # = m*cos(theta_t)
+    d = np.where(np.imag(m) == 0, np.conjugate(d), d)  # choose right branch for dielectrics
     rs = (c - d) / (c + d)
     return np.real_if_close(rs)
 
@@ -152,9 +152,8 @@ def t_par_amplitude(m, theta_i, n_i=1):
     m2 = (m/n_i)**2
     c = np.cos(theta_i)
     s = np.sin(theta_i)
-    d = np.sqrt(m2 - s * s, dtype=np.complex) # = m*cos(theta_t)
-    if m.imag == 0:  # choose right branch for dielectrics
-        d = np.conjugate(d)
+    d = np.sqrt(m2 - s * s, dtype=np.complex128) # = m*cos(theta_t)
+    d = np.where(np.imag(m) == 0, np.conjugate(d), d)  # choose right branch for dielectrics
     tp = 2 * c * (m/n_i) / (m2 * c + d)
     return np.real_if_close(tp)
 
@@ -182,9 +181,8 @@ def t_per_amplitude(m, theta_i, n_i=1):
     m2 = (m/n_i)**2
     c = np.cos(theta_i)
     s = np.sin(theta_i)
-    d = np.sqrt(m2 - s * s, dtype=np.complex) # = m*cos(theta_t)
-    if m.imag == 0:  # choose right branch for dielectrics
-        d = np.conjugate(d)
+    d = np.sqrt(m2 - s * s, dtype=np.complex128) # = m*cos(theta_t)
+    d = np.where(np.imag(m) == 0, np.conjugate(d), d)  # choose right branch for dielectrics
     ts = 2 * d / (m/n_i)/ (c + d)
     return np.real_if_close(ts)
 
@@ -256,7 +254,7 @@ def T_par(m, theta_i, n_i=1):
     m2 = (m/n_i)**2
     c = np.cos(theta_i)
     s = np.sin(theta_i)
-    d = np.sqrt(m2 - s * s, dtype=np.complex)
+    d = np.sqrt(m2 - s * s, dtype=np.complex128)
     tp = 2 * c * (m/n_i) / (m2 * c + d)
     return np.abs(d / c * abs(tp)**2)
 
@@ -284,7 +282,7 @@ def T_per(m, theta_i, n_i=1):
     m2 = (m/n_i)**2
     c = np.cos(theta_i)
     s = np.sin(theta_i)
-    d = np.sqrt(m2 - s * s, dtype=np.complex)
+    d = np.sqrt(m2 - s * s, dtype=np.complex128)
     ts = 2 * c / (c + d)
     return np.abs(d / c * abs(ts)**2)
 
@@ -318,4 +316,34 @@ def T_unpolarized(m, theta_i, n_i=1):
     Returns:
         reflected irradiance                  [-]
     """
-    return (T_par(m, theta_i, n_i) + T_per(m, theta_i, n_i)) / 2
\ No newline at end of file
+    return (T_par(m, theta_i, n_i) + T_per(m, theta_i, n_i)) / 2
+
+
+# incidence angles of the lookup tables, 0.05 degree steps from 0 to 90 degree
+lookupAngles = np.linspace(0.0, np.pi / 2, 1801)
+
+# lookup tables of T_unpolarized, one for each pair of refractive indices
+transmissionTables = {}
+
+
+def T_unpolarized_lookup(m, theta_i, n_i=1):
+    """
+    Fraction of unpolarized light that is transmitted, interpolated from a lookup table.
+
+    The table of T_unpolarized over the incidence angle is calculated once for each
+    pair of refractive indices, so the transmission of many hits on the same material
+    is a single interpolation.
+
+    Args:
+        m :     real index of refraction of the outgoing medium   [-]
+        theta_i : incidence angles from normal, 0 to pi/2         [radians]
+        n_i :   real index of refraction of the incoming medium   [-]
+    Returns:
+        transmitted irradiance                [-]
+    """
+    key = (m, n_i)
+
+    if key not in transmissionTables:
+        transmissionTables[key] = T_unpolarized(m, lookupAngles, n_i)
+
+    return np.interp(theta_i, lookupAngles, transmissionTables[key])
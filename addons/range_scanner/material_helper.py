@@ -2,9 +2,8 @@ import bpy
 import math
 import colorsys
 from mathutils import Vector
-from mathutils.interpolate import poly_3d_calc
 from bpy.types import Scene, Mesh, MeshPolygon, Image
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 import numpy as np
 
 def getSurfaceReflectivity(color):
@@ -18,150 +17,238 @@ def getSurfaceReflectivity(color):
 
 MaterialProperty = namedtuple('MaterialProperty', 'color metallic ior')
 
-def getMaterialColorAndMetallic(hit, materialMappings, depsgraph, debugOutput):
+# the shading properties of every material slot of every target, resolved once per scan
+# instead of walking the node tree for each hit
+#   color:      base RGBA color (ignored if the slot uses a texture)
+#   metallic:   metallic factor, 1.0 means mirror
+#   ior:        index of refraction, 0.0 for opaque materials
+#   texture:    index into MaterialTable.textures or -1
+#   isValid:    False if the slot has no material or an unknown node setup
+materialDataType = np.dtype([
+    ('color', np.float32, (4,)),
+    ('metallic', np.float64),
+    ('ior', np.float64),
+    ('texture', np.int32),
+    ('isValid', np.bool_),
+])
+
+# rows:         one row per material slot, the slots of each object are stored consecutively
+# offsets:      (number of targets,) first row of each target
+# slotCounts:   (number of targets,) number of material slots of each target
+# textures:     images referenced by the texture column
+# targetIndices: target -> index, used to look up single hits
+MaterialTable = namedtuple('MaterialTable', 'rows offsets slotCounts textures targetIndices')
+
+def compileMaterial(material, textures, textureIndices, objectName):
+    row = np.zeros((), dtype=materialDataType)
+    row['texture'] = -1
+
+    if material is None:
+        # no material set
+        return row
+
+    if material.use_nodes == False:
+        # diffuse_color, metallic, specular_intensity, roughness
+        row['color'] = material.diffuse_color
+        row['metallic'] = material.metallic
+        row['isValid'] = True
+
+        return row
+
+    # the easy way would be to get the active node:
+    # node = material.node_tree.nodes.active
+    # the problem here is that also no node can be active so this returns None
+
+    # instead, we get the Material Output node and look at the connected nodes
+    # see: https://blender.stackexchange.com/a/5471/95167
+    links = material.node_tree.nodes["Material Output"].inputs["Surface"].links
+
+    for link in links:
+        # get the node of the connected link
+        node = link.from_node
+
+        # node tree
+        if node.type == 'BSDF_GLASS':
+            # glass
+            row['color'] = node.inputs['Color'].default_value
+            row['ior'] = node.inputs['IOR'].default_value
+            row['isValid'] = True
+
+            return row
+        elif node.type == 'TEX_IMAGE':
+            # image texture, the color is read for each hit
+            image = node.image
+
+            if not image.as_pointer() in textureIndices:
+                textureIndices[image.as_pointer()] = len(textures)
+                textures.append(image)
+
+            row['texture'] = textureIndices[image.as_pointer()]
+
+            # retrieve metallic factor
+            row['metallic'] = material.node_tree.nodes["Principled BSDF"].inputs['Metallic'].default_value
+            row['isValid'] = True
+
+            return row
+        elif node.type == 'BSDF_PRINCIPLED':
+            # simple color
+            row['color'] = node.inputs['Base Color'].default_value
+            row['metallic'] = node.inputs['Metallic'].default_value
+            row['isValid'] = True
+
+            return row
+        else:
+            # unknown material
+            print("Unknown material type for object %s!" % objectName)
+            print(node.type)
+
+    return row
+
+def compileMaterialTable(targets, debugOutput):
+    # the fingerprint of an image doesn't change when it is painted, reloaded or edited in place,
+    # so the pixels are read again in each scan and only reused between the frames and batches of one scan
+    clearTexturePixels()
+
+    rows = []
+    textures = []
+    textureIndices = {}
+
+    offsets = np.zeros(len(targets), dtype=np.int64)
+    slotCounts = np.zeros(len(targets), dtype=np.int64)
+
+    # instances share the material slots of the instanced object, so they also share the rows
+    objectOffsets = {}
+
+    for targetIndex, target in enumerate(targets):
+        slotCounts[targetIndex] = len(target.material_slots)
+
+        if target.original in objectOffsets:
+            offsets[targetIndex] = objectOffsets[target.original]
+            continue
+
+        offsets[targetIndex] = objectOffsets[target.original] = len(rows)
+
+        for slot in target.material_slots:
+            if slot.material is None and debugOutput:
+                print("WARNING: No material set for object %s!" % target.name)
+
+            rows.append(compileMaterial(slot.material, textures, textureIndices, target.name))
+
+    return MaterialTable(np.array(rows, dtype=materialDataType).reshape(-1), offsets, slotCounts, textures,
+                         {target: index for index, target in enumerate(targets)})
+
+def getMaterialRows(materialTable, targetIndices, materialIndices):
+    # gather the properties of many hits at once
+    # Blender uses the last slot for material indices which are out of range
+    materialIndices = np.minimum(materialIndices, materialTable.slotCounts[targetIndices] - 1)
+
+    return materialTable.rows[materialTable.offsets[targetIndices] + materialIndices]
+
+def getMaterialColorAndMetallic(hit, materialMappings, materialTable, depsgraph, debugOutput, textureColor=None):
     # each face can have an individual material so we need to get the correct one here
+    targetIndex = materialTable.targetIndices[hit.target]
     materialIndex = materialMappings[hit.target][hit.faceIndex]
-    material = hit.target.material_slots[materialIndex].material
 
-    if material is not None:
-        if material.use_nodes == False:
-            # diffuse_color, metallic, specular_intensity, roughness
-            rgba = material.diffuse_color
-            metallic = material.metallic
+    row = getMaterialRows(materialTable, targetIndex, materialIndex)
 
-            return MaterialProperty(rgba, metallic, 0.0)
-        else:
-            # the easy way would be to get the active node:
-            # node = material.node_tree.nodes.active
-            # the problem here is that also no node can be active so this returns None
-
-            # instead, we get the Material Output node and look at the connected nodes
-            # see: https://blender.stackexchange.com/a/5471/95167
-            links = material.node_tree.nodes["Material Output"].inputs["Surface"].links
-
-            for link in links:
-                # get the node of the connected link
-                node = link.from_node
-
-                # node tree
-                if node.type == 'BSDF_GLASS':
-                    # glass
-                    rgba = node.inputs['Color'].default_value
-                    ior = node.inputs['IOR'].default_value
-
-                    return MaterialProperty(rgba, 0.0, ior)
-                elif node.type == 'TEX_IMAGE':
-                    # image texture
-                    
-                    # retrieve color
-                    rgba = getUVPixelColor(hit.target.data, hit.faceIndex, hit.location, node.image)
-                    
-                    # retrieve metallic factor
-                    metallic = material.node_tree.nodes["Principled BSDF"].inputs['Metallic'].default_value
-
-                    return MaterialProperty(rgba, metallic, 0.0)
-                elif node.type == 'BSDF_PRINCIPLED':
-                    # simple color
-                    rgba = node.inputs['Base Color'].default_value
-                    metallic = node.inputs['Metallic'].default_value
-    
-                    return MaterialProperty(rgba, metallic, 0.0)
-                else:
-                    # unknown material
-                    print("Unknown material type for object %s!" % hit.target.name)
-                    print(node.type)
+    if not row['isValid']:
+        return None
+
+    if row['texture'] >= 0 and textureColor is not None:
+        # already sampled together with the other hits of the batch
+        rgba = textureColor
+    elif row['texture'] >= 0:
+        # retrieve color
+        rgba = getTextureColors([hit], materialMappings, materialTable)[0]
     else:
-        # no material set
-        if debugOutput:
-            print("WARNING: No material set for object %s!" % hit.target.name)
-    
-    return None
-
-# source: https://blender.stackexchange.com/a/139399/95167
-def getUVPixelColor(mesh:Mesh, face_idx:int, point:Vector, image:Image):
-    """ get RGBA value for point in UV image at specified face index
-    mesh     -- target mesh (must be uv unwrapped)
-    face_idx -- index of face in target mesh to grab texture color from
-    point    -- location (in 3D space on the specified face) to grab texture color from
-    image    -- UV image used as texture for 'mesh' object
-    """
+        rgba = tuple(row['color'].tolist())
+
+    return MaterialProperty(rgba, float(row['metallic']), float(row['ior']))
+
+# pixels of all used textures as (height, width, channels) arrays, least recently used first
+# (cleared at the start of each scan, see compileMaterialTable)
+texturePixels = OrderedDict()
+
+# textures are evicted once the cached pixels need more memory than this (in bytes)
+maxTextureCacheSize = 512 * 1024 * 1024
+
+def getTextureFingerprint(image):
+    # the pointer might be reused by another image, so we also compare some cheap properties
+    return (image.name_full, tuple(image.size), image.channels, image.filepath_raw)
+
+def getTexturePixels(image):
+    key = image.as_pointer()
+    fingerprint = getTextureFingerprint(image)
+
+    if key in texturePixels and texturePixels[key][1] == fingerprint:
+        texturePixels.move_to_end(key)
+        return texturePixels[key][0]
+
     # ensure image contains at least one pixel
-    assert image is not None and image.pixels is not None and len(image.pixels) > 0
-    
-    # get closest material using UV map
-    face = mesh.polygons[face_idx]
-    
-    # get uv coordinate based on nearest face intersection
-    uv_coord = getUVCoord(mesh, face, point, image)
-    
-    # retrieve rgba value at uv coordinate
-    rgba = getPixel(image, uv_coord)
-    return rgba
+    assert image is not None and len(image.pixels) > 0
+
+    # accessing image.pixels element by element is very slow, so all pixels are copied at once
+    # see: https://docs.blender.org/api/current/bpy.types.bpy_prop_collection.html#bpy.types.bpy_prop_collection.foreach_get
+    (width, height) = image.size
+    pixels = np.empty(width * height * image.channels, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    pixels = pixels.reshape(height, width, image.channels)
+
+    texturePixels[key] = (pixels, fingerprint)
 
+    # drop the least recently used textures, the current one is always kept
+    cacheSize = sum(cachedPixels.nbytes for (cachedPixels, _) in texturePixels.values())
 
-def getUVCoord(mesh:Mesh, face:MeshPolygon, point:Vector, image:Image):
-    """ returns UV coordinate of target point in source mesh image texture
-    mesh  -- mesh data from source object
-    face  -- face object from mesh
-    point -- coordinate of target point on source mesh
-    image -- image texture for source mesh
+    while cacheSize > maxTextureCacheSize and len(texturePixels) > 1:
+        (removedPixels, _) = texturePixels.popitem(last=False)[1]
+        cacheSize -= removedPixels.nbytes
+
+    return pixels
+
+def clearTexturePixels():
+    texturePixels.clear()
+
+def sampleTexture(pixels, uvs):
+    """ get the RGBA values of many UV coordinates at once
+    pixels -- (height, width, channels) pixels of the texture
+    uvs    -- (N, 2) UV coordinates
     """
-    
-    # get active uv layer data
-    uv_layer = mesh.uv_layers.active
-    assert uv_layer is not None # ensures mesh has a uv map
-    
-    uv = uv_layer.data
+    (height, width, channels) = pixels.shape
 
-    # get 3D coordinates of face's vertices
-    lco = [mesh.vertices[i].co for i in face.vertices]
-    
-    # get uv coordinates of face's vertices
-    luv = [uv[i].uv for i in face.loop_indices]
-    
-    # calculate barycentric weights for point
-    lwts = poly_3d_calc(lco, point)
-    
-    # multiply barycentric weights by uv coordinates
-    uv_loc = sum((p*w for p,w in zip(luv,lwts)), Vector((0,0)))
-    
     # ensure uv_loc is in range(0,1)
     # TODO: possibly approach this differently? currently, uv verts that are outside the image are wrapped to the other side
-    uv_loc = Vector((uv_loc[0] % 1, uv_loc[1] % 1))
-    
-    # convert uv_loc in range(0,1) to uv coordinate
-    image_size_x, image_size_y = image.size
-    x_co = round(uv_loc.x * (image_size_x - 1))
-    y_co = round(uv_loc.y * (image_size_y - 1))
-    uv_coord = (x_co, y_co)
+    uvs = np.mod(uvs, 1.0)
 
-    # return resulting uv coordinate
-    return Vector(uv_coord)
+    # convert uv_loc in range(0,1) to pixel coordinates
+    x = np.round(uvs[:, 0] * (width - 1)).astype(np.int64)
+    y = np.round(uvs[:, 1] * (height - 1)).astype(np.int64)
 
+    colors = np.ones((len(uvs), 4), dtype=np.float32)
+    colors[:, :min(channels, 4)] = pixels[y, x, :4]
 
-# reference: https://svn.blender.org/svnroot/bf-extensions/trunk/py/scripts/addons/uv_bake_texture_to_vcols.py
-def getPixel(img, uv_coord):
-    """ get RGBA value for specified coordinate in UV image
-    pixels    -- list of pixel data from UV texture image
-    uv_coord  -- UV coordinate of desired pixel value
-    """
-    uv_pixels = img.pixels # Accessing pixels directly is quite slow. Copy to new array and pass as an argument for massive performance-gain if you plan to run this function many times on the same image (img.pixels[:]).
-    
-    pixelNumber = (img.size[0] * int(uv_coord.y)) + int(uv_coord.x)
-    
-    r = uv_pixels[pixelNumber*4 + 0]
-    g = uv_pixels[pixelNumber*4 + 1]
-    b = uv_pixels[pixelNumber*4 + 2]
-    a = uv_pixels[pixelNumber*4 + 3]
-    
-    return (r, g, b, a)
+    return colors
+
+def getTextureColors(hits, materialMappings, materialTable):
+    # the texture colors of a batch of hits, None for hits without texture
+    colors = [None] * len(hits)
+
+    if len(hits) == 0 or len(materialTable.textures) == 0:
+        return colors
+
+    targetIndices = np.array([materialTable.targetIndices[hit.target] for hit in hits], dtype=np.int64)
+    materialIndices = np.array([materialMappings[hit.target][hit.faceIndex] for hit in hits], dtype=np.int64)
+
+    textures = getMaterialRows(materialTable, targetIndices, materialIndices)['texture']
+
+    # the UV coordinates are already interpolated while casting the rays, so all hits
+    # with the same texture are sampled together
+    for texture in np.unique(textures[textures >= 0]):
+        hitIndices = np.flatnonzero(textures == texture)
+        uvs = np.array([hits[hitIndex].uv for hitIndex in hitIndices], dtype=np.float64).reshape(-1, 2)
 
-def getFaceMaterialMapping(mesh):
-    # https://blender.stackexchange.com/a/52429/95167
-    numberOfPolygons = len(mesh.polygons.items())
-    mapping = np.empty(numberOfPolygons, dtype=int)
+        textureColors = sampleTexture(getTexturePixels(materialTable.textures[texture]), uvs)
 
-    for f in mesh.polygons: 
-        mapping[f.index] = f.material_index
+        for hitIndex, color in zip(hitIndices, textureColors.tolist()):
+            colors[hitIndex] = tuple(color)
 
-    return mapping
\ No newline at end of file
+    return colors
@@ -1,12 +1,16 @@
 import bpy
 import sys
 import bmesh
+from mathutils import Vector
 from mathutils.bvhtree import BVHTree
 import numpy as np
 from . import hit_info
+from . import geometry_cache
+from . import instances
 import os
 import time
 
+from collections import namedtuple
 from enum import Enum
 ScannerType = Enum('ScannerType', 'static rotating sideScan')
 
@@ -14,6 +18,7 @@ from . import lidar
 from . import sonar
 from ..export import exporter
 from .. import material_helper
+from .. import error_distribution
 from ..scanners import generic
 
 # source: https://blender.stackexchange.com/a/30739/95167
@@ -95,31 +100,85 @@ def getTargetIndices(targets, debugOutput):
        
 
     # add all materials to dictionary
-    for material in bpy.data.materials:
-        materialName = material.name
-
+    # (the names are cached until a material is added, removed or renamed)
+    for materialName in geometry_cache.getMaterialNames():
         if not materialName in partIDs:
             partIDs[materialName] = partIndex
             partIndex += 1
 
-    return (categoryIDs, partIDs)
+    return (categoryIDs, partIDs, getTargetIDs(targets, categoryIDs, partIDs))
+
+# integer lookup tables for the segmentation labels
+#   categoryIndices:    (number of targets,) category index of each target
+#   partIndices:        part index of each material slot, the slots of each target are stored consecutively
+#   partOffsets:        (number of targets,) first entry of each target in partIndices
+#   slotCounts:         (number of targets,) number of material slots of each target
+TargetIDs = namedtuple('TargetIDs', 'categoryIndices partIndices partOffsets slotCounts')
+
+# part of the faces whose material slot is empty
+unassignedPartName = "no material"
+
+def getTargetIDs(targets, categoryIDs, partIDs):
+    categoryIndices = np.array([categoryIDs[target["categoryID"]] for target in targets], dtype=np.int32)
+
+    partIndices = []
+    partOffsets = np.zeros(len(targets), dtype=np.int64)
+    slotCounts = np.zeros(len(targets), dtype=np.int64)
+
+    for targetIndex, target in enumerate(targets):
+        partOffsets[targetIndex] = len(partIndices)
+
+        if "partID" in target:
+            partNames = [target["partID"]] * len(target.material_slots)
+        else:
+            # fallback is the material of the face
+            partNames = [slot.name if slot.name in partIDs else unassignedPartName for slot in target.material_slots]
+
+        if len(partNames) == 0:
+            # the faces of a target without material slots all use the first (missing) slot
+            partNames = [unassignedPartName]
+
+        if unassignedPartName in partNames and not unassignedPartName in partIDs:
+            # the part is only added if it is used, so it doesn't get a color in the segmented image otherwise
+            partIDs[unassignedPartName] = len(partIDs)
+
+        slotCounts[targetIndex] = len(partNames)
+        partIndices.extend(partIDs[partName] for partName in partNames)
+
+    return TargetIDs(categoryIndices, np.array(partIndices, dtype=np.int32), partOffsets, slotCounts)
+
+def getHitIDs(targetIDs, targets, materialMappings, targetIndices, faceIndices):
+    # category and part index of a batch of hits
+    targetIndices = np.asarray(targetIndices, dtype=np.int64)
+    faceIndices = np.asarray(faceIndices, dtype=np.int64)
+
+    materialIndices = np.zeros(len(targetIndices), dtype=np.int64)
+
+    # the material indices of the faces are stored per target
+    for targetIndex in np.unique(targetIndices):
+        isTarget = targetIndices == targetIndex
+        materialIndices[isTarget] = materialMappings[targets[targetIndex]][faceIndices[isTarget]]
+
+    # Blender uses the last slot for material indices which are out of range
+    materialIndices = np.minimum(materialIndices, targetIDs.slotCounts[targetIndices] - 1)
+
+    categoryIndices = targetIDs.categoryIndices[targetIndices]
+    partIndices = targetIDs.partIndices[targetIDs.partOffsets[targetIndices] + materialIndices]
+
+    return (categoryIndices, partIndices)
 
 def addMeshToScene(name, values, useNoiseLocation):
     # Create new mesh to store all measurements as points
     mesh = bpy.data.meshes.new(name='created mesh')
-    bm = bmesh.new()        
 
-    # iterate over all possible hits
     if useNoiseLocation:
-        for hit in values:                
-            bm.verts.new((hit.noiseLocation.x, hit.noiseLocation.y, hit.noiseLocation.z))
+        locations = values['noiseLocation']
     else:
-        for hit in values:                
-            bm.verts.new((hit.location.x, hit.location.y, hit.location.z))
+        locations = values['location']
 
-    # make the bmesh the object's mesh
-    bm.to_mesh(mesh)  
-    bm.free()  # always do this when finished
+    # set all vertices at once instead of adding them one by one
+    mesh.vertices.add(len(locations))
+    mesh.vertices.foreach_set("co", np.ascontiguousarray(locations, dtype=np.float32).ravel())
         
     # We're done setting up the mesh values, update mesh object and 
     # let Blender do some checks on it
@@ -133,48 +192,228 @@ def addMeshToScene(name, values, useNoiseLocation):
     scene = bpy.context.scene
     scene.collection.objects.link(obj)
 
-def getClosestHit(targets, trees, origin, direction, maxRange, debugOutput, debugLines):
-    closestLocation = None
-    closestFaceNormal = None
-    closestFaceIndex = None
-    closestDistance = maxRange
-    closestTarget = None
+# results of a batch of rays, one entry per ray
+# rays without a hit have an infinite distance and a target index of -1
+# faceIndices are polygon indices, triangleIndices and barycentrics locate the hit on the
+# triangle of the BVH tree (used to interpolate per corner attributes like the UVs)
+RayHits = namedtuple('RayHits', 'distances locations faceIndices normals targetIndices triangleIndices barycentrics uvs')
 
-    # iterate over all targets to find the closest hit
-    for target in targets:
-        if debugOutput:
-            print("Scanning target ", target.name, "...")
+# limits of the number of rays which are processed at once in castRays
+minChunkSize = 256
+maxChunkSize = 16384
+
+# maximum number of entries of a (rays, targets) table, 2^22 float64 values need 32 MB
+maxBoundsTableSize = 2**22
+
+def getTargetBounds(targets, trees):
+    boundsMin = np.array([trees[target].bounds[0] for target in targets], dtype=np.float64).reshape(-1, 3)
+    boundsMax = np.array([trees[target].bounds[1] for target in targets], dtype=np.float64).reshape(-1, 3)
+
+    return (boundsMin, boundsMax)
 
-        # perform the actual ray casting
-        # see: https://docs.blender.org/api/current/mathutils.bvhtree.html#mathutils.bvhtree.BVHTree.ray_cast
-        #      https://github.com/blender/blender/blob/master/source/blender/blenlib/BLI_kdopbvh.h#L81
-        location, faceNormal, faceIndex, distance = trees[target][0].ray_cast(origin, direction, closestDistance)
+def intersectBounds(origins, directions, boundsMin, boundsMax, maxRanges):
+    # slab test of every ray against every axis aligned bounding box
+    # see: https://tavianator.com/2011/ray_box.html
+    # returns the distance at which each ray enters each box, inf if the box is missed
+    tNear = np.full((len(directions), len(boundsMin)), -np.inf)
+    tFar = np.full((len(directions), len(boundsMin)), np.inf)
+
+    # one axis at a time, so only two (rays, boxes) tables are needed besides the result
+    for axis in range(3):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inverseDirections = 1.0 / directions[:, axis, np.newaxis]
+
+            t1 = (boundsMin[np.newaxis, :, axis] - origins[:, axis, np.newaxis]) * inverseDirections
+            t2 = (boundsMax[np.newaxis, :, axis] - origins[:, axis, np.newaxis]) * inverseDirections
+
+            # fmin/fmax ignore the NaNs of rays parallel to a slab which start on its border
+            np.fmax(tNear, np.fmin(t1, t2), out=tNear)
+            np.fmin(tFar, np.fmax(t1, t2), out=tFar)
+
+    # boxes behind the origin are not relevant, boxes containing the origin are entered immediately
+    tNear = np.maximum(tNear, 0.0)
+
+    isHit = (tNear <= tFar) & (tNear <= maxRanges[:, np.newaxis])
+
+    # empty boxes (min > max) belong to targets which don't exist in the current frame
+    isHit &= np.all(boundsMin <= boundsMax, axis=1)[np.newaxis, :]
+
+    return np.where(isHit, tNear, np.inf)
+
+def getChunkSize(numberOfTargets):
+    # the ray/box tables of a chunk have one entry per ray and target, so scenes with many
+    # targets (e.g. particle instances) are cast in smaller chunks to keep their memory bounded
+    return int(np.clip(maxBoundsTableSize // max(numberOfTargets, 1), minChunkSize, maxChunkSize))
+
+def castRays(targets, trees, origins, directions, maxRanges, debugOutput=False, outputProgress=False):
+    numberOfRays = len(directions)
+
+    distances = np.full(numberOfRays, np.inf)
+    locations = np.zeros((numberOfRays, 3))
+    faceIndices = np.full(numberOfRays, -1, dtype=np.int64)
+    normals = np.zeros((numberOfRays, 3))
+    targetIndices = np.full(numberOfRays, -1, dtype=np.int64)
+    triangleIndices = np.full(numberOfRays, -1, dtype=np.int64)
+    barycentrics = np.zeros((numberOfRays, 3))
+    uvs = np.zeros((numberOfRays, 2))
+
+    # a single maximum range is used for all rays
+    maxRanges = np.broadcast_to(np.asarray(maxRanges, dtype=np.float64), (numberOfRays,))
+
+    # the rays are processed in chunks, so the ray/box tables stay small
+    chunkSize = getChunkSize(len(targets))
+
+    # look up the bound methods only once instead of once per ray and target
+    rayCasts = [trees[target].tree.ray_cast for target in targets]
+
+    # the trees are built in object space, so the rays have to be transformed into
+    # each object's space and the hits back into world space
+    matrices = np.array([trees[target].matrixWorld for target in targets], dtype=np.float64).reshape(-1, 4, 4)
+    inverseMatrices = np.array([trees[target].inverseMatrixWorld for target in targets], dtype=np.float64).reshape(-1, 4, 4)
+
+    geometries = [trees[target].geometry for target in targets]
+    worldNormals = [trees[target].worldNormals for target in targets]
+
+    (boundsMin, boundsMax) = getTargetBounds(targets, trees)
+
+    for chunkStart in range(0, numberOfRays, chunkSize):
+        chunkEnd = min(chunkStart + chunkSize, numberOfRays)
+
+        chunkOrigins = np.broadcast_to(np.asarray(origins, dtype=np.float64), (numberOfRays, 3))[chunkStart:chunkEnd]
+        chunkDirections = np.asarray(directions, dtype=np.float64)[chunkStart:chunkEnd]
+
+        # the box distances have to be measured in the same unit as the hit distances
+        chunkDirections = chunkDirections / np.linalg.norm(chunkDirections, axis=1)[:, np.newaxis]
+
+        # top level: only the targets whose bounding box is crossed by a ray are candidates for that ray,
+        # they are sorted by the distance at which the ray enters the box
+        # only the crossed boxes are sorted, most rays only cross a few of many instances
+        entryDistances = intersectBounds(chunkOrigins, chunkDirections, boundsMin, boundsMax, maxRanges[chunkStart:chunkEnd])
+        (candidateRays, candidateTargets) = np.nonzero(np.isfinite(entryDistances))
+        candidateDistances = entryDistances[candidateRays, candidateTargets]
+        del entryDistances
+
+        # the candidates of each ray are stored one after another, starting at candidateStarts
+        candidateOrder = np.lexsort((candidateDistances, candidateRays))
+        candidateTargets = candidateTargets[candidateOrder]
+        candidateDistances = candidateDistances[candidateOrder]
+        candidateCounts = np.bincount(candidateRays, minlength=chunkEnd - chunkStart)
+        candidateStarts = np.cumsum(candidateCounts) - candidateCounts
 
         # we use the current closest distance as maximum range, because we don't need to consider geometry which 
         # is further away than the current closest hit
+        closestDistances = maxRanges[chunkStart:chunkEnd].copy()
+        closestTargets = np.full(chunkEnd - chunkStart, -1, dtype=np.int64)
+        closestFaceIndices = np.full(chunkEnd - chunkStart, -1, dtype=np.int64)
+        closestLocations = np.zeros((chunkEnd - chunkStart, 3))
+        closestFaceNormals = np.zeros((chunkEnd - chunkStart, 3))
+        closestTriangleIndices = np.full(chunkEnd - chunkStart, -1, dtype=np.int64)
+        closestBarycentrics = np.zeros((chunkEnd - chunkStart, 3))
+        closestUVs = np.zeros((chunkEnd - chunkStart, 2))
+
+        # bottom level: visit the candidate targets of all rays front to back, one candidate per ray at a time
+        for candidateIndex in range(candidateCounts.max(initial=0)):
+            # all remaining boxes of a ray start behind its closest hit, so they can't contain a closer one
+            isActive = candidateCounts > candidateIndex
+            isActive[isActive] = candidateDistances[candidateStarts[isActive] + candidateIndex] <= closestDistances[isActive]
+
+            activeRays = np.flatnonzero(isActive)
+
+            if len(activeRays) == 0:
+                break
+
+            activeTargets = candidateTargets[candidateStarts[activeRays] + candidateIndex]
+
+            # the rays of one target are transformed into its object space at once
+            for targetIndex in np.unique(activeTargets):
+                rayIndices = activeRays[activeTargets == targetIndex]
+                inverseMatrix = inverseMatrices[targetIndex]
+
+                localOrigins = chunkOrigins[rayIndices] @ inverseMatrix[:3, :3].T + inverseMatrix[:3, 3]
+                localDirections = chunkDirections[rayIndices] @ inverseMatrix[:3, :3].T
+
+                # a scaled object changes the length of the direction vector, which is
+                # the factor between distances in object space and world space
+                scales = np.linalg.norm(localDirections, axis=1)
+                localRanges = closestDistances[rayIndices] * scales
+
+                rayCast = rayCasts[targetIndex]
+
+                # mathutils accepts plain sequences, converting the arrays once is much
+                # cheaper than converting single rows inside the loop
+                for rayIndex, origin, direction, maxRange, scale in zip(rayIndices.tolist(), localOrigins.tolist(), localDirections.tolist(), localRanges.tolist(), scales.tolist()):
+                    # perform the actual ray casting
+                    # see: https://docs.blender.org/api/current/mathutils.bvhtree.html#mathutils.bvhtree.BVHTree.ray_cast
+                    #      https://github.com/blender/blender/blob/master/source/blender/blenlib/BLI_kdopbvh.h#L81
+                    location, faceNormal, faceIndex, distance = rayCast(origin, direction, maxRange)
+
+                    # if there was a hit and it is closer to the origin, update closest hit
+                    if distance is not None and distance / scale < closestDistances[rayIndex]:
+                        closestDistances[rayIndex] = distance / scale
+                        closestTargets[rayIndex] = targetIndex
+                        closestLocations[rayIndex] = location
+                        closestFaceNormals[rayIndex] = faceNormal
+                        closestFaceIndices[rayIndex] = faceIndex
+
+        # transform the hits of each target back into world space
+        for targetIndex in np.unique(closestTargets[closestTargets >= 0]):
+            rayIndices = np.flatnonzero(closestTargets == targetIndex)
+            matrix = matrices[targetIndex]
+            geometry = geometries[targetIndex]
+
+            # the tree returns the index of the triangle, the barycentric weights of the hits on
+            # these triangles are calculated at once (still in object space)
+            hitTriangles = closestFaceIndices[rayIndices]
+            weights = geometry_cache.getBarycentricWeights(geometry, hitTriangles, closestLocations[rayIndices])
+
+            closestTriangleIndices[rayIndices] = hitTriangles
+            closestBarycentrics[rayIndices] = weights
+
+            if len(geometry.loopUVs) > 0:
+                closestUVs[rayIndices] = geometry_cache.interpolateCorners(geometry, geometry.loopUVs, hitTriangles, weights)
+
+            # but for the materials we need the polygon
+            closestFaceIndices[rayIndices] = geometry.trianglePolygons[hitTriangles]
+
+            closestLocations[rayIndices] = closestLocations[rayIndices] @ matrix[:3, :3].T + matrix[:3, 3]
+
+            if worldNormals[targetIndex] is not None:
+                # the world space normals of all triangles are already known
+                closestFaceNormals[rayIndices] = worldNormals[targetIndex][hitTriangles]
+            else:
+                closestFaceNormals[rayIndices] = geometry_cache.getWorldNormals(geometry, matrix, inverseMatrices[targetIndex], hitTriangles)
 
-        # if there was a hit and it is closer to the origin, update closest hit
-        # but we need a workaround for rounding errors:
-        # sometimes when we fire a ray from an object, that ray immediately hits that
-        # same object again, so we just ignore it
-        if distance is not None and distance < closestDistance:
-            if debugOutput:
-                print("Old hit ", closestLocation, closestFaceNormal, closestFaceIndex, closestDistance, closestTarget)
-                print("New hit ", location, faceNormal, faceIndex, distance, target)
-
-            closestLocation = location
-            closestFaceNormal = faceNormal
-            closestFaceIndex = faceIndex
-            closestDistance = distance
-            closestTarget = target
-            
-    if closestLocation is not None:
-        if debugLines:
-            addLine(origin, closestLocation)
-        
-        return hit_info.HitInfo(closestLocation, closestFaceNormal, closestFaceIndex, closestDistance, closestTarget)
-    else:
-        return None
+        isHit = closestTargets >= 0
+
+        distances[chunkStart:chunkEnd][isHit] = closestDistances[isHit]
+        locations[chunkStart:chunkEnd][isHit] = closestLocations[isHit]
+        faceIndices[chunkStart:chunkEnd][isHit] = closestFaceIndices[isHit]
+        normals[chunkStart:chunkEnd][isHit] = closestFaceNormals[isHit]
+        targetIndices[chunkStart:chunkEnd][isHit] = closestTargets[isHit]
+        triangleIndices[chunkStart:chunkEnd][isHit] = closestTriangleIndices[isHit]
+        barycentrics[chunkStart:chunkEnd][isHit] = closestBarycentrics[isHit]
+        uvs[chunkStart:chunkEnd][isHit] = closestUVs[isHit]
+
+        if debugOutput:
+            for chunkIndex in np.flatnonzero(isHit):
+                print("Hit ", closestLocations[chunkIndex], closestFaceNormals[chunkIndex], closestFaceIndices[chunkIndex], closestDistances[chunkIndex], targets[closestTargets[chunkIndex]].name)
+
+        if outputProgress:
+            updateProgress("Scanning scene", chunkEnd / numberOfRays)
+
+    return RayHits(distances, locations, faceIndices, normals, targetIndices, triangleIndices, barycentrics, uvs)
+
+def getHitInfo(rayHits, rayIndex, targets):
+    # convert a single entry of a ray batch into the HitInfo structure used for shading
+    hit = hit_info.HitInfo(Vector(rayHits.locations[rayIndex]), 
+                           Vector(rayHits.normals[rayIndex]), 
+                           int(rayHits.faceIndices[rayIndex]), 
+                           float(rayHits.distances[rayIndex]), 
+                           targets[rayHits.targetIndices[rayIndex]])
+
+    hit.uv = rayHits.uvs[rayIndex]
+
+    return hit
 
 # remove invalid characters
 # source https://blender.stackexchange.com/a/104877
@@ -202,6 +441,10 @@ def startScan(context, dependencies_installed, properties, objectName):
                                         x.active_material != None # only consider targets with a material set
                                 , bpy.context.scene.objects))
 
+        # particles and other instances are not part of the scene's objects, they share the geometry
+        # of the instanced object and are scanned without making them real
+        allTargets.extend(instances.getInstanceTargets(context.evaluated_depsgraph_get()))
+
     if properties.scannerObject == None:
         print("No scanner object selected!")
         return {'FINISHED'}   
@@ -210,34 +453,36 @@ def startScan(context, dependencies_installed, properties, objectName):
             startTime = time.time()
 
     targets = []
+
+    # the face->material mapping of each target, filled together with the BVH trees as
+    # it has to match the evaluated geometry (including all modifiers)
     materialMappings = {}
 
     for target in allTargets:
-        # we need to know which material belongs to which face, get the mapping for each target
+        # we need to know which material belongs to which face
         if len(target.material_slots) == 0:
             if properties.debugOutput:
                 print("No material set for object %s! Skipping..." % target.name)
             continue
-        
-        # Blender's modifiers can change an objetc's shape although it seems
-        # already modified in the viewport
-        # so wen need to apply all modifiers here
-        context.view_layer.objects.active = target
-
-        for modifier in target.modifiers:
-            bpy.ops.object.modifier_apply(apply_as='DATA', modifier=modifier.name)
 
+        # Blender's modifiers can change an objetc's shape although it seems
+        # already modified in the viewport, the scanners read the evaluated geometry
+        # so the modifiers don't have to be applied
         targets.append(target)
 
-        # get the face->material mappings for the current object
-        materialMappings[target] = material_helper.getFaceMaterialMapping(target.data)
+    (categoryIDs, partIDs, targetIDs) = getTargetIndices(targets, properties.debugOutput)
 
-    (categoryIDs, partIDs) = getTargetIndices(targets, properties.debugOutput)
+    # resolve the material of each slot once, the hits only look up their row
+    materialTable = material_helper.compileMaterialTable(targets, properties.debugOutput)
 
     if properties.debugOutput:
         print("CategoryIDs ", categoryIDs)
         print("PartIDs ", partIDs)
 
+    # one seeded generator draws the noise of all frames, so the scan can be reproduced
+    noiseGenerator = error_distribution.NoiseGenerator(properties.noiseSeed)
+    print("Noise seed: %d" % noiseGenerator.seed)
+
     if properties.scannerType == ScannerType.sideScan.name:
         if properties.scannerObject.matrix_world.translation.z > properties.surfaceHeight:
             print("ERROR: Sensor is above water level!")
@@ -264,14 +509,14 @@ def startScan(context, dependencies_installed, properties, objectName):
                     properties.fovSonar, properties.sonarStepDegree, properties.sonarMode3D, properties.sonarKeepRotation,
                     properties.sourceLevel, properties.noiseLevel, properties.directivityIndex, properties.processingGain, properties.receptionThreshold,   
                     properties.simulateWaterProfile, depthList,   
-                    properties.addNoise, properties.noiseType, properties.mu, properties.sigma, properties.addConstantNoise, properties.noiseAbsoluteOffset, properties.noiseRelativeOffset,
+                    properties.addNoise, properties.noiseType, properties.mu, properties.sigma, properties.addConstantNoise, properties.noiseAbsoluteOffset, properties.noiseRelativeOffset, noiseGenerator,
                     properties.addMesh,
                     properties.exportLAS and dependencies_installed, properties.exportHDF and dependencies_installed, properties.exportCSV, properties.exportSingleFrames,
                     properties.dataFilePath, cleanedFileName,
                     properties.debugLines, properties.debugOutput, properties.outputProgress, properties.measureTime, properties.singleRay, properties.destinationObject, properties.targetObject,
                     properties.enableAnimation, properties.frameStart, properties.frameEnd, properties.frameStep,
-                    targets, materialMappings,
-                    categoryIDs, partIDs)
+                    targets, materialMappings, materialTable,
+                    categoryIDs, partIDs, targetIDs)
 
     else:
         if properties.enableAnimation:
@@ -337,11 +582,45 @@ def startScan(context, dependencies_installed, properties, objectName):
         # array to store hit information
         # we don't know how many of our rays will actually hit an object, so we allocate
         # memory for the worst case of every ray hitting the scene
-        # (TODO depending on the RAM usage, it might be a good idea to use some kind of caching/splitting)
-        scannedValues = np.full(len(frameRange) * totalNumberOfRays, None, dtype=hit_info.HitInfo)
+        if properties.exportSingleFrames:
+            # each frame is exported on its own, so the buffer only has to hold one frame
+            bufferSize = totalNumberOfRays
+        elif properties.streamExport:
+            # the hits are written to disk whenever the next frame might not fit into
+            # the buffer anymore, so the memory doesn't grow with the number of frames
+            bufferSize = max(properties.chunkSize, totalNumberOfRays)
+        else:
+            # all frames are exported at once in the end
+            bufferSize = len(frameRange) * totalNumberOfRays
+
+        # the noise columns are only needed if the scanner calculates noise,
+        # the same flag decides if they are exported
+        exportNoiseData = properties.addNoise or properties.simulateRain or properties.addConstantNoise
+
+        scannedValues = hit_info.createHitBuffer(bufferSize, exportNoiseData)
 
         startIndex = 0
 
+        chunkExporter = None
+
+        if properties.streamExport and not properties.exportSingleFrames:
+            if properties.addMesh or properties.exportYCB:
+                print("WARNING: Meshes and YCB data need all hits at once and are not exported in streaming mode!")
+
+            if (properties.exportLAS and dependencies_installed) or (properties.exportHDF and dependencies_installed) or properties.exportCSV:
+                chunkExporter = exporter.ChunkExporter(properties.dataFilePath, "%s_frames_%d_to_%d" % (cleanedFileName, firstFrame, lastFrame), cleanedFileName, targets, exportNoiseData,
+                                                       properties.exportLAS and dependencies_installed, properties.exportHDF and dependencies_installed, properties.exportCSV,
+                                                       fileNameExtra="_frames_%d_to_%d_merged" % (firstFrame, lastFrame), noiseSeed=noiseGenerator.seed)
+
+        # the ray directions and the mesh data can be stored on disk
+        if properties.cacheDirectory:
+            cacheDirectory = bpy.path.abspath(properties.cacheDirectory)
+
+            # keep the cache directory from growing with every scanned mesh
+            geometry_cache.cleanCacheDirectory(cacheDirectory)
+        else:
+            cacheDirectory = ""
+
         # graph needed for BVH tree
         depsgraph = context.evaluated_depsgraph_get()
 
@@ -350,8 +629,6 @@ def startScan(context, dependencies_installed, properties, objectName):
         for frameNumber in frameRange:
             print("Rendering frame %d..." % frameNumber)
 
-            trees = generic.getBVHTrees(trees, targets, depsgraph)
-
             halfFOV = properties.fovX / 2.0
 
             # get the angle which the sensor needs to cover in the current frame
@@ -370,29 +647,50 @@ def startScan(context, dependencies_installed, properties, objectName):
                 # be updated before calculating the point data!
                 bpy.context.scene.frame_set(frameNumber)
 
+            # the trees have to be updated after the frame is set, otherwise we would scan the
+            # targets at their positions in the previous frame
+            trees = generic.getBVHTrees(trees, targets, depsgraph, materialMappings, cacheDirectory)
+
+            if properties.exportSingleFrames:
+                # the hits of the last frame are already exported
+                startIndex = 0
+            elif properties.streamExport and startIndex + totalNumberOfRays > len(scannedValues):
+                # the buffer might overflow in this frame, so write the collected hits to disk
+                # and start again at the beginning of the buffer
+                if chunkExporter is not None:
+                    chunkExporter.write(scannedValues[:startIndex])
+
+                startIndex = 0
+
             numberOfHits = lidar.performScan(context, 
                                 properties.scannerType, properties.scannerObject,
                                 properties.reflectivityLower, properties.distanceLower, properties.reflectivityUpper, properties.distanceUpper, properties.maxReflectionDepth,
                                 intervalStart, intervalEnd, properties.fovX, stepsX, properties.fovY, stepsY, properties.resolutionPercentage,
                                 scannedValues, startIndex,
                                 firstFrame, lastFrame, frameNumber, properties.rotationsPerSecond,
-                                properties.addNoise, properties.noiseType, properties.mu, properties.sigma, properties.addConstantNoise, properties.noiseAbsoluteOffset, properties.noiseRelativeOffset,
+                                properties.addNoise, properties.noiseType, properties.mu, properties.sigma, properties.addConstantNoise, properties.noiseAbsoluteOffset, properties.noiseRelativeOffset, noiseGenerator,
                                 properties.simulateRain, properties.rainfallRate,
                                 properties.simulateDust, properties.particleRadius, properties.particlesPcm, properties.dustCloudLength, properties.dustCloudStart,
+                                properties.simulateKinect, properties.kinectBaseline, properties.kinectFocalLength, properties.kinectDisparitySteps, properties.kinectMaxIncidenceAngle, properties.simulateProjectorShadows,
                                 properties.addMesh and properties.exportSingleFrames,
                                 properties.exportLAS and dependencies_installed and properties.exportSingleFrames, properties.exportHDF and dependencies_installed and properties.exportSingleFrames, properties.exportCSV and properties.exportSingleFrames, 
                                 properties.exportRenderedImage, properties.exportSegmentedImage, properties.exportPascalVoc and dependencies_installed, properties.exportDepthmap, properties.depthMinDistance, properties.depthMaxDistance, 
                                 properties.dataFilePath, cleanedFileName,
                                 properties.debugLines, properties.debugOutput, properties.outputProgress, properties.measureTime, properties.singleRay, properties.destinationObject, properties.targetObject,
-                                targets, materialMappings,
-                                categoryIDs, partIDs, trees, depsgraph)
+                                properties.numberOfWorkers, properties.tileSize, cacheDirectory,
+                                targets, materialMappings, materialTable,
+                                categoryIDs, partIDs, targetIDs, trees, depsgraph)
 
             startIndex += numberOfHits
 
         # reset view mode
         # bpy.context.area.type = mode
         
-        if not properties.exportSingleFrames:
+        if chunkExporter is not None:
+            # write the remaining hits
+            chunkExporter.write(scannedValues[:startIndex])
+            chunkExporter.close()
+        elif not properties.exportSingleFrames and not properties.streamExport:
             # we now have the final number of hits so we could shrink the array here
             # as explained here (https://stackoverflow.com/a/32398318/13440564), resizing
             # would cause a copy, so we slice the array instead
@@ -401,15 +699,13 @@ def startScan(context, dependencies_installed, properties, objectName):
             if properties.addMesh:
                 addMeshToScene("real_values_frames_%d_to_%d" % (firstFrame, lastFrame), slicedScannedValues, False)
 
-                if (properties.addNoise or properties.simulateRain):
+                if exportNoiseData:
                     addMeshToScene("noise_values_frames_%d_to_%d" % (firstFrame, lastFrame), slicedScannedValues, True)
 
-            exportNoiseData = properties.addNoise or properties.simulateRain
-
             if len(slicedScannedValues) > 0:
                 # setup exporter with our data
                 if (properties.exportYCB and dependencies_installed) or (properties.exportLAS and dependencies_installed) or (properties.exportHDF and dependencies_installed) or (properties.exportCSV and dependencies_installed):
-                    fileExporter = exporter.Exporter(properties.dataFilePath, "%s_frames_%d_to_%d" % (cleanedFileName, firstFrame, lastFrame), cleanedFileName, slicedScannedValues, targets, categoryIDs, partIDs, materialMappings, exportNoiseData, stepsX, stepsY)
+                    fileExporter = exporter.Exporter(properties.dataFilePath, "%s_frames_%d_to_%d" % (cleanedFileName, firstFrame, lastFrame), cleanedFileName, slicedScannedValues, targets, categoryIDs, partIDs, materialMappings, exportNoiseData, stepsX, stepsY, noiseSeed=noiseGenerator.seed)
 
                     print(fileExporter.fileName)
 
@@ -430,27 +726,66 @@ def startScan(context, dependencies_installed, properties, objectName):
     if properties.measureTime:
         print("Scan time: %s s" % (time.time() - startTime))
 
-def getBVHTrees(trees, targets, depsgraph):
+# per target: the BVH tree in object space, the geometry it was built from (see geometry_cache.MeshGeometry),
+# the world matrix and its inverse (as arrays), the world space bounding box (min, max)
+# which is used to skip targets a ray can't hit and the world space normal of each triangle (None for instances)
+TreeInfo = namedtuple('TreeInfo', 'tree geometry matrixWorld inverseMatrixWorld bounds worldNormals')
+
+def getWorldBounds(target, depsgraph):
+    # the bounding box of the evaluated object also contains the changes of all modifiers
+    evaluatedTarget = target.evaluated_get(depsgraph)
+
+    corners = np.array([corner[:] for corner in evaluatedTarget.bound_box], dtype=np.float64)
+    matrixWorld = np.array(target.matrix_world, dtype=np.float64)
+
+    worldCorners = corners @ matrixWorld[:3, :3].T + matrixWorld[:3, 3]
+
+    boundsMin = worldCorners.min(axis=0)
+    boundsMax = worldCorners.max(axis=0)
+
+    # grow the box a little bit, so rounding errors can't make us miss flat objects
+    margin = 1e-6 * (1.0 + np.abs(boundsMax - boundsMin).max())
+
+    return np.array([boundsMin - margin, boundsMax + margin])
+
+def getBVHTrees(trees, targets, depsgraph, materialMappings, cacheDirectory=""):
+    # instances move with their instancer (e.g. particles), so get their current transforms
+    instances.updateInstanceTargets(targets, depsgraph)
+
+    # all instances of an object share one tree, also if its geometry has to be read again in every frame
+    geometries = {}
+
     for target in targets:
-        # check if the target is already in the tree map
-        if target in trees:
-            # if so, get the old values
-            (existingTree, matrix_world) = trees[target]
-
-            # if the object did not change its world matrix, we
-            # don't have to recompute the tree
-            if matrix_world == target.matrix_world:
-                continue
-
-        # the easy way would be to use this function, but then we would have to transform all
-        # coordinates into the object's local coordinate system
-        #trees[target] = BVHTree.FromObject(target, depsgraph)
-        
-        # source: https://developer.blender.org/T57861
-        bm = bmesh.new()
-        bm.from_object(target, depsgraph=depsgraph)
-        bm.transform(target.matrix_world)
-        
-        trees[target] = (BVHTree.FromBMesh(bm), target.matrix_world.copy())
+        # the trees only depend on the geometry, so rigid motion of the target
+        # just needs new matrices and bounds, not a new tree
+        if not target.original in geometries:
+            geometries[target.original] = geometry_cache.getGeometry(target, depsgraph, cacheDirectory)
+
+        geometry = geometries[target.original]
+
+        matrixWorld = np.array(target.matrix_world, dtype=np.float64)
+        inverseMatrixWorld = np.linalg.inv(matrixWorld)
+
+        if instances.isVisible(target):
+            bounds = getWorldBounds(target, depsgraph)
+        else:
+            bounds = instances.getEmptyBounds()
+
+        # the world space normals only change with the geometry or the transform
+        previousTree = trees.get(target)
+
+        if isinstance(target, instances.TargetInstance):
+            # a table per instance would need the memory of all instanced triangles, so the
+            # normals of instances are only transformed for the triangles which are hit
+            worldNormals = None
+        elif previousTree is not None and previousTree.geometry is geometry and np.array_equal(previousTree.matrixWorld, matrixWorld):
+            worldNormals = previousTree.worldNormals
+        else:
+            worldNormals = geometry_cache.getWorldNormals(geometry, matrixWorld, inverseMatrixWorld)
+
+        trees[target] = TreeInfo(geometry.tree, geometry, matrixWorld, inverseMatrixWorld, bounds, worldNormals)
+
+        # the polygons of the evaluated geometry might differ from the ones of the mesh datablock
+        materialMappings[target] = geometry.materialIndices
     
-    return trees
\ No newline at end of file
+    return trees
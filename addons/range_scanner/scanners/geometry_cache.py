@@ -0,0 +1,409 @@
+import bpy
+import hashlib
+import os
+import shutil
+from bpy.app.handlers import persistent
+from collections import namedtuple
+from mathutils.bvhtree import BVHTree
+import numpy as np
+
+# the geometry of a mesh in object space:
+#   tree:               BVH tree over all triangles
+#   vertices:           (V, 3) vertex coordinates
+#   triangles:          (T, 3) vertex indices of each triangle
+#   trianglePolygons:   (T,) index of the polygon each triangle belongs to
+#   materialIndices:    (P,) material slot index of each polygon
+#   triangleLoops:      (T, 3) loop (face corner) indices of each triangle
+#   loopUVs:            (L, 2) UV coordinates of each loop in the active UV map, empty without UV map
+#   triangleNormals:    (T, 3) normal of each triangle (not stored in the disk cache)
+MeshGeometry = namedtuple('MeshGeometry', 'tree vertices triangles trianglePolygons materialIndices triangleLoops loopUVs triangleNormals')
+
+# evaluated geometry of all scanned meshes, keyed by the mesh datablock or, for deformed objects, by the object
+# moving, rotating or scaling an object doesn't change its geometry, so animated objects
+# and repeated scans of the same scene only build each tree once
+meshGeometries = {}
+
+# names of all materials in the file, None if they have to be read again
+materialNames = None
+
+# the arrays which are stored in the disk cache
+cachedArrays = ('vertices', 'triangles', 'trianglePolygons', 'materialIndices', 'triangleLoops', 'loopUVs')
+
+# has to be increased whenever the cached arrays or the cache key change, so old cache folders are not used anymore
+cacheVersion = 4
+
+# the least recently used meshes are deleted from the cache directory once it needs more space than this (in bytes)
+maxDiskCacheSize = 4 * 1024 * 1024 * 1024
+
+def isDeformed(target):
+    # the evaluated geometry of these objects (modifiers, shape keys) does not only
+    # depend on the mesh datablock, but also on the object and the current frame
+    return len(target.modifiers) > 0 or target.data.shape_keys is not None
+
+def getGeometryKey(target):
+    if isDeformed(target):
+        # instances of a deformed object share its evaluated geometry
+        return ('object', target.original.as_pointer())
+
+    # all objects using the same mesh share the same geometry
+    return ('mesh', target.data.as_pointer())
+
+def getFingerprint(target):
+    # a new mesh might get the memory (and so the pointer) of a deleted one, so
+    # we also compare some cheap properties before reusing cached data
+    mesh = target.data
+
+    return (mesh.name_full, len(mesh.vertices), len(mesh.polygons), len(target.modifiers))
+
+def readMaterialIndices(mesh):
+    # https://blender.stackexchange.com/a/52429/95167
+    # read all material indices at once instead of looping over the polygons
+    # (int32 matches Blender's internal type, so foreach_get can copy the values directly)
+    materialIndices = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get('material_index', materialIndices)
+
+    return materialIndices
+
+def readLoopUVs(mesh):
+    # get active uv layer data
+    uvLayer = mesh.uv_layers.active
+
+    if uvLayer is None:
+        return np.empty((0, 2), dtype=np.float32)
+
+    loopUVs = np.empty((len(mesh.loops), 2), dtype=np.float32)
+    uvLayer.data.foreach_get('uv', loopUVs.ravel())
+
+    return loopUVs
+
+def readHashedArrays(mesh):
+    # the arrays which identify the geometry of a mesh, they are read with foreach_get anyway
+    # see: https://docs.blender.org/api/current/bpy.types.bpy_prop_collection.html#bpy.types.bpy_prop_collection.foreach_get
+    vertices = np.empty((len(mesh.vertices), 3), dtype=np.float32)
+    mesh.vertices.foreach_get('co', vertices.ravel())
+
+    loopVertices = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get('vertex_index', loopVertices)
+
+    loopStarts = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get('loop_start', loopStarts)
+
+    return {
+        'vertices': vertices,
+        'loopVertices': loopVertices,
+        'loopStarts': loopStarts,
+        'materialIndices': readMaterialIndices(mesh),
+        'loopUVs': readLoopUVs(mesh),
+    }
+
+def getCacheKey(hashedArrays):
+    # the content hash identifies the same geometry across Blender sessions and files,
+    # no matter if the file was saved or the mesh was imported just now
+    meshHash = hashlib.sha1()
+
+    for name in sorted(hashedArrays):
+        values = hashedArrays[name]
+
+        # the shape is part of the key, so the arrays can't be shifted into each other
+        meshHash.update(("%s%s" % (name, values.shape)).encode())
+        meshHash.update(values.tobytes())
+
+    return meshHash.hexdigest()
+
+def readMeshArrays(mesh, hashedArrays=None):
+    if hashedArrays is None:
+        hashedArrays = readHashedArrays(mesh)
+
+    # the BVH tree is built from triangles, so every polygon is split up
+    mesh.calc_loop_triangles()
+
+    triangles = np.empty((len(mesh.loop_triangles), 3), dtype=np.int32)
+    mesh.loop_triangles.foreach_get('vertices', triangles.ravel())
+
+    trianglePolygons = np.empty(len(mesh.loop_triangles), dtype=np.int32)
+    mesh.loop_triangles.foreach_get('polygon_index', trianglePolygons)
+
+    # per corner attributes (UVs, vertex colors, split normals) are stored per loop
+    triangleLoops = np.empty((len(mesh.loop_triangles), 3), dtype=np.int32)
+    mesh.loop_triangles.foreach_get('loops', triangleLoops.ravel())
+
+    return {
+        'vertices': hashedArrays['vertices'],
+        'triangles': triangles,
+        'trianglePolygons': trianglePolygons,
+        'materialIndices': hashedArrays['materialIndices'],
+        'triangleLoops': triangleLoops,
+        'loopUVs': hashedArrays['loopUVs'],
+    }
+
+# the arrays which are not part of the cache key, they need the triangulation of the mesh
+triangulatedArrays = ('triangles', 'trianglePolygons', 'triangleLoops')
+
+def loadMeshArrays(cacheFolder, hashedArrays):
+    # the arrays are memory mapped, so only the parts which are needed are read from disk
+    try:
+        arrays = {name: np.load(os.path.join(cacheFolder, "%s.npy" % name), mmap_mode='r') for name in triangulatedArrays}
+    except (OSError, ValueError):
+        return None
+
+    # the modification time marks the recently used folders for cleanCacheDirectory
+    try:
+        os.utime(cacheFolder)
+    except OSError:
+        pass
+
+    arrays.update((name, hashedArrays[name]) for name in cachedArrays if name not in triangulatedArrays)
+
+    return arrays
+
+def saveMeshArrays(cacheFolder, arrays):
+    # several Blender processes might scan the same mesh at the same time, so the files are
+    # written into a temporary folder which is renamed in one step once it is complete
+    temporaryFolder = "%s_%d.tmp" % (cacheFolder, os.getpid())
+    os.makedirs(temporaryFolder, exist_ok=True)
+
+    for name in triangulatedArrays:
+        np.save(os.path.join(temporaryFolder, "%s.npy" % name), arrays[name])
+
+    try:
+        os.rename(temporaryFolder, cacheFolder)
+    except OSError:
+        # another process was faster
+        shutil.rmtree(temporaryFolder, ignore_errors=True)
+
+def getTriangleNormals(vertices, triangles):
+    # same orientation as the normals returned by BVHTree.ray_cast
+    corners = vertices[triangles].astype(np.float64)
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normals /= np.linalg.norm(normals, axis=1)[:, np.newaxis]
+
+    # degenerated triangles can't be hit anyway
+    return np.nan_to_num(normals).astype(np.float32)
+
+def getWorldNormals(geometry, matrixWorld, inverseMatrixWorld, triangleIndices=slice(None)):
+    # normals are transformed with the inverse transpose matrix, so they are also correct
+    # for non-uniform scaling, parents and constraints
+    normals = geometry.triangleNormals[triangleIndices] @ inverseMatrixWorld[:3, :3].astype(np.float32)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normals /= np.linalg.norm(normals, axis=1)[:, np.newaxis]
+
+    return np.nan_to_num(normals)
+
+def buildGeometry(arrays):
+    # the tree's face indices are triangle indices, they are mapped to polygons with trianglePolygons
+    # see: https://docs.blender.org/api/current/mathutils.bvhtree.html#mathutils.bvhtree.BVHTree.FromPolygons
+    tree = BVHTree.FromPolygons(arrays['vertices'].tolist(), arrays['triangles'].tolist(), all_triangles=True)
+
+    return MeshGeometry(tree, *(arrays[name] for name in cachedArrays), getTriangleNormals(arrays['vertices'], arrays['triangles']))
+
+def readGeometry(target, depsgraph, hashedArrays=None):
+    # the evaluated object contains the changes of all modifiers
+    evaluatedTarget = target.evaluated_get(depsgraph)
+    mesh = evaluatedTarget.to_mesh()
+
+    try:
+        arrays = readMeshArrays(mesh, hashedArrays)
+    finally:
+        evaluatedTarget.to_mesh_clear()
+
+    return arrays
+
+def loadGeometry(target, depsgraph, cacheDirectory):
+    # only meshes without modifiers and shape keys are stored on disk, their evaluated geometry is the mesh itself,
+    # so the key is hashed from the arrays of the mesh datablock
+    # a cache hit skips the evaluation, to_mesh and the triangulation with its foreach_get calls,
+    # the BVH tree can't be stored and is always built again from the cached arrays
+    if not cacheDirectory:
+        return buildGeometry(readGeometry(target, depsgraph))
+
+    hashedArrays = readHashedArrays(target.data)
+
+    cacheFolder = os.path.join(cacheDirectory, "mesh_v%d_%s" % (cacheVersion, getCacheKey(hashedArrays)))
+
+    arrays = loadMeshArrays(cacheFolder, hashedArrays)
+
+    if arrays is None:
+        # the evaluated mesh has the same vertices, loops and polygons, so they are not read again
+        arrays = readGeometry(target, depsgraph, hashedArrays)
+        saveMeshArrays(cacheFolder, arrays)
+
+    return buildGeometry(arrays)
+
+def getGeometry(target, depsgraph, cacheDirectory=""):
+    # the geometry is a snapshot of the evaluated mesh, so the modifiers don't need to be applied
+    key = getGeometryKey(target)
+    fingerprint = getFingerprint(target)
+
+    if key not in meshGeometries or meshGeometries[key][1] != fingerprint:
+        if isDeformed(target):
+            # deformed objects might change in every frame, so they are only kept in memory
+            meshGeometries[key] = (buildGeometry(readGeometry(target, depsgraph)), fingerprint)
+        else:
+            meshGeometries[key] = (loadGeometry(target, depsgraph, cacheDirectory), fingerprint)
+
+    return meshGeometries[key][0]
+
+def getCacheEntries(cacheDirectory):
+    # (path, size, last use) of the mesh folders and ray tables in the cache directory
+    entries = []
+
+    for entry in os.scandir(cacheDirectory):
+        if entry.name.endswith(".tmp"):
+            # written by a running scan
+            continue
+
+        try:
+            if entry.is_dir():
+                size = sum(file.stat().st_size for file in os.scandir(entry.path))
+            else:
+                size = entry.stat().st_size
+
+            entries.append((entry.path, size, entry.stat().st_mtime))
+        except OSError:
+            # removed by another process in the meantime
+            continue
+
+    return entries
+
+def cleanCacheDirectory(cacheDirectory, maxSize=maxDiskCacheSize):
+    # the cache directory would grow with every edited mesh, so the folders of old cache versions
+    # and the least recently used entries are deleted before each scan
+    if not cacheDirectory or not os.path.isdir(cacheDirectory):
+        return
+
+    currentPrefix = "mesh_v%d_" % cacheVersion
+
+    entries = []
+
+    for (path, size, lastUse) in getCacheEntries(cacheDirectory):
+        name = os.path.basename(path)
+
+        if name.startswith("mesh_v") and not name.startswith(currentPrefix):
+            shutil.rmtree(path, ignore_errors=True)
+        elif name.startswith("mesh_v") or name.startswith("rays_"):
+            entries.append((path, size, lastUse))
+
+    cacheSize = sum(size for (_, size, _) in entries)
+
+    for (path, size, _) in sorted(entries, key=lambda entry: entry[2]):
+        if cacheSize <= maxSize:
+            break
+
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+        cacheSize -= size
+
+def getBarycentricWeights(geometry, triangleIndices, points):
+    # barycentric coordinates of points (in object space) on the given triangles
+    # see: Christer Ericson, Real-Time Collision Detection, p. 47
+    corners = geometry.vertices[geometry.triangles[triangleIndices]].astype(np.float64)
+
+    edge0 = corners[:, 1] - corners[:, 0]
+    edge1 = corners[:, 2] - corners[:, 0]
+    offsets = points - corners[:, 0]
+
+    d00 = np.einsum('ij,ij->i', edge0, edge0)
+    d01 = np.einsum('ij,ij->i', edge0, edge1)
+    d11 = np.einsum('ij,ij->i', edge1, edge1)
+    d20 = np.einsum('ij,ij->i', offsets, edge0)
+    d21 = np.einsum('ij,ij->i', offsets, edge1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        denominator = d00 * d11 - d01 * d01
+
+        v = (d11 * d20 - d01 * d21) / denominator
+        w = (d00 * d21 - d01 * d20) / denominator
+
+    weights = np.column_stack((1.0 - v - w, v, w))
+
+    # degenerated triangles have no area, all corners get the same weight
+    weights[~np.isfinite(weights).all(axis=1)] = 1.0 / 3.0
+
+    return weights
+
+def interpolateCorners(geometry, loopValues, triangleIndices, weights):
+    # interpolate any per loop attribute (UVs, vertex colors, split normals) at the hit points
+    return np.einsum('ij,ijk->ik', weights, loopValues[geometry.triangleLoops[triangleIndices]])
+
+def getMaterialNames():
+    global materialNames
+
+    if materialNames is None:
+        materialNames = [material.name for material in bpy.data.materials]
+
+    return materialNames
+
+def clear():
+    global materialNames
+
+    meshGeometries.clear()
+    materialNames = None
+
+@persistent
+def onDepsgraphUpdate(scene, depsgraph):
+    global materialNames
+
+    # materials were added, removed or renamed
+    if depsgraph.id_type_updated('MATERIAL'):
+        materialNames = None
+
+    # drop the cached data of all meshes and objects which were edited
+    # (changing a modifier or assigning another material to a face is also a geometry update)
+    for update in depsgraph.updates:
+        if not update.is_updated_geometry:
+            continue
+
+        changedID = update.id.original
+
+        if isinstance(changedID, bpy.types.Object):
+            if changedID.type != 'MESH':
+                continue
+
+            meshGeometries.pop(('object', changedID.as_pointer()), None)
+
+            changedID = changedID.data
+
+        if isinstance(changedID, bpy.types.Mesh):
+            meshGeometries.pop(('mesh', changedID.as_pointer()), None)
+
+@persistent
+def onFrameChange(scene, *args):
+    # modifiers and shape keys might be animated, so the deformed objects have to be read again
+    for key in [key for key in meshGeometries if key[0] == 'object']:
+        del meshGeometries[key]
+
+@persistent
+def clearOnLoad(dummy):
+    clear()
+
+def register():
+    if onDepsgraphUpdate not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(onDepsgraphUpdate)
+
+    if onFrameChange not in bpy.app.handlers.frame_change_post:
+        bpy.app.handlers.frame_change_post.append(onFrameChange)
+
+    # loading another file invalidates all pointers
+    if clearOnLoad not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(clearOnLoad)
+
+def unregister():
+    if onDepsgraphUpdate in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(onDepsgraphUpdate)
+
+    if onFrameChange in bpy.app.handlers.frame_change_post:
+        bpy.app.handlers.frame_change_post.remove(onFrameChange)
+
+    if clearOnLoad in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(clearOnLoad)
+
+    clear()
@@ -1,3 +1,5 @@
+import numpy as np
+
 class HitInfo:
     def __init__(self, location, faceNormal, faceIndex, distance, target):
         self.location = location
@@ -16,5 +18,62 @@ class HitInfo:
         self.x = None
         self.y = None
 
+        # texture coordinates at the hit location
+        self.uv = None
+
         self.partID = None
-        self.categoryID = None
\ No newline at end of file
+        self.categoryID = None
+
+# all hits of a scan are stored in one structured array with one row (48 bytes) per hit,
+# the exporters read whole columns (e.g. hits['distance']) instead of the attributes of
+# every single HitInfo object, hits['location'] etc. are (N, 3) views without a copy
+# the target of a hit is stored as index into the list of scanned targets
+hitDataType = np.dtype([
+    ('location', np.float32, (3,)),
+    ('distance', np.float32),
+    ('intensity', np.float32),
+    ('color', np.float32, (3,)),
+    ('categoryID', np.int32),
+    ('partID', np.int32),
+    ('pixelX', np.uint16),
+    ('pixelY', np.uint16),
+    ('targetIndex', np.int32),
+])
+
+# the noise columns (16 bytes per hit) are only part of the buffer if noise is calculated
+noiseDataType = np.dtype(hitDataType.descr + [
+    ('noiseLocation', np.float32, (3,)),
+    ('noiseDistance', np.float32),
+])
+
+def createHitBuffer(size, withNoise=True):
+    if withNoise:
+        return np.zeros(size, dtype=noiseDataType)
+
+    return np.zeros(size, dtype=hitDataType)
+
+def hasNoiseColumns(hits):
+    return 'noiseLocation' in hits.dtype.names
+
+def storeHit(hits, index, hit, targetIndex):
+    row = hits[index]
+
+    row['location'] = hit.location
+    row['distance'] = hit.distance
+    row['intensity'] = hit.intensity
+    row['color'] = hit.color[:3]
+
+    # noise data is only calculated if it is exported
+    if hit.noiseLocation is not None and hasNoiseColumns(hits):
+        row['noiseLocation'] = hit.noiseLocation
+        row['noiseDistance'] = hit.noiseDistance
+
+    row['categoryID'] = hit.categoryID
+    row['partID'] = hit.partID
+
+    # sonar hits don't belong to an image pixel
+    if hit.x is not None:
+        row['pixelX'] = hit.x
+        row['pixelY'] = hit.y
+
+    row['targetIndex'] = targetIndex
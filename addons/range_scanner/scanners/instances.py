@@ -0,0 +1,106 @@
+import numpy as np
+
+# an object which is created by an instancer (particle system, collection instance, vertex/face instancing)
+# it shares the geometry, materials and custom properties of the instanced object and only stores its own
+# transform, so there is no need to make the instances real before scanning
+class TargetInstance:
+    def __init__(self, object, key, name, matrixWorld):
+        self.object = object
+        self.key = key
+        self.name = name
+        self.matrix_world = matrixWorld
+
+        # False if the instance doesn't exist in the current frame (e.g. a dead particle)
+        self.isVisible = True
+
+        # custom properties which are set for this instance only (e.g. the categoryID fallback)
+        self.properties = {}
+
+    # mesh data, material slots, modifiers etc. come from the instanced object
+    def __getattr__(self, name):
+        return getattr(self.object, name)
+
+    @property
+    def location(self):
+        return self.matrix_world.translation
+
+    @property
+    def rotation_euler(self):
+        return self.matrix_world.to_euler()
+
+    @property
+    def scale(self):
+        return self.matrix_world.to_scale()
+
+    # custom properties behave like the ones of bpy.types.Object
+    def __contains__(self, key):
+        return key in self.properties or key in self.object
+
+    def __getitem__(self, key):
+        if key in self.properties:
+            return self.properties[key]
+
+        return self.object[key]
+
+    def __setitem__(self, key, value):
+        self.properties[key] = value
+
+    def get(self, key, default=None):
+        if key in self.properties:
+            return self.properties[key]
+
+        return self.object.get(key, default)
+
+def getInstanceKey(instance):
+    # the persistent ID identifies an instance across frames
+    # see: https://docs.blender.org/api/current/bpy.types.DepsgraphObjectInstance.html
+    return (instance.parent.original.name_full, instance.object.original.name_full, tuple(instance.persistent_id))
+
+def isScannable(object):
+    return object.type == 'MESH' and object.active_material != None
+
+def getInstanceTargets(depsgraph):
+    targets = []
+
+    for instance in depsgraph.object_instances:
+        # real objects are already part of the scene's objects
+        if not instance.is_instance:
+            continue
+
+        object = instance.object.original
+
+        if not isScannable(object):
+            continue
+
+        # the instance data is only valid during the iteration, so we need to copy the matrix
+        name = "%s[%d]" % (object.name, len(targets))
+        targets.append(TargetInstance(object, getInstanceKey(instance), name, instance.matrix_world.copy()))
+
+    return targets
+
+def updateInstanceTargets(targets, depsgraph):
+    instanceTargets = {target.key: target for target in targets if isinstance(target, TargetInstance)}
+
+    if len(instanceTargets) == 0:
+        return
+
+    for target in instanceTargets.values():
+        target.isVisible = False
+
+    # particles move from frame to frame, so the transforms have to be updated
+    for instance in depsgraph.object_instances:
+        if not instance.is_instance:
+            continue
+
+        target = instanceTargets.get(getInstanceKey(instance))
+
+        if target is not None:
+            target.matrix_world = instance.matrix_world.copy()
+            target.isVisible = True
+
+def isVisible(target):
+    return getattr(target, 'isVisible', True)
+
+def getEmptyBounds():
+    # a box with min > max is never hit by any ray
+    return np.array([np.full(3, np.inf), np.full(3, -np.inf)])
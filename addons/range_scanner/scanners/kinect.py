@@ -0,0 +1,56 @@
+import numpy as np
+
+from . import parallel
+
+# depth model of the Kinect v1 (structured light sensor)
+# see: K. Khoshelham and S. O. Elberink, "Accuracy and Resolution of Kinect Depth Data for Indoor Mapping Applications"
+#      https://doi.org/10.3390/s120201437
+
+def getPlaneDistances(locations, origin, viewDirection):
+    # the Kinect raw depth data does not measure the distance between camera lens (L)
+    # and hit point (H) -> d_1, but between the (virtual) camera plane and hit point,
+    # so we need to correct the distance
+    #
+    #   -----------------------H----
+    #             |          / |
+    #             |        /   |
+    #             |  d_1 /     |
+    #             |    /       |
+    #             |  /         |
+    #             |/           |
+    #   ----------L------------------
+    #
+    # the view direction has unit length, so the projection onto it is the distance to the plane
+    return (locations - origin) @ viewDirection
+
+def quantizeDepths(depths, baseline, focalLength, disparitySteps):
+    # the depth is calculated from the disparity between the projected and the observed pattern,
+    # which is measured in steps of 1/disparitySteps pixel, so the depth resolution decreases
+    # with the square of the distance, eq. (5)
+    disparities = baseline * focalLength / depths
+
+    quantizedDisparities = np.round(disparities * disparitySteps) / disparitySteps
+
+    # points too far away for the smallest disparity step are measured at the maximum depth
+    quantizedDisparities = np.maximum(quantizedDisparities, 1.0 / disparitySteps)
+
+    return baseline * focalLength / quantizedDisparities
+
+def getGrazingHits(directions, normals, maxIncidenceAngle):
+    # the pattern can't be observed on surfaces which are almost parallel to the rays,
+    # so there are no returns for large incidence angles
+    cosines = np.abs(np.einsum('ij,ij->i', directions, normals))
+
+    return cosines < np.cos(maxIncidenceAngle)
+
+def getProjectorShadows(targets, trees, locations, projectorOrigin, numberOfWorkers, tileSize, debugOutput):
+    # the depth can only be measured where the camera sees the pattern of the projector, which is
+    # offset by the baseline, so the surfaces hidden from the projector appear as holes next to the edges
+    # one shadow ray is cast from the projector to each hit, all of them in one batch
+    directions = locations - projectorOrigin
+    distances = np.linalg.norm(directions, axis=1)
+
+    # the rays end 1mm in front of the hits, otherwise they would find the hit surface itself
+    rayHits = parallel.castRays(targets, trees, np.broadcast_to(projectorOrigin, directions.shape), directions, distances - 0.001, numberOfWorkers, tileSize, debugOutput)
+
+    return rayHits.targetIndices >= 0
@@ -11,13 +11,15 @@ import os
 import sys
 import math, mathutils
 
-from .. import error_distribution
 from .. import material_helper
 from ..export import exporter
 from . import hit_info
 from .. import fresnel
 from ..ui import user_interface
 from . import generic
+from . import ray_generator
+from . import parallel
+from . import kinect
 
 
 # refractive index of air
@@ -25,49 +27,211 @@ from . import generic
 iorAir = 1.000293 
 
 
-def castRay(targets, trees, origin, direction, maxRange, materialMappings, depsgraph, debugLines, debugOutput, currentIOR, isInsideMaterial, remainingReflectionDepth):
-    if remainingReflectionDepth < 0:
-        return None
+# a ray of the wavefront
+# secondary rays (mirror reflections, glass reflections and refractions) are stored in the ray
+# which spawned them, so the returns can be combined after all bounces are cast
+class TracedRay:
+    def __init__(self, origin, direction, maxRange, currentIOR, isInsideMaterial, remainingReflectionDepth):
+        self.origin = origin
+        self.direction = direction
+        self.maxRange = maxRange
+        self.currentIOR = currentIOR
+        self.isInsideMaterial = isInsideMaterial
+        self.remainingReflectionDepth = remainingReflectionDepth
 
-    if debugOutput:
-        print("")
-        print("")
-        print("")
-        print("### SUBCAST ###")
-        print(origin, direction, maxRange)
+        self.closestHit = None
+
+        self.mirrorRay = None
+        self.reflectedRay = None
+        self.passthroughRay = None
+
+        # amount of light which goes through the glass
+        self.transmission = None
+
+        # the final return of the ray, set by resolveRay
+        self.result = None
+
+def spawnRay(closestHit, direction, maxRange, currentIOR, isInsideMaterial, remainingReflectionDepth):
+    # the offset is needed to push the origin 1mm in the direction of the ray as otherwise we might
+    # hit the same location again because of rounding errors
+    directionOffset = (direction.normalized() * 0.001)
+
+    return TracedRay(closestHit.location + directionOffset, direction, maxRange, currentIOR, isInsideMaterial, remainingReflectionDepth)
+
+def traceRays(rays, targets, trees, materialMappings, materialTable, depsgraph, numberOfWorkers, tileSize, debugLines, debugOutput):
+    # wavefront ray tracing: instead of following each ray recursively, the secondary rays
+    # of all hits are collected and cast together in the next wave, until no more bounces are needed
+    # the closest hits of the given (primary) rays have to be set already
+    allRays = list(rays)
+
+    wave = shadeRays(rays, materialMappings, materialTable, depsgraph, debugLines, debugOutput)
+
+    while len(wave) > 0:
+        allRays.extend(wave)
+
+        # rays which exceed the maximum reflection depth don't return anything
+        castableRays = [ray for ray in wave if ray.remainingReflectionDepth >= 0]
+
+        if len(castableRays) > 0:
+            if debugOutput:
+                print("")
+                print("### SUBCAST ###")
+                print("Casting %d secondary rays" % len(castableRays))
+
+            origins = np.array([ray.origin[:] for ray in castableRays], dtype=np.float64)
+            directions = np.array([ray.direction[:] for ray in castableRays], dtype=np.float64)
+            maxRanges = np.array([ray.maxRange for ray in castableRays], dtype=np.float64)
+
+            rayHits = parallel.castRays(targets, trees, origins, directions, maxRanges, numberOfWorkers, tileSize, debugOutput)
+
+            for rayIndex in np.flatnonzero(rayHits.targetIndices >= 0):
+                ray = castableRays[rayIndex]
+                ray.closestHit = generic.getHitInfo(rayHits, rayIndex, targets)
+
+                if debugLines:
+                    generic.addLine(ray.origin, ray.closestHit.location)
+
+        wave = shadeRays([ray for ray in castableRays if ray.closestHit is not None], materialMappings, materialTable, depsgraph, debugLines, debugOutput)
+
+    # secondary rays are always created after the ray which spawned them, so in reverse
+    # order all secondary rays of a ray are resolved before the ray itself
+    for ray in reversed(allRays):
+        ray.result = resolveRay(ray)
+
+def getNormalAngles(directions, normals):
+    # angles between the rays and the surface normals, both are given in world space
+    directions = directions / np.linalg.norm(directions, axis=1)[:, np.newaxis]
+    cosines = np.einsum('ij,ij->i', directions, normals)
+
+    return np.arccos(np.clip(cosines, -1.0, 1.0))
 
-    closestHit = generic.getClosestHit(targets, trees, origin, direction, maxRange, debugOutput, debugLines)
+def shadeRays(rays, materialMappings, materialTable, depsgraph, debugLines, debugOutput):
+    secondaryRays = []
 
-    if closestHit is not None:
-        # the normal is given in local object space, so we need to transform it to global space
-        normal = closestHit.target.rotation_euler.to_matrix() @ closestHit.faceNormal
+    if len(rays) == 0:
+        return secondaryRays
 
-        # calculate angle between our ray and the mesh surface
-        normalAngle = direction.angle(normal)
+    hits = [ray.closestHit for ray in rays]
 
-        # get the material's reflectivity properties
-        materialProperty = material_helper.getMaterialColorAndMetallic(closestHit, materialMappings, depsgraph, debugOutput)
+    # the texture colors of all hits are sampled at once
+    textureColors = material_helper.getTextureColors(hits, materialMappings, materialTable)
 
-        closestHit.color = materialProperty.color
+    # get the material's reflectivity properties
+    materialProperties = [material_helper.getMaterialColorAndMetallic(hit, materialMappings, materialTable, depsgraph, debugOutput, textureColor) for hit, textureColor in zip(hits, textureColors)]
 
-        # use simple lambert reflectance to approximate light return
-        # see: https://en.wikipedia.org/wiki/Lambertian_reflectance
-        closestHit.intensity = abs(math.cos(normalAngle)) *  material_helper.getSurfaceReflectivity(materialProperty.color)
+    # calculate angle between our rays and the mesh surfaces
+    directions = np.array([ray.direction[:] for ray in rays], dtype=np.float64)
+    normals = np.array([hit.faceNormal[:] for hit in hits], dtype=np.float64)
+    normalAngles = getNormalAngles(directions, normals)
 
+    # use simple lambert reflectance to approximate light return
+    # see: https://en.wikipedia.org/wiki/Lambertian_reflectance
+    reflectivities = np.array([material_helper.getSurfaceReflectivity(materialProperty.color) for materialProperty in materialProperties], dtype=np.float64)
+    intensities = np.abs(np.cos(normalAngles)) * reflectivities
+
+    # the amount of light which goes through glass is looked up for all glass hits of a material at once
+    # rays leaving the glass hit the back side of the face, the incidence angle is measured to the flipped normal
+    iors = np.array([materialProperty.ior for materialProperty in materialProperties], dtype=np.float64)
+    incidenceAngles = np.abs(np.pi - normalAngles)
+    incidenceAngles = np.minimum(incidenceAngles, np.pi - incidenceAngles)
+    transmissions = np.zeros(len(rays))
+
+    for ior in np.unique(iors[iors > 0.0]):
+        isMaterialHit = iors == ior
+
+        # dynamic approach: 
+        # https://www.scratchapixel.com/lessons/3d-basic-rendering/introduction-to-shading/reflection-refraction-fresnel
+        # https://refractiveindex.info/?shelf=3d&book=glass&page=BK7
+        # https://de.wikipedia.org/wiki/Brechungsindex#Brechungsindex_der_Luft_und_anderer_Stoffe
+        transmissions[isMaterialHit] = fresnel.T_unpolarized_lookup(ior, incidenceAngles[isMaterialHit], 1.000292)
+
+    for ray, materialProperty, normalAngle, intensity, transmission in zip(rays, materialProperties, normalAngles.tolist(), intensities.tolist(), transmissions.tolist()):
+        secondaryRays.extend(shadeHit(ray, materialProperty, normalAngle, intensity, transmission, debugLines, debugOutput))
+
+    return secondaryRays
+
+def shadeHit(ray, materialProperty, normalAngle, intensity, transmission, debugLines, debugOutput):
+    # shades the closest hit of the ray and returns the secondary rays it needs
+    closestHit = ray.closestHit
+    origin = ray.origin
+    direction = ray.direction
+    maxRange = ray.maxRange
+
+    # the normal is already given in world space
+    normal = closestHit.faceNormal
+
+    closestHit.color = materialProperty.color
+    closestHit.intensity = intensity
+
+    if debugOutput:
+        print("RGBA", materialProperty.color[0], materialProperty.color[1], materialProperty.color[2], materialProperty.color[3])
+        print("Metallic ", materialProperty.metallic)
+                    
+    # if the surface is 100% reflecting reflect the ray
+    # aka: recursive raytracing
+    # see: https://en.wikipedia.org/wiki/Ray_tracing_(graphics)#Recursive_ray_tracing_algorithm:~:text=rendered.-,Recursive%20ray%20tracing%20algorithm
+    if (materialProperty is not None and materialProperty.metallic == 1.0):
         if debugOutput:
-            print("RGBA", materialProperty.color[0], materialProperty.color[1], materialProperty.color[2], materialProperty.color[3])
-            print("Metallic ", materialProperty.metallic)
-                        
-        # if the surface is 100% reflecting reflect the ray
-        # aka: recursive raytracing
-        # see: https://en.wikipedia.org/wiki/Ray_tracing_(graphics)#Recursive_ray_tracing_algorithm:~:text=rendered.-,Recursive%20ray%20tracing%20algorithm
-        if (materialProperty is not None and materialProperty.metallic == 1.0):
+            print("### RESULT ###")
+            print("Hit point location: ", closestHit.location)
+            print("Normal on hit point: ", normal, closestHit.faceNormal)
+            print("Index of the tree node: ", closestHit.faceIndex)
+            print("Distance to the hit point: ", closestHit.distance)
+
+        # reflect the incoming ray with surface normal
+        # see: https://docs.blender.org/api/current/mathutils.html#mathutils.Vector.reflect
+        reflectedVec = direction.reflect(normal)
+
+        if debugLines:
+            generic.addLine(closestHit.location, closestHit.location + normal)
+            generic.addLine(origin, closestHit.location)
+            generic.addLine(closestHit.location, closestHit.location + reflectedVec)
+        
+        if debugOutput:
+            print("### REFLECTION ###")
+            print("direction: ", direction)
+            print("normal: ", normal, normal + closestHit.location)
+            print("reflected: ", reflectedVec, closestHit.location + reflectedVec)
+
+        # decrease maximum range by already travelled distance
+        newRange = maxRange - closestHit.distance
+
+        if newRange > 0.0:
+            # cast new ray from current hit point in the next wave
+            ray.mirrorRay = spawnRay(closestHit, reflectedVec, newRange, ray.currentIOR, ray.isInsideMaterial, ray.remainingReflectionDepth - 1)
+
+            return [ray.mirrorRay]
+    
+    if (materialProperty is not None and materialProperty.ior > 0.0):
+        # when hitting glass, there are 4 cases:
+        #   - the ray goes through the glas and hits the object behind
+        #   - the ray is reflected and hits an object in the reflected direction
+        #   - the glass directly reflects the ray (only for small angles)
+        #   - no hit is detected
+
+        angle = abs(np.pi - normalAngle)
+
+        # for small angles, we return the glass surface as hit
+        # see: https://ieeexplore.ieee.org/document/6630875
+        # 0.0349066 rad = 2.0 deg
+        if (abs(angle)) <= 0.0349066:
             if debugOutput:
-                print("### RESULT ###")
-                print("Hit point location: ", closestHit.location)
-                print("Normal on hit point: ", normal, closestHit.faceNormal)
-                print("Index of the tree node: ", closestHit.faceIndex)
-                print("Distance to the hit point: ", closestHit.distance)
+                print("Angle too small, returning...")
+
+            return []
+
+        if debugOutput:
+            print("### RESULT ###")
+            print("Hit point location: ", closestHit.location)
+            print("Normal on hit point: ", normal, closestHit.faceNormal)
+            print("Index of the tree node: ", closestHit.faceIndex)
+            print("Distance to the hit point: ", closestHit.distance)
+
+        # decrease maximum range by already travelled distance
+        newRange = maxRange - closestHit.distance
+
+        if newRange > 0.0:
+            secondaryRays = []
 
             # reflect the incoming ray with surface normal
             # see: https://docs.blender.org/api/current/mathutils.html#mathutils.Vector.reflect
@@ -84,179 +248,206 @@ def castRay(targets, trees, origin, direction, maxRange, materialMappings, depsg
                 print("normal: ", normal, normal + closestHit.location)
                 print("reflected: ", reflectedVec, closestHit.location + reflectedVec)
 
-            # decrease maximum range by already travelled distance
-            newRange = maxRange - closestHit.distance
+            # now we need to know how much light is reflected and how much is refracted
+            # static approach: 
+            # https://link.springer.com/content/pdf/10.1007%2F978-3-8348-2101-0.pdf, S. 604
+            # Velodyne Scanner 63-HDL64ES2g HDL-64E S2 CD HDL-64E S2 Users Manual low res, S. 39, 905nm -> IR-A (nahes Infrarot)
+            # -> 85 % transmission
 
-            if newRange > 0.0:
-                # the offset is needed to push the origin 1mm in the direction of the ray as otherwise we might
-                # hit the same location again because of rounding errors
-                directionOffset = (reflectedVec.normalized() * 0.001)    
 
-                # cast new ray from current hit point            
-                reflectedHit = castRay(targets, trees, closestHit.location + directionOffset, reflectedVec, newRange, materialMappings, depsgraph, debugLines, debugOutput, currentIOR, isInsideMaterial, remainingReflectionDepth - 1)
+            # dynamic approach: the transmission is calculated for all glass hits in shadeRays
+            ray.transmission = transmission
 
-                if reflectedHit is not None:
-                    # the scanner does not know if a ray is returned from an object's surface or a mirror
-                    # that means it assumes the returned distance was measured along the original direction vector
-                    closestHit.distance += reflectedHit.distance
+            # mirror the ray at the glass surface   
+            if not ray.isInsideMaterial:
+                ray.reflectedRay = spawnRay(closestHit, reflectedVec, newRange, ray.currentIOR, ray.isInsideMaterial, ray.remainingReflectionDepth - 1)
+                secondaryRays.append(ray.reflectedRay)
 
-                    # the hit location seems to have the color of the reflected surface
-                    closestHit.color = reflectedHit.color
-                    closestHit.intensity = material_helper.getSurfaceReflectivity(reflectedHit.color)
+            # send the ray through the glass
+            # see: https://en.wikipedia.org/wiki/Snell%27s_law
+            #      https://en.wikipedia.org/wiki/List_of_refractive_indices
+            direction = direction.normalized()
+            normal = normal.normalized()
 
-                    closestHit.wasReflected = True
-                else:
-                    return None
-        
-        if (materialProperty is not None and materialProperty.ior > 0.0):
-            # when hitting glass, there are 4 cases:
-            #   - the ray goes through the glas and hits the object behind
-            #   - the ray is reflected and hits an object in the reflected direction
-            #   - the glass directly reflects the ray (only for small angles)
-            #   - no hit is detected
-
-            angle = abs(np.pi - normalAngle)
-
-            # for small angles, we return the glass surface as hit
-            # see: https://ieeexplore.ieee.org/document/6630875
-            # 0.0349066 rad = 2.0 deg
-            if (abs(angle)) <= 0.0349066:
-                if debugOutput:
-                    print("Angle too small, returning...")
+            # check if the normal points to the same side of the face as the origin is
+            if normal.dot(direction) > 0.0:
+                normal *= -1.0
 
-                return closestHit
+            # are we going grom air to medium or from medium to air?
+            if ray.isInsideMaterial:
+                n = materialProperty.ior / iorAir
+            else:
+                n = iorAir / materialProperty.ior
+
+            # calculate new direction vector
+            # see: http://www.starkeffects.com/snells-law-vector.shtml
+            newDirection = n * (normal.cross(-normal.cross(direction))) - normal * np.sqrt(1 - (n**2) * (normal.cross(direction) @ normal.cross(direction)))
 
             if debugOutput:
-                print("### RESULT ###")
-                print("Hit point location: ", closestHit.location)
-                print("Normal on hit point: ", normal, closestHit.faceNormal)
-                print("Index of the tree node: ", closestHit.faceIndex)
-                print("Distance to the hit point: ", closestHit.distance)
+                print("### REFRACTION ###")
+                print("dot:", normal.dot(direction))
+                print("direction: ", direction)
+                print("normal: ", normal, normal + closestHit.location)
+                print("refracted: ", newDirection, closestHit.location + newDirection)
 
-            # decrease maximum range by already travelled distance
-            newRange = maxRange - closestHit.distance
+            ray.passthroughRay = spawnRay(closestHit, newDirection, newRange, materialProperty.ior, not ray.isInsideMaterial, ray.remainingReflectionDepth - 1)
+            secondaryRays.append(ray.passthroughRay)
 
-            if newRange > 0.0:
-                # reflect the incoming ray with surface normal
-                # see: https://docs.blender.org/api/current/mathutils.html#mathutils.Vector.reflect
-                reflectedVec = direction.reflect(normal)
+            return secondaryRays
+    
+    return []
 
-                if debugLines:
-                    generic.addLine(closestHit.location, closestHit.location + normal)
-                    generic.addLine(origin, closestHit.location)
-                    generic.addLine(closestHit.location, closestHit.location + reflectedVec)
-                
-                if debugOutput:
-                    print("### REFLECTION ###")
-                    print("direction: ", direction)
-                    print("normal: ", normal, normal + closestHit.location)
-                    print("reflected: ", reflectedVec, closestHit.location + reflectedVec)
-
-                # now we need to know how much light is reflected and how much is refracted
-                # static approach: 
-                # https://link.springer.com/content/pdf/10.1007%2F978-3-8348-2101-0.pdf, S. 604
-                # Velodyne Scanner 63-HDL64ES2g HDL-64E S2 CD HDL-64E S2 Users Manual low res, S. 39, 905nm -> IR-A (nahes Infrarot)
-                # -> 85 % transmission
-
-
-                # dynamic approach: 
-                # https://www.scratchapixel.com/lessons/3d-basic-rendering/introduction-to-shading/reflection-refraction-fresnel
-                # https://refractiveindex.info/?shelf=3d&book=glass&page=BK7
-                # https://de.wikipedia.org/wiki/Brechungsindex#Brechungsindex_der_Luft_und_anderer_Stoffe
-                transmission = fresnel.T_unpolarized(materialProperty.ior, angle, 1.000292)
-                reflectivity = 1 - transmission 
-
-                # mirror the ray at the glass surface   
-                if isInsideMaterial:
-                    reflectedHit = None
-                else:
-                    # the offset is needed to push the origin 1mm in the direction of the ray as otherwise we might
-                    # hit the same location again because of rounding errors
-                    directionOffset = (reflectedVec.normalized() * 0.001) 
-                    reflectedHit = castRay(targets, trees, closestHit.location + directionOffset, reflectedVec, newRange, materialMappings, depsgraph, debugLines, debugOutput, currentIOR, isInsideMaterial, remainingReflectionDepth - 1)
-
-                intensityReflected = 0.0
-                if reflectedHit is not None:
-                    reflectedHit.wasReflected = True
-                    intensityReflected = material_helper.getSurfaceReflectivity(reflectedHit.color)
-
-                    # the transmission tells us, which amount of light goes through the glass
-                    # the rest is split up between absorption and reflection (~ 50/50 -> # https://link.springer.com/content/pdf/10.1007%2F978-3-8348-2101-0.pdf, S. 605, 3-18)
-                    # as the ray is reflected at the glass twice, the value is reduced twice
-                    intensityReflected *= reflectivity * reflectivity
-
-
-
-
-                # send the ray through the glass
-                # see: https://en.wikipedia.org/wiki/Snell%27s_law
-                #      https://en.wikipedia.org/wiki/List_of_refractive_indices
-                direction = direction.normalized()
-                normal = normal.normalized()
-
-                # check if the normal points to the same side of the face as the origin is
-                if normal.dot(direction) > 0.0:
-                    normal *= -1.0
-
-                # are we going grom air to medium or from medium to air?
-                if isInsideMaterial:
-                    n = materialProperty.ior / iorAir
-                else:
-                    n = iorAir / materialProperty.ior
-
-                # calculate new direction vector
-                # see: http://www.starkeffects.com/snells-law-vector.shtml
-                newDirection = n * (normal.cross(-normal.cross(direction))) - normal * np.sqrt(1 - (n**2) * (normal.cross(direction) @ normal.cross(direction)))
+def resolveRay(ray):
+    # combines the closest hit of a ray with the returns of its secondary rays
+    closestHit = ray.closestHit
 
-                if debugOutput:
-                    print("### REFRACTION ###")
-                    print("dot:", normal.dot(direction))
-                    print("direction: ", direction)
-                    print("normal: ", normal, normal + closestHit.location)
-                    print("refracted: ", newDirection, closestHit.location + newDirection)
-
-                directionOffset = (newDirection.normalized() * 0.001)
-                passthroughHit = castRay(targets, trees, closestHit.location + directionOffset, newDirection, newRange, materialMappings, depsgraph, debugLines, debugOutput, materialProperty.ior, not isInsideMaterial, remainingReflectionDepth - 1)
-                
-                intensityPassthrough = 0.0
-                if passthroughHit is not None:
-                    intensityPassthrough = material_helper.getSurfaceReflectivity(passthroughHit.color)
+    if closestHit is None:
+        return None
+
+    if ray.mirrorRay is not None:
+        reflectedHit = ray.mirrorRay.result
 
-                    # the transmission tells us, which amount of  light goes through the glass
-                    # as the ray passes the glass twice, the value is reduced twice
-                    intensityPassthrough *= transmission * transmission
+        if reflectedHit is None:
+            return None
 
+        # the scanner does not know if a ray is returned from an object's surface or a mirror
+        # that means it assumes the returned distance was measured along the original direction vector
+        closestHit.distance += reflectedHit.distance
 
-                # decide which return is the brightest
-                if intensityPassthrough >= intensityReflected and intensityPassthrough > 0.0:
-                    # object behind the glass is the brightest
-                    closestHit.distance += passthroughHit.distance
+        # the hit location seems to have the color of the reflected surface
+        closestHit.color = reflectedHit.color
+        closestHit.intensity = material_helper.getSurfaceReflectivity(reflectedHit.color)
 
-                    closestHit.color = passthroughHit.color
-                    closestHit.intensity = intensityPassthrough
+        closestHit.wasReflected = True
 
-                    closestHit.wasReflected = True
+        return closestHit
 
-                    return closestHit
-                elif intensityReflected > intensityPassthrough:
-                    # object in the reflection is the brightest
-                    closestHit.distance += reflectedHit.distance
+    if ray.passthroughRay is not None:
+        transmission = ray.transmission
+        reflectivity = 1 - transmission 
 
-                    closestHit.color = reflectedHit.color
-                    closestHit.intensity = intensityReflected
+        reflectedHit = None
+        if ray.reflectedRay is not None:
+            reflectedHit = ray.reflectedRay.result
 
-                    closestHit.wasReflected = True
+        intensityReflected = 0.0
+        if reflectedHit is not None:
+            reflectedHit.wasReflected = True
+            intensityReflected = material_helper.getSurfaceReflectivity(reflectedHit.color)
 
-                    return closestHit
-                else:
-                    # we return None, as the sensor can't register a hit on the glass' surface
-                    return None
-        
-        return closestHit
-    
-    return None
+            # the transmission tells us, which amount of light goes through the glass
+            # the rest is split up between absorption and reflection (~ 50/50 -> # https://link.springer.com/content/pdf/10.1007%2F978-3-8348-2101-0.pdf, S. 605, 3-18)
+            # as the ray is reflected at the glass twice, the value is reduced twice
+            intensityReflected *= reflectivity * reflectivity
+
+        passthroughHit = ray.passthroughRay.result
+
+        intensityPassthrough = 0.0
+        if passthroughHit is not None:
+            intensityPassthrough = material_helper.getSurfaceReflectivity(passthroughHit.color)
+
+            # the transmission tells us, which amount of  light goes through the glass
+            # as the ray passes the glass twice, the value is reduced twice
+            intensityPassthrough *= transmission * transmission
+
+
+        # decide which return is the brightest
+        if intensityPassthrough >= intensityReflected and intensityPassthrough > 0.0:
+            # object behind the glass is the brightest
+            closestHit.distance += passthroughHit.distance
+
+            closestHit.color = passthroughHit.color
+            closestHit.intensity = intensityPassthrough
+
+            closestHit.wasReflected = True
+
+            return closestHit
+        elif intensityReflected > intensityPassthrough:
+            # object in the reflection is the brightest
+            closestHit.distance += reflectedHit.distance
+
+            closestHit.color = reflectedHit.color
+            closestHit.intensity = intensityReflected
+
+            closestHit.wasReflected = True
+
+            return closestHit
+        else:
+            # we return None, as the sensor can't register a hit on the glass' surface
+            return None
+
+    return closestHit
+
+def getMinimumReflectivities(distances, reflectivityLower, distanceLower, reflectivityUpper, distanceUpper):
+    # the minimum reflectivity a target needs to be seen by the sensor at the given distances
+    # source: https://github.com/mgschwan/blensor/blob/0b6cca9f189b1e072cfd8aaa6360deeab0b96c61/release/scripts/addons/blensor/scan_interface_pure.py#L9
+    minimumReflectivities = reflectivityLower + ((reflectivityUpper - reflectivityLower) * distances) / (distanceUpper - distanceLower)
+    minimumReflectivities[distances < distanceLower] = 0.0
+
+    return minimumReflectivities
+
+def getRainEffects(distances, rainfallRate, noiseGenerator):
+    # see https://www.researchgate.net/publication/330415308_Predicting_the_influence_of_rain_on_LIDAR_in_ADAS for details
+    # the deviation of the noise depends on the distance of each hit
+    noise = noiseGenerator.getNoise('gaussian', 0.0, 0.02 * distances * (1 - np.exp(-rainfallRate)) ** 2, len(distances)) # equation (9)
+
+    # coefficient following observation
+    backScatteringCoefficientRain = 0.01 * rainfallRate ** 0.6 # equation (5)
+
+    delta = np.exp(-2 * backScatteringCoefficientRain * distances) - 1
+
+    return (noise, delta)
+
+def getDustEffects(distances, minimumReflectivities, particleRadius, particlesPcm, dustCloudLength, dustCloudStart):
+    # see: https://www.researchgate.net/publication/313582355_When_the_Dust_Settles_The_Four_Behaviors_of_LiDAR_in_the_Presence_of_Fine_Airborne_Particulates
+    r = particleRadius * 10**(-6)
+    n = particlesPcm
+    Ld = dustCloudLength
+    Rd = dustCloudStart
+
+    # targets in front of the dust cloud -> no backscatter or reduction
+    isInCloud = distances >= Rd
+
+    beta = (r**2 * n) / 4 # eq. (31)
 
+    # light is reflected by the cloud -> the cloud front appears as solid object
+    isCloudFront = isInCloud & (beta > minimumReflectivities)
 
+    # light enters the dust cloud, for targets inside the cloud only the part in front of
+    # the target reduces the power, for targets behind it the full length of the cloud
+    isAttenuated = isInCloud & ~isCloudFront
+    relevantDustCloudLength = np.minimum(distances[isAttenuated] - Rd, Ld)
+
+    # calculate the transmission loss
+    alpha = np.ones(len(distances))
+    alpha[isAttenuated] = np.exp(-2 * np.pi * r**2 * n * relevantDustCloudLength) # eq. (32)
+
+    return (isCloudFront, alpha, beta)
+
+def removeHits(frameValues, isVisible):
+    # moves the visible hits to the front of the frame's rows and returns their number
+    # the hits are copied within the hit buffer, the remaining rows are overwritten by the next frame
+    numberOfVisibleHits = np.count_nonzero(isVisible)
+
+    if numberOfVisibleHits < len(frameValues):
+        frameValues[:numberOfVisibleHits] = frameValues[isVisible]
+
+    return numberOfVisibleHits
+
+def applyNoise(frameValues, origin, directions, noise, debugOutput):
+    # we can't simply move the hit location around by some random translation
+    # instead, we have to move it along the ray direction
+
+    # calculate distance with noise
+    noiseDistances = frameValues['distance'] + noise
+
+    # calculate the noise location of the hit point
+    frameValues['noiseLocation'] = origin + directions * noiseDistances[:, np.newaxis]
+    frameValues['noiseDistance'] = noiseDistances
+
+    if debugOutput:
+        print("Noise Distance ", noiseDistances)
+        print("Noise Location ", frameValues['noiseLocation'])
 
 def performScan(context, 
                 scannerType, scannerObject,
@@ -264,16 +455,18 @@ def performScan(context,
                 intervalStart, intervalEnd, fovX, stepsX, fovY, stepsY, percentage,
                 scannedValues, startIndex,
                 firstFrame, lastFrame, frameNumber, rotationsPerSecond,
-                addNoise, noiseType, mu, sigma, addConstantNoise, noiseAbsoluteOffset, noiseRelativeOffset,
+                addNoise, noiseType, mu, sigma, addConstantNoise, noiseAbsoluteOffset, noiseRelativeOffset, noiseGenerator,
                 simulateRain, rainfallRate, 
                 simulateDust, particleRadius, particlesPcm, dustCloudLength, dustCloudStart,
+                simulateKinect, kinectBaseline, kinectFocalLength, kinectDisparitySteps, kinectMaxIncidenceAngle, simulateProjectorShadows,
                 addMesh,
                 exportLAS, exportHDF, exportCSV, 
                 exportRenderedImage, exportSegmentedImage, exportPascalVoc, exportDepthmap, depthMinDistance, depthMaxDistance, 
                 dataFilePath, dataFileName,
                 debugLines, debugOutput, outputProgress, measureTime, singleRay, destinationObject, targetObject,
-                targets, materialMappings,
-                categoryIDs, partIDs, trees, depsgraph):
+                numberOfWorkers, tileSize, cacheDirectory,
+                targets, materialMappings, materialTable,
+                categoryIDs, partIDs, targetIDs, trees, depsgraph):
 
     if measureTime:
         startTime = time.time()
@@ -335,9 +528,19 @@ def performScan(context,
 
     origin = sensor.matrix_world.translation
 
-    # set counter of scanned rays to 0
-    indexX = 0
-    indexY = 0
+    # generate all rays of this frame at once
+    if scannerType == generic.ScannerType.static.name:
+        planeDepth = topLeft[2]
+    else:
+        planeDepth = None
+
+    (origins, directions, pixelX, pixelY) = ray_generator.generateRays(scannerType, sensor, xRange, yRange, planeDepth, cacheDirectory)
+
+    if singleRay:
+        # only one ray is cast, pointing from the sensor to the destination object
+        destination = destinationObject.matrix_world.translation
+        directions = ray_generator.normalize(np.array([destination - origin], dtype=np.float64))
+        origins = origins[:1]
 
     if measureTime:
         print("Prepare: %s s" % (time.time() - startTime))
@@ -352,240 +555,193 @@ def performScan(context,
     sensorZero.rotate(sensor.matrix_world.decompose()[1])
 
     exportNoiseData = addNoise or simulateRain or addConstantNoise
-    # iterate over all X/Y coordinates
-    for x in xRange:
-        # setup vector in the according direction
-        quatX = Quaternion((0.0, 1.0, 0.0), radians(x))
-        
-        for y in yRange:
-            if scannerType == generic.ScannerType.rotating.name:
-                quatY = Quaternion((1.0, 0.0, 0.0), radians(y))
 
-                # define "zero" direction of sensor
-                vec = Vector((0.0, 0.0, -1.0))
-                
-                # calculate destination translation from X/Y directions
-                quatAll = quatX @ quatY
-                vec.rotate(quatAll)
-
-                # caution: we can't use sensor.rotation_euler as it only gives us the 
-                # object's local rotation
-                # instead, we need to use the global rotation after "Follow Path" constraint is applied
-                # see comments of: https://blender.stackexchange.com/a/38179/95167 
-                vec.rotate(sensor.matrix_world.decompose()[1])
-                            
-            elif scannerType == generic.ScannerType.static.name:
-                # get current pixel vector from camera center
-                vec = Vector((x, y, topLeft[2]))
+    # the hit buffer stores the index of the target, not the object itself
+    targetIndices = {target: index for index, target in enumerate(targets)}
+
+    # cast all primary rays of the frame in one batch
+    if maxReflectionDepth > 0:
+        rayHits = parallel.castRays(targets, trees, origins, directions, distanceUpper, numberOfWorkers, tileSize, debugOutput, outputProgress)
+        hitRayIndices = np.flatnonzero(rayHits.targetIndices >= 0)
+    else:
+        # not even the primary ray is allowed
+        hitRayIndices = []
+
+    if measureTime:
+        print("Ray casting: %s s" % (time.time() - startTime))
+        startTime = time.time()
+
+    primaryRays = []
+
+    for rayIndex in hitRayIndices:
+        ray = TracedRay(origin, Vector(directions[rayIndex]), distanceUpper, iorAir, False, maxReflectionDepth - 1)
+        ray.closestHit = generic.getHitInfo(rayHits, rayIndex, targets)
+
+        if debugLines:
+            generic.addLine(origin, ray.closestHit.location)
+
+        primaryRays.append(ray)
+
+    # shade all hits and cast the reflected/refracted rays wave by wave
+    traceRays(primaryRays, targets, trees, materialMappings, materialTable, depsgraph, numberOfWorkers, tileSize, debugLines, debugOutput)
+
+    if measureTime:
+        print("Shading: %s s" % (time.time() - startTime))
+        startTime = time.time()
+
+    # iterate over all rays which hit something
+    # the labels of all hits are looked up at once, returns of mirrors and glass
+    # keep the labels of the primary hit
+    if len(hitRayIndices) > 0:
+        (hitCategoryIndices, hitPartIndices) = generic.getHitIDs(targetIDs, targets, materialMappings, rayHits.targetIndices[hitRayIndices], rayHits.faceIndices[hitRayIndices])
+
+    # the rays which returned something, in the order of their hits in the buffer
+    storedRayIndices = []
+    storedReflections = []
+
+    for hitIndex, (rayIndex, ray) in enumerate(zip(hitRayIndices, primaryRays)):
+        direction = ray.direction
+
+        closestHit = ray.result
+
+        # if location is None, no hit was found within the given range
+        if closestHit is not None:
+            # set the image x/y coordinates for tof sensor
+            closestHit.x = int(pixelX[rayIndex])
+            closestHit.y = int(pixelY[rayIndex])
+
+            # set category/part id for that hit to enable segmentation
+            closestHit.categoryID = hitCategoryIndices[hitIndex]
+            closestHit.partID = hitPartIndices[hitIndex]
+
+            if closestHit.wasReflected:
+                if debugLines:
+                    generic.addLine(origin, closestHit.location)
                 
-                # rotate that vector according to camera rotation
-                vec.rotate(sensor.matrix_world.decompose()[1])
-                           
-            # calculate destination location
-            destination = vec + sensor.matrix_world.translation
-
-            if singleRay:
-                destination = destinationObject.matrix_world.translation
-
-            # calculate ray direction 
-            direction = destination - origin
-
-            closestHit = castRay(targets, trees, origin, direction, distanceUpper, materialMappings, depsgraph, debugLines, debugOutput, iorAir, False, maxReflectionDepth - 1)
-
-            # if location is None, no hit was found within the given range
-            if closestHit is not None: 
-                # set the image x/y coordinates for tof sensor
-                closestHit.x = indexX
-                closestHit.y = indexY
-
-                # the Kinect raw depth data does not measure the distance between camera lens (L)
-                # and hit point (H) -> d_1, but between the (virtual) camera plane and hit point, 
-                # so we need to correct the distance
-                #
-                #   -----------------------H----
-                #             |          / |
-                #             |        /   |
-                #             |  d_1 /     |
-                #             |    /       |
-                #             |  /         |
-                #             |/           |
-                #   ----------L------------------
-                if scannerType == generic.ScannerType.static.name:
-                    # only modify the distance, not the XYZ values!
-                    closestHit.distance = mathutils.geometry.distance_point_to_plane(closestHit.location, origin, sensorZero)
+                fakePoint = direction.normalized() * closestHit.distance + origin
                 
-                # set category/part id for that hit to enable segmentation
-                if "partID" in closestHit.target:
-                    partIDIndex = closestHit.target["partID"]
-                else:
-                    partIDIndex = closestHit.target.material_slots[materialMappings[closestHit.target][closestHit.faceIndex]].name
-
-                closestHit.categoryID = categoryIDs[closestHit.target["categoryID"]]
-                closestHit.partID = partIDs[partIDIndex]
-
-                if closestHit.wasReflected:
-                    if debugLines:
-                        generic.addLine(origin, closestHit.location)
-                    
-                    fakePoint = direction.normalized() * closestHit.distance + origin
-                    
-                    if debugOutput:
-                        print(fakePoint)
-                        print("Total reflected distance ", closestHit.distance)
-                        
-                    # update the original hit location (on the mirror) with the fake position from the total distance
-                    closestHit.location = fakePoint
+                if debugOutput:
+                    print(fakePoint)
+                    print("Total reflected distance ", closestHit.distance)
                     
-                    if debugLines:
-                        generic.addLine(origin, closestHit.location)
-
-                
-                noise = noiseAbsoluteOffset + (closestHit.distance * noiseRelativeOffset / 100.0)
+                # update the original hit location (on the mirror) with the fake position from the total distance
+                closestHit.location = fakePoint
                 
-                surfaceReflectivity = closestHit.intensity
+                if debugLines:
+                    generic.addLine(origin, closestHit.location)
 
-                # source: https://github.com/mgschwan/blensor/blob/0b6cca9f189b1e072cfd8aaa6360deeab0b96c61/release/scripts/addons/blensor/scan_interface_pure.py#L9
-                rMin = 0.0
-                if closestHit.distance >= distanceLower:
-                    rMin = reflectivityLower + ((reflectivityUpper - reflectivityLower) * closestHit.distance) / (distanceUpper - distanceLower)
+            if debugOutput:
+                print("Location ", closestHit.location)
+                print("Direction ", direction)
+                print("Length ", closestHit.location.length)
+                print("Distance ", closestHit.distance)
+
+            # save closest hit into array
+            hit_info.storeHit(scannedValues, valueIndex, closestHit, targetIndices[closestHit.target])
+            storedRayIndices.append(rayIndex)
+            storedReflections.append(closestHit.wasReflected)
+            valueIndex += 1
+        else:
+            if debugOutput:
+                print("NO RETURN for ray %d after shading" % rayIndex)
 
-                delta = 0
+    if measureTime:
+        print("Loop: %s s" % (time.time() - startTime))
+        startTime = time.time()
 
-                if simulateRain:
-                    # see https://www.researchgate.net/publication/330415308_Predicting_the_influence_of_rain_on_LIDAR_in_ADAS for details
-                    noise += error_distribution.applyNoise(0.0, 0.02 * closestHit.distance * (1 - np.e ** -rainfallRate) ** 2) # equation (9)
-                
-                    # coefficient following observation
-                    backScatteringCoefficientRain = 0.01 * rainfallRate ** 0.6 # equation (5)
-
-                    delta = np.e ** (-2 * backScatteringCoefficientRain * closestHit.distance) - 1
-
-                surfaceReflectivity += delta
-
-                alpha = 1.0
-
-                if simulateDust:
-                    # see: https://www.researchgate.net/publication/313582355_When_the_Dust_Settles_The_Four_Behaviors_of_LiDAR_in_the_Presence_of_Fine_Airborne_Particulates
-                    Rt = closestHit.distance
-
-                    r = particleRadius * 10**(-6)
-                    n = particlesPcm
-                    Ld = dustCloudLength
-                    Rd = dustCloudStart
-
-                    if Rt < Rd:
-                        # target is in front of dust cloud -> no backscatter or reduction -> no action to perform
-                        pass
-                    else:
-                        # target in or behind dust cloud
-                        beta = (r**2 * n) / 4 # eq. (31)
-
-                        if beta > rMin:
-                            # light is reflected by the cloud -> appears as solid object
-
-                            # calculate the direction vector 
-                            dustDirection =  direction.normalized() * Rd
-
-                            # calculate the dust cloud location of the hit point
-                            dustLocation = dustDirection + origin
-
-                            if debugOutput:
-                                print("Dust Distance ", dustDirection)
-                                print("Dust Location ", dustLocation)
-                            
-                            # update the closest hit to the dust cloud
-                            closestHit.location = dustLocation
-                            closestHit.distance = Rd
-                            closestHit.intensity = beta
-                        else:
-                            # light enters the dust cloud
-
-                            # the end is the length + the start distance
-                            dustCloudEnd = Rd + Ld
-
-                            if Rt < dustCloudEnd: 
-                                # target inside dust cloud, so we need to calculate the part of the dust cloud
-                                # which is IN FRONT of our target
-                                relevantDustCloudLength = Rt - Rd
-                                
-                            else:
-                                # target behind dust cloud, so the full length of the dust cloud reduces the power
-                                relevantDustCloudLength = Ld
-                            
-                            # calculate the transmission loss
-                            alpha = np.exp(-2 * np.pi * r**2 * n * (relevantDustCloudLength)) # eq. (32)
-
-                surfaceReflectivity *= alpha
-
-                isVisible = surfaceReflectivity > rMin #relativeSensorPower > minimumRelativePower:
-                
-                # if the return is not powerful enough, the detector can't see it at all
-                if not isVisible:
-                    closestHit.intensity = 0.0
+    # the weather, the visibility and the noise are applied to the columns of all hits of the frame at once
+    # the columns are views of the hit buffer, so the results are written directly into the buffer
+    frameValues = scannedValues[startIndex:valueIndex]
 
-                #if not isVisible:
-                #    continue
-                
-                if debugOutput:
-                    print("Visible ", isVisible, surfaceReflectivity, rMin)
+    hitDirections = ray_generator.normalize(directions[storedRayIndices].reshape(-1, 3))
+    sensorOrigin = np.array(origin, dtype=np.float64)
 
-                if addNoise:
-                    # generate some noise
-                    # error model: https://github.com/mgschwan/blensor/blob/master/release/scripts/addons/blensor/gaussian_error_model.py#L21
-                    #              https://github.com/mgschwan/blensor/blob/0b6cca9f189b1e072cfd8aaa6360deeab0b96c61/release/scripts/addons/blensor/generic_lidar.py#L172
-                    noise += error_distribution.applyNoise(mu, sigma)
+    # hits the sensor can't measure, independent of their reflectivity
+    isMeasured = np.ones(len(frameValues), dtype=bool)
 
-                if debugOutput:
-                    print("Location ", closestHit.location)
-                    print("Direction ", direction)
-                    print("Length ", closestHit.location.length)
-                    print("Noise ", noise)
-                    print("Distance ", closestHit.distance)
-                
-                if exportNoiseData:
-                    # we can't simply move the hit location around by some random translation
-                    # instead, we have to move it along the ray direction
+    if scannerType == generic.ScannerType.static.name:
+        # the depth camera measures the distance to the camera plane, the locations of reflected hits are
+        # already moved along the ray, so their distance is measured to the point behind the mirror
+        # only modify the distance, not the XYZ values!
+        frameValues['distance'] = kinect.getPlaneDistances(frameValues['location'].astype(np.float64), sensorOrigin, np.array(sensorZero, dtype=np.float64))
 
-                    # calculate distance with noise
-                    noiseDistance = closestHit.distance + noise
-                    
-                    # calculate the direction vector with noise applied
-                    noiseDirection =  direction.normalized() * noiseDistance
+        if simulateKinect and len(frameValues) > 0:
+            frameValues['distance'] = kinect.quantizeDepths(frameValues['distance'].astype(np.float64), kinectBaseline, kinectFocalLength, kinectDisparitySteps)
 
-                    # calculate the noise location of the hit point
-                    noiseLocation = noiseDirection + origin
+            # the surface normals of the primary hits decide if the pattern is visible
+            isMeasured = ~kinect.getGrazingHits(hitDirections, rayHits.normals[storedRayIndices], math.radians(kinectMaxIncidenceAngle))
 
-                    if debugOutput:
-                        print("Noise Distance ", noiseDistance)
-                        print("Noise Location ", noiseLocation)
-                    
-                    closestHit.noiseLocation = noiseLocation
-                    closestHit.noiseDistance = noiseDistance
+        if simulateProjectorShadows and len(frameValues) > 0:
+            # the projector sits next to the camera, along the sensor's x axis
+            projectorOffset = Vector((kinectBaseline, 0.0, 0.0))
+            projectorOffset.rotate(sensor.matrix_world.decompose()[1])
+            projectorOrigin = sensorOrigin + np.array(projectorOffset, dtype=np.float64)
 
-                # save closest hit into array
-                scannedValues[valueIndex] = closestHit
-                valueIndex += 1
-            else:
-                if debugOutput:
-                    print("NO HIT within range of %f" % distanceUpper)
-            
-            indexY += 1
+            # the locations of reflected hits are behind the mirror, the projector's light takes the way over the mirror
+            isDirectHit = ~np.array(storedReflections, dtype=bool)
 
-            if singleRay:
-                break
-        
-        indexX += 1
-        indexY = 0
+            isShadowed = np.zeros(len(frameValues), dtype=bool)
+            isShadowed[isDirectHit] = kinect.getProjectorShadows(targets, trees, frameValues['location'][isDirectHit].astype(np.float64), projectorOrigin, numberOfWorkers, tileSize, debugOutput)
+
+            if debugOutput:
+                print("Hits in projector shadow ", np.count_nonzero(isShadowed))
+
+            isMeasured &= ~isShadowed
+
+    distances = frameValues['distance'].astype(np.float64)
+
+    noise = noiseAbsoluteOffset + (distances * noiseRelativeOffset / 100.0)
+
+    surfaceReflectivities = frameValues['intensity'].astype(np.float64)
+
+    minimumReflectivities = getMinimumReflectivities(distances, reflectivityLower, distanceLower, reflectivityUpper, distanceUpper)
 
-        if outputProgress:
-            percentage = (indexX * yRange.size) / totalNumberOfRays 
-            generic.updateProgress("Scanning scene", percentage)
+    if simulateRain:
+        (rainNoise, delta) = getRainEffects(distances, rainfallRate, noiseGenerator)
+
+        noise += rainNoise
+        surfaceReflectivities += delta
+
+    if simulateDust:
+        (isCloudFront, alpha, beta) = getDustEffects(distances, minimumReflectivities, particleRadius, particlesPcm, dustCloudLength, dustCloudStart)
+
+        # update the closest hits to the dust cloud
+        frameValues['location'][isCloudFront] = sensorOrigin + hitDirections[isCloudFront] * dustCloudStart
+        frameValues['distance'][isCloudFront] = dustCloudStart
+        frameValues['intensity'][isCloudFront] = beta
+
+        if debugOutput:
+            print("Dust cloud front hits ", np.count_nonzero(isCloudFront))
 
-        if singleRay:
-            break
+        surfaceReflectivities *= alpha
+
+    # if the return is not powerful enough, the detector can't see it at all
+    isVisible = (surfaceReflectivities > minimumReflectivities) & isMeasured #relativeSensorPower > minimumRelativePower:
+
+    if debugOutput:
+        print("Visible ", isVisible, surfaceReflectivities, minimumReflectivities)
+
+    # the hits the detector can't see are removed, so they are not exported
+    valueIndex = startIndex + removeHits(frameValues, isVisible)
+
+    frameValues = scannedValues[startIndex:valueIndex]
+    hitDirections = hitDirections[isVisible]
+    noise = noise[isVisible]
+
+    if addNoise:
+        # generate some noise
+        # error model: https://github.com/mgschwan/blensor/blob/master/release/scripts/addons/blensor/gaussian_error_model.py#L21
+        #              https://github.com/mgschwan/blensor/blob/0b6cca9f189b1e072cfd8aaa6360deeab0b96c61/release/scripts/addons/blensor/generic_lidar.py#L172
+        noise += noiseGenerator.getNoise(noiseType, mu, sigma, len(frameValues))
+
+    if debugOutput:
+        print("Noise ", noise)
+
+    if exportNoiseData:
+        applyNoise(frameValues, sensorOrigin, hitDirections, noise, debugOutput)
 
     if measureTime:
-        print("Loop: %s s" % (time.time() - startTime))
+        print("Post-processing: %s s" % (time.time() - startTime))
         startTime = time.time()
 
     # we now have the final number of hits so we could shrink the array here
@@ -610,7 +766,7 @@ def performScan(context,
     if len(slicedScannedValues) > 0:
         # setup exporter with our data
         if exportLAS or exportHDF or exportCSV or exportSegmentedImage or exportRenderedImage or exportDepthmap:
-            fileExporter = exporter.Exporter(dataFilePath, "%s_frame_%d" % (dataFileName, frameNumber), dataFileName, slicedScannedValues, targets, categoryIDs, partIDs, materialMappings, exportNoiseData, stepsX, stepsY)
+            fileExporter = exporter.Exporter(dataFilePath, "%s_frame_%d" % (dataFileName, frameNumber), dataFileName, slicedScannedValues, targets, categoryIDs, partIDs, materialMappings, exportNoiseData, stepsX, stepsY, noiseSeed=noiseGenerator.seed)
 
             # export to each format
             if exportLAS:
@@ -0,0 +1,109 @@
+import ctypes
+import multiprocessing
+from multiprocessing import sharedctypes
+
+import numpy as np
+
+from . import generic
+
+# everything the worker processes need to cast their tiles
+# the workers are forked from Blender's process, so they inherit this read-only
+# snapshot (BVH trees, ray arrays and result buffers) without pickling or copying it
+workerState = None
+
+# batches with fewer rays are cast in the current process, forking the pool would take longer than casting them
+# (e.g. the secondary waves of a few mirrors or glass hits)
+minParallelRays = 16384
+
+# the tiles are not made smaller than this, so the workers don't spend their time on the pool's messages
+minTileSize = 256
+
+def getTileSize(numberOfRays, numberOfWorkers, tileSize):
+    # tileSize is the largest tile, smaller batches are split evenly so every worker gets at least one tile
+    return max(minTileSize, min(tileSize, int(np.ceil(numberOfRays / numberOfWorkers))))
+
+def createSharedArray(shape, dtype):
+    # see: https://docs.python.org/3.7/library/multiprocessing.html#module-multiprocessing.sharedctypes
+    # (multiprocessing.shared_memory is not available in Blender's Python 3.7)
+    if dtype == np.float64:
+        ctype = ctypes.c_double
+    elif dtype == np.int64:
+        ctype = ctypes.c_int64
+    else:
+        raise ValueError("Unsupported data type %s!" % dtype)
+
+    buffer = sharedctypes.RawArray(ctype, int(np.prod(shape)))
+
+    return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+def castTile(tile):
+    (tileStart, tileEnd) = tile
+    (targetIndices, treeInfos, origins, directions, maxRanges, results) = workerState
+
+    rayHits = generic.castRays(targetIndices, treeInfos, origins[tileStart:tileEnd], directions[tileStart:tileEnd], maxRanges[tileStart:tileEnd])
+
+    # write the results directly into the shared buffers, nothing is sent back through the pool
+    for sharedArray, values in zip(results, rayHits):
+        sharedArray[tileStart:tileEnd] = values
+
+    return tileEnd - tileStart
+
+def castRays(targets, trees, origins, directions, maxRanges, numberOfWorkers, tileSize, debugOutput=False, outputProgress=False):
+    global workerState
+
+    numberOfRays = len(directions)
+
+    # the workers only see the trees and rays which exist when they are forked, so a new pool is
+    # needed for each batch, which only pays off for larger batches
+    if numberOfWorkers <= 1 or numberOfRays < minParallelRays:
+        return generic.castRays(targets, trees, origins, directions, maxRanges, debugOutput, outputProgress)
+
+    # the BVH trees live in Blender's memory and can't be pickled, so the
+    # workers have to be forked from the current process
+    try:
+        processContext = multiprocessing.get_context("fork")
+    except ValueError:
+        print("WARNING: Parallel scanning needs the 'fork' start method, which is not available on this platform. Scanning in a single process.")
+        return generic.castRays(targets, trees, origins, directions, maxRanges, debugOutput, outputProgress)
+
+    # shared result buffers, filled by the workers and handed to the exporter without a copy
+    results = generic.RayHits(createSharedArray((numberOfRays,), np.float64),
+                              createSharedArray((numberOfRays, 3), np.float64),
+                              createSharedArray((numberOfRays,), np.int64),
+                              createSharedArray((numberOfRays, 3), np.float64),
+                              createSharedArray((numberOfRays,), np.int64),
+                              createSharedArray((numberOfRays,), np.int64),
+                              createSharedArray((numberOfRays, 3), np.float64),
+                              createSharedArray((numberOfRays, 2), np.float64))
+
+    # the workers don't need any Blender objects, the targets are replaced by their indices
+    targetIndices = list(range(len(targets)))
+    treeInfos = {index: trees[target] for index, target in enumerate(targets)}
+
+    origins = np.broadcast_to(np.asarray(origins, dtype=np.float64), (numberOfRays, 3))
+    directions = np.asarray(directions, dtype=np.float64)
+    maxRanges = np.broadcast_to(np.asarray(maxRanges, dtype=np.float64), (numberOfRays,))
+
+    workerState = (targetIndices, treeInfos, origins, directions, maxRanges, results)
+
+    # split the ray grid into tiles of consecutive rays
+    tileSize = getTileSize(numberOfRays, numberOfWorkers, tileSize)
+    tiles = [(tileStart, min(tileStart + tileSize, numberOfRays)) for tileStart in range(0, numberOfRays, tileSize)]
+
+    try:
+        # there is no use in forking more workers than there are tiles
+        with processContext.Pool(min(numberOfWorkers, len(tiles))) as pool:
+            numberOfScannedRays = 0
+
+            for numberOfTileRays in pool.imap_unordered(castTile, tiles):
+                numberOfScannedRays += numberOfTileRays
+
+                if outputProgress:
+                    generic.updateProgress("Scanning scene", numberOfScannedRays / numberOfRays)
+    finally:
+        workerState = None
+
+    if debugOutput:
+        print("Scanned %d rays in %d tiles of %d rays with %d processes" % (numberOfRays, len(tiles), tileSize, min(numberOfWorkers, len(tiles))))
+
+    return results
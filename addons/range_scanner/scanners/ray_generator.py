@@ -0,0 +1,161 @@
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from . import generic
+
+# all rays of one frame are generated at once as (N, 3) arrays, the order of the rays
+# is the same as in the former nested loops: x is the outer, y the inner index
+
+
+def getSensorRotation(sensor):
+    # caution: we can't use sensor.rotation_euler as it only gives us the
+    # object's local rotation
+    # instead, we need to use the global rotation after "Follow Path" constraint is applied
+    # see comments of: https://blender.stackexchange.com/a/38179/95167
+    return np.array(sensor.matrix_world.decompose()[1].to_matrix(), dtype=np.float64)
+
+def getRotatingDirections(xRange, yRange):
+    # angles in degree, x rotates around the sensor's Y axis, y around its X axis
+    xAngles, yAngles = np.meshgrid(np.radians(xRange), np.radians(yRange), indexing='ij')
+
+    cosY = np.cos(yAngles)
+
+    # "zero" direction (0, 0, -1) rotated by quatX @ quatY, written out component-wise
+    directions = np.empty((xAngles.size, 3), dtype=np.float64)
+    directions[:, 0] = (-np.sin(xAngles) * cosY).ravel()
+    directions[:, 1] = np.sin(yAngles).ravel()
+    directions[:, 2] = (-np.cos(xAngles) * cosY).ravel()
+
+    return directions
+
+def getStaticDirections(xRange, yRange, planeDepth):
+    # every pixel is a point on the camera's view frame plane
+    xValues, yValues = np.meshgrid(xRange, yRange, indexing='ij')
+
+    directions = np.empty((xValues.size, 3), dtype=np.float64)
+    directions[:, 0] = xValues.ravel()
+    directions[:, 1] = yValues.ravel()
+    directions[:, 2] = planeDepth
+
+    return directions
+
+def getPixelIndices(xSize, ySize):
+    pixelX, pixelY = np.meshgrid(np.arange(xSize), np.arange(ySize), indexing='ij')
+
+    return (pixelX.ravel(), pixelY.ravel())
+
+def normalize(vectors):
+    lengths = np.linalg.norm(vectors, axis=1)
+    lengths[lengths == 0.0] = 1.0
+
+    return vectors / lengths[:, np.newaxis]
+
+def getYRotation(angle):
+    # rotation around the sensor's Y axis, angle in degree
+    angle = np.radians(angle)
+
+    return np.array([
+        [np.cos(angle), 0.0, np.sin(angle)],
+        [0.0, 1.0, 0.0],
+        [-np.sin(angle), 0.0, np.cos(angle)],
+    ])
+
+# normalized ray directions in sensor space, keyed by the scanner settings
+# the table of a static scanner depends on its view frame and resolution
+# the table of a rotating scanner depends on the covered angle, the vertical FOV and the step sizes
+# (where the covered interval starts is applied as additional rotation, so all frames of an animation share one table)
+directionTemplates = OrderedDict()
+
+# a few templates are enough, as the settings rarely change during a scan
+maxNumberOfTemplates = 8
+
+def getTemplateKey(scannerType, xRange, yRange, planeDepth):
+    # rounding avoids new templates because of floating point noise
+    if scannerType == generic.ScannerType.rotating.name:
+        xKey = (round(float(xRange[-1] - xRange[0]), 9), len(xRange))
+    else:
+        xKey = (round(float(xRange[0]), 9), round(float(xRange[-1]), 9), len(xRange))
+
+    yKey = (round(float(yRange[0]), 9), round(float(yRange[-1]), 9), len(yRange))
+
+    if planeDepth is None:
+        depthKey = None
+    else:
+        depthKey = round(float(planeDepth), 9)
+
+    return (scannerType, xKey, yKey, depthKey)
+
+def getDirectionTemplate(scannerType, xRange, yRange, planeDepth=None, cacheDirectory=""):
+    key = getTemplateKey(scannerType, xRange, yRange, planeDepth)
+
+    if key in directionTemplates:
+        directionTemplates.move_to_end(key)
+        return directionTemplates[key]
+
+    templateFile = None
+    template = None
+
+    if cacheDirectory:
+        templateFile = os.path.join(cacheDirectory, "rays_%s.npy" % hashlib.sha1(repr(key).encode()).hexdigest()[:16])
+
+        if os.path.isfile(templateFile):
+            template = np.load(templateFile)
+
+            # the modification time marks the recently used files for geometry_cache.cleanCacheDirectory
+            try:
+                os.utime(templateFile)
+            except OSError:
+                pass
+
+            if template.shape != (len(xRange) * len(yRange), 3):
+                print("WARNING: Ray cache file %s does not match the scanner settings! Ignoring it." % templateFile)
+                template = None
+
+    if template is None:
+        if scannerType == generic.ScannerType.rotating.name:
+            # the interval is moved to start at 0 degree
+            template = getRotatingDirections(np.asarray(xRange) - xRange[0], yRange)
+        elif scannerType == generic.ScannerType.static.name:
+            template = getStaticDirections(xRange, yRange, planeDepth)
+        else:
+            raise ValueError("Unknown scanner type %s!" % scannerType)
+
+        template = normalize(template)
+
+        if templateFile is not None:
+            os.makedirs(cacheDirectory, exist_ok=True)
+            np.save(templateFile, template)
+
+    # the arrays are shared between frames, so nobody is allowed to change them
+    template.flags.writeable = False
+
+    directionTemplates[key] = template
+
+    if len(directionTemplates) > maxNumberOfTemplates:
+        directionTemplates.popitem(last=False)
+
+    return template
+
+def generateRays(scannerType, sensor, xRange, yRange, planeDepth=None, cacheDirectory=""):
+    localDirections = getDirectionTemplate(scannerType, xRange, yRange, planeDepth, cacheDirectory)
+
+    rotation = getSensorRotation(sensor)
+
+    if scannerType == generic.ScannerType.rotating.name:
+        # the template starts at 0 degree, so we rotate it to the start of the interval
+        rotation = rotation @ getYRotation(xRange[0])
+
+    # rotate all directions into world space with one matrix product
+    # the rotation keeps the length, so the directions are still normalized
+    directions = localDirections @ rotation.T
+
+    # all rays start at the sensor, so we don't need to store the origin N times
+    origin = np.array(sensor.matrix_world.translation, dtype=np.float64)
+    origins = np.broadcast_to(origin, directions.shape)
+
+    (pixelX, pixelY) = getPixelIndices(len(xRange), len(yRange))
+
+    return (origins, directions, pixelX, pixelY)
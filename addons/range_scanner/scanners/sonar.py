@@ -11,64 +11,216 @@ import os
 import sys
 import math
 
-from .. import error_distribution
 from .. import material_helper
 from ..export import exporter
 from . import hit_info
 from .. import fresnel
 from ..ui import user_interface
 from . import generic
+from . import ray_generator
 
 
 
-def castRay(targets, trees, origin, direction, maxRange, materialMappings, depsgraph, debugLines, debugOutput,
-            sourceLevel, noiseLevel, directivityIndex, processingGain, receptionThreshold):
+def shadeHit(closestHit, materialMappings, materialTable, depsgraph, debugOutput,
+             sourceLevel, noiseLevel, directivityIndex, processingGain, receptionThreshold, textureColor=None):
+    materialProperty = material_helper.getMaterialColorAndMetallic(closestHit, materialMappings, materialTable, depsgraph, debugOutput, textureColor)
+    closestHit.color = materialProperty.color
+
     if debugOutput:
-        print("")
-        print("")
-        print("")
-        print("### SUBCAST ###")
-        print(origin, direction, maxRange)
+        print("RGBA", materialProperty.color[0], materialProperty.color[1], materialProperty.color[2], materialProperty.color[3])
+        print("Metallic ", materialProperty.metallic)
 
-    closestHit = generic.getClosestHit(targets, trees, origin, direction, maxRange, debugOutput, debugLines)
+    # see: https://link.springer.com/book/10.1007/978-1-349-20508-0, p. 18
+    transmissionLoss = 10 * np.log10(closestHit.distance)
+    
+    #backscatteringCrossSection = material_helper.getSurfaceReflectivity(closestHit.color)
+    #targetStrength = 10 * np.log10(backscatteringCrossSection)
 
-    if closestHit is not None:
-        materialProperty = material_helper.getMaterialColorAndMetallic(closestHit, materialMappings, depsgraph, debugOutput)
-        closestHit.color = materialProperty.color
+    # same as for light: instead of some formula to calculate a value, we let the user
+    # directly set the value for simplification the input process
+    # just use it as factor how much of the incoming energy should be refelcted
+    targetStrength = material_helper.getSurfaceReflectivity(closestHit.color)
 
-        if debugOutput:
-            print("RGBA", materialProperty.color[0], materialProperty.color[1], materialProperty.color[2], materialProperty.color[3])
-            print("Metallic ", materialProperty.metallic)
 
-        # see: https://link.springer.com/book/10.1007/978-1-349-20508-0, p. 18
-        transmissionLoss = 10 * np.log10(closestHit.distance)
+    ' SONAR EQUATION '
+    # see: https://www.uio.no/studier/emner/matnat/ifi/INF-GEO4310/h12/undervisningsmateriale/sonar_introduction_2012_compressed.pdf
+    # eq. (19)
+    receivedSignalLevel = sourceLevel - 2*transmissionLoss - noiseLevel + directivityIndex + processingGain # + targetStrength
+    receivedSignalLevel *= targetStrength
+
+    isMeasured = receivedSignalLevel > receptionThreshold
+
+    if debugOutput:
+        print("SEND ", sourceLevel, transmissionLoss, targetStrength, noiseLevel, directivityIndex, processingGain)
+        print("RECEIVE ", receivedSignalLevel, isMeasured)
+
+    if isMeasured:
+        closestHit.intensity = receivedSignalLevel / sourceLevel
+        return closestHit
+            
+    return None
+
+def castRayBatch(targets, trees, origins, directions, maxRanges, materialMappings, materialTable, depsgraph, debugLines, debugOutput,
+                 sourceLevels, noiseLevel, directivityIndex, processingGain, receptionThreshold):
+    # cast all rays at once, only the hits are shaded one by one
+    rayHits = generic.castRays(targets, trees, origins, directions, maxRanges, debugOutput)
+
+    sourceLevels = np.broadcast_to(sourceLevels, (len(directions),))
+
+    closestHits = [None] * len(directions)
+
+    hitRayIndices = np.flatnonzero(rayHits.targetIndices >= 0)
+    hits = [generic.getHitInfo(rayHits, rayIndex, targets) for rayIndex in hitRayIndices]
+
+    # the texture colors of all hits are sampled at once
+    textureColors = material_helper.getTextureColors(hits, materialMappings, materialTable)
+
+    for rayIndex, closestHit, textureColor in zip(hitRayIndices, hits, textureColors):
+        if debugLines:
+            generic.addLine(origins[rayIndex], closestHit.location)
+
+        closestHits[rayIndex] = shadeHit(closestHit, materialMappings, materialTable, depsgraph, debugOutput,
+                                         float(sourceLevels[rayIndex]), noiseLevel, directivityIndex, processingGain, receptionThreshold, textureColor)
+
+    return closestHits
+
+def castWaterProfileRays(targets, trees, origin, directions, maxDistance, depthList, firstValueBelowSensor, sensorHeight,
+                         materialMappings, materialTable, depsgraph, debugLines, debugOutput,
+                         sourceLevel, noiseLevel, directivityIndex, processingGain, receptionThreshold):
+    numberOfRays = len(directions)
+
+    # the angle to the vertical axis is only calculated once for the original direction
+    angles = np.arccos(np.clip(-directions[:, 2], -1.0, 1.0))
+
+    internalOrigins = np.tile(np.array(origin, dtype=np.float64), (numberOfRays, 1))
+    currentDirections = np.array(directions, dtype=np.float64)
+
+    remainingDistances = np.full(numberOfRays, maxDistance, dtype=np.float64)
+    remainingSourceLevels = np.full(numberOfRays, sourceLevel, dtype=np.float64)
+    distancesTraveled = np.zeros(numberOfRays, dtype=np.float64)
+
+    # rays which did neither hit anything nor run out of range
+    isActive = np.ones(numberOfRays, dtype=bool)
+
+    closestHits = [None] * numberOfRays
+
+    oldHeight = sensorHeight
+
+    # as the water layers are not represented by Blender objects, we
+    # need to define the normal manually as upwards (positive Z axis)
+    normal = np.array([0.0, 0.0, 1.0])
+
+    for layerIndex in range(firstValueBelowSensor, len(depthList) + 1):
+        rayIndices = np.flatnonzero(isActive)
+
+        if len(rayIndices) == 0:
+            break
+
+        # after passing the final layer, the ray distance is only limited by the
+        # sensor's parameters, not the water layers
+        if layerIndex == len(depthList):
+            newRanges = remainingDistances[rayIndices]
+        else:
+            # else, determine the range until the next water layer
+            newRanges = (oldHeight - depthList[layerIndex][0]) / np.cos(angles[rayIndices])
+
+            oldHeight = depthList[layerIndex][0]
+
+            if debugOutput:
+                print(sensorHeight, depthList[layerIndex][0], depthList[layerIndex][1])
+
+        castRanges = np.minimum(remainingDistances[rayIndices], newRanges)
+
+        layerHits = castRayBatch(targets, trees, internalOrigins[rayIndices], currentDirections[rayIndices], castRanges, materialMappings, materialTable, depsgraph, debugLines, debugOutput,
+                                 remainingSourceLevels[rayIndices], noiseLevel, directivityIndex, processingGain, receptionThreshold)
+
+        if debugLines:
+            for index, rayIndex in enumerate(rayIndices):
+                generic.addLine(internalOrigins[rayIndex], internalOrigins[rayIndex] + currentDirections[rayIndex] * castRanges[index])
+
+        isMissed = np.ones(len(rayIndices), dtype=bool)
+
+        for index, rayIndex in enumerate(rayIndices):
+            if layerHits[index] is not None:
+                closestHits[rayIndex] = layerHits[index]
+                isMissed[index] = False
+
+        isActive[rayIndices[~isMissed]] = False
+
+        # no hit was found
+        # decrease the scanning distance for next run
+        missedIndices = rayIndices[isMissed]
+        newRanges = newRanges[isMissed]
+
+        remainingDistances[missedIndices] -= newRanges
+        distancesTraveled[missedIndices] += newRanges
+
+        # no scanning distance left or final layer reached, abort
+        if layerIndex == len(depthList):
+            isActive[missedIndices] = False
+            break
+
+        isOutOfRange = remainingDistances[missedIndices] < 0
+        isActive[missedIndices[isOutOfRange]] = False
+
+        missedIndices = missedIndices[~isOutOfRange]
+        newRanges = newRanges[~isOutOfRange]
+
+        # for the next ray we need to refract the current ray at the border
+        # of the two adjacent layers
+
+        # see: https://en.wikipedia.org/wiki/Snell%27s_law
+        #      https://en.wikipedia.org/wiki/List_of_refractive_indices
+
+        # determine n by the refractive index of the layer above and below the border
+        # https://en.wikipedia.org/wiki/Snell%27s_law
+        # sin a1   v2   n1 
+        # ------ = -- = --
+        # sin a2   v1   n2
+
+        # we now need to get n1 / n2, so we can also take v2 / v1
+        v1 = depthList[layerIndex - 1][1]
+        v2 = depthList[layerIndex][1]
         
-        #backscatteringCrossSection = material_helper.getSurfaceReflectivity(closestHit.color)
-        #targetStrength = 10 * np.log10(backscatteringCrossSection)
+        n = v2 / v1
 
-        # same as for light: instead of some formula to calculate a value, we let the user
-        # directly set the value for simplification the input process
-        # just use it as factor how much of the incoming energy should be refelcted
-        targetStrength = material_helper.getSurfaceReflectivity(closestHit.color)
+        if debugOutput:
+            print(v1, v2, n)
+
+        direction = currentDirections[missedIndices]
+
+        # calculate new direction vector
+        # see: http://www.starkeffects.com/snells-law-vector.shtml
+        normalCrossDirection = np.cross(normal, direction)
+        newDirection = n * np.cross(normal, -normalCrossDirection) - normal * np.sqrt(1 - (n**2) * np.einsum('ij,ij->i', normalCrossDirection, normalCrossDirection))[:, np.newaxis]
 
+        incidentAngle = np.arccos(np.clip(direction[:, 2] / np.linalg.norm(direction, axis=1), -1.0, 1.0))
+        refractionAngle = np.arccos(np.clip(newDirection[:, 2] / np.linalg.norm(newDirection, axis=1), -1.0, 1.0))
 
-        ' SONAR EQUATION '
-        # see: https://www.uio.no/studier/emner/matnat/ifi/INF-GEO4310/h12/undervisningsmateriale/sonar_introduction_2012_compressed.pdf
-        # eq. (19)
-        receivedSignalLevel = sourceLevel - 2*transmissionLoss - noiseLevel + directivityIndex + processingGain # + targetStrength
-        receivedSignalLevel *= targetStrength
+        # now we need to calculate how much of the waves energy is transmitted as some fraction is reflected away from the receiver
+        # see: https://epic.awi.de/id/eprint/29175/1/Hat2009b.pdf, p. 38, 2.7.4 Schalltransmission
+        p1 = depthList[layerIndex - 1][2]
+        p2 = depthList[layerIndex][2]
 
-        isMeasured = receivedSignalLevel > receptionThreshold
+        denominator = p2 * v2 * np.cos(incidentAngle) + p1 * v1 * np.cos(refractionAngle)
+        transmission = (4 * p1 * v1 * p2 * v2 * np.cos(incidentAngle) * np.cos(refractionAngle)) / denominator**2 # equation (2.42)
 
         if debugOutput:
-            print("SEND ", sourceLevel, transmissionLoss, targetStrength, noiseLevel, directivityIndex, processingGain)
-            print("RECEIVE ", receivedSignalLevel, isMeasured)
+            print("density ", p1, p2, "transmission", transmission)
+        
+        # set ray parameters for next run
+        internalOrigins[missedIndices] = direction * newRanges[:, np.newaxis] + internalOrigins[missedIndices]
+        currentDirections[missedIndices] = newDirection
+        remainingSourceLevels[missedIndices] *= transmission
 
-        if isMeasured:
-            closestHit.intensity = receivedSignalLevel / sourceLevel
-            return closestHit
-            
-    return None
+    for rayIndex, closestHit in enumerate(closestHits):
+        if closestHit is not None:
+            # important: update the total distance, as currently it is set so the distance
+            # between the hitpoint and water layer above!
+            closestHit.distance = closestHit.distance + distancesTraveled[rayIndex]
+
+    # the direction of the last segment is needed to place the noisy points
+    return (closestHits, currentDirections)
 
 def performScan(context, 
                 scannerType, scannerObject,
@@ -76,14 +228,14 @@ def performScan(context,
                 fovSonar, sonarStepDegree, sonarMode3D, sonarKeepRotation,
                 sourceLevel, noiseLevel, directivityIndex, processingGain, receptionThreshold,    
                 simulateWaterProfile, depthList,  
-                addNoise, noiseType, mu, sigma, addConstantNoise, noiseAbsoluteOffset, noiseRelativeOffset,
+                addNoise, noiseType, mu, sigma, addConstantNoise, noiseAbsoluteOffset, noiseRelativeOffset, noiseGenerator,
                 addMesh,
                 exportLAS, exportHDF, exportCSV, exportSingleFrames,
                 dataFilePath, dataFileName,
                 debugLines, debugOutput, outputProgress, measureTime, singleRay, destinationObject, targetObject,
                 enableAnimation, frameStart, frameEnd, frameStep,
-                targets, materialMappings,
-                categoryIDs, partIDs):
+                targets, materialMappings, materialTable,
+                categoryIDs, partIDs, targetIDs):
 
     if measureTime:
         startTime = time.time()
@@ -116,7 +268,10 @@ def performScan(context,
     # we don't know how many of our rays will actually hit an object, so we allocate
     # memory for the worst case of every ray hitting the scene
     # (TODO depending on the RAM usage, it might be a good idea to use some kind of caching)
-    scannedValues = np.full(totalNumberOfRays, None, dtype=hit_info.HitInfo)
+    # the noise columns are only needed if the noise is exported
+    exportNoiseData = addNoise or addConstantNoise
+
+    scannedValues = hit_info.createHitBuffer(totalNumberOfRays, exportNoiseData)
 
     valueIndex = 0
 
@@ -141,10 +296,6 @@ def performScan(context,
     origin = sensor.matrix_world.translation
     startLocation = origin.copy()
 
-    # set counter of scanned rays to 0
-    indexX = 0
-    indexY = 0
-
     if measureTime:
         print("Prepare: %s s" % (time.time() - startTime))
         startTime = time.time()
@@ -153,13 +304,14 @@ def performScan(context,
     if outputProgress:
         generic.updateProgress("Scanning scene", 0.0)
 
-    exportNoiseData = addNoise or addConstantNoise
+    # the hit buffer stores the index of the target, not the object itself
+    targetIndices = {target: index for index, target in enumerate(targets)}
 
     for frameNumber in range(firstFrame, lastFrame + 1, frameStep):
         bpy.context.scene.frame_set(frameNumber)
 
         # setup BVH tree for each object
-        trees = generic.getBVHTrees(trees, targets, depsgraph)
+        trees = generic.getBVHTrees(trees, targets, depsgraph, materialMappings)
         
         sensorHeight = sensor.matrix_world.translation.z
 
@@ -184,229 +336,108 @@ def performScan(context,
             # in both cases we don't have to care about refraction
             simulateWaterProfile = False
 
-        # iterate over all X/Y coordinates
-        for x in xRange:
-            # setup vector in the according direction
-            quatX = Quaternion((0.0, 1.0, 0.0), radians(x))
-            
-            for y in yRange:
-                quatY = Quaternion((1.0, 0.0, 0.0), radians(y))
-
-                # define "zero" direction of sensor
-                vec = Vector((0.0, 0.0, -1.0))
-                
-                # calculate destination translation from X/Y directions
-                quatAll = quatX @ quatY
-                vec.rotate(quatAll)
-
-                # caution: we can't use sensor.rotation_euler as it only gives us the 
-                # object's local rotation
-                # instead, we need to use the global rotation after "Follow Path" constraint is applied
-                # see comments of: https://blender.stackexchange.com/a/38179/95167 
-                vec.rotate(sensor.matrix_world.decompose()[1])
-                            
-                # calculate destination location
-                destination = vec + sensor.matrix_world.translation
-
-                if singleRay:
-                    destination = destinationObject.matrix_world.translation
-
-                # calculate ray direction 
-                direction = (destination - origin).normalized()
+        # generate all rays of this frame at once
+        (origins, directions, pixelX, pixelY) = ray_generator.generateRays(generic.ScannerType.rotating.name, sensor, xRange, yRange)
+
+        if singleRay:
+            # only one ray is cast, pointing from the sensor to the destination object
+            destination = destinationObject.matrix_world.translation
+            directions = ray_generator.normalize(np.array([destination - origin], dtype=np.float64))
+            origins = origins[:1]
+
+        if simulateWaterProfile:
+            (closestHits, hitDirections) = castWaterProfileRays(targets, trees, origin, directions, maxDistance, depthList, firstValueBelowSensor, sensorHeight,
+                                                                materialMappings, materialTable, depsgraph, debugLines, debugOutput,
+                                                                sourceLevel, noiseLevel, directivityIndex, processingGain, receptionThreshold)
+        else:
+            closestHits = castRayBatch(targets, trees, origins, directions, maxDistance, materialMappings, materialTable, depsgraph, debugLines, debugOutput,
+                                       sourceLevel, noiseLevel, directivityIndex, processingGain, receptionThreshold)
+            hitDirections = directions
+
+        # the labels of all hits are looked up at once
+        hitRayIndices = [rayIndex for rayIndex, closestHit in enumerate(closestHits) if closestHit is not None]
+
+        if len(hitRayIndices) > 0:
+            (hitCategoryIndices, hitPartIndices) = generic.getHitIDs(targetIDs, targets, materialMappings,
+                                                                     [targetIndices[closestHits[rayIndex].target] for rayIndex in hitRayIndices],
+                                                                     [closestHits[rayIndex].faceIndex for rayIndex in hitRayIndices])
+
+            hitLabels = dict(zip(hitRayIndices, zip(hitCategoryIndices.tolist(), hitPartIndices.tolist())))
+
+        # the noise of all rays of the frame is drawn at once from the generator of the scan
+        if addNoise:
+            sensorNoise = noiseGenerator.getNoise(noiseType, mu, sigma, len(closestHits))
+
+        for rayIndex, closestHit in enumerate(closestHits):
+            # the direction of the ray segment which hit the target
+            direction = Vector(hitDirections[rayIndex])
+
+            # left or right side of the sensor
+            x = xRange[pixelX[rayIndex]]
+
+            # if location is None, no hit was found within the given range
+            if closestHit is not None:
+                # set category/part id for that hit to enable segmentation
+                (closestHit.categoryID, closestHit.partID) = hitLabels[rayIndex]
                 
-                closestHit = None
-                internalOrigin = origin
+                noise = noiseAbsoluteOffset + (closestHit.distance * noiseRelativeOffset / 100.0)
 
-                if simulateWaterProfile:
-                    angle = Vector((0.0, 0.0, -1.0)).angle(direction) 
+                if addNoise:
+                    # generate some noise
+                    # error model: https://github.com/mgschwan/blensor/blob/master/release/scripts/addons/blensor/gaussian_error_model.py#L21
+                    #              https://github.com/mgschwan/blensor/blob/0b6cca9f189b1e072cfd8aaa6360deeab0b96c61/release/scripts/addons/blensor/generic_lidar.py#L172
+                    noise += sensorNoise[rayIndex]
 
-                    remainingDistance = maxDistance   
+                # we can't simply move the hit location around by some random translation
+                # instead, we have to move it along the ray direction
 
-                    oldHeight = sensorHeight        
-
-                    remainingSourceLevel = sourceLevel
-
-                    distanceTraveled = 0.0
-
-                    for layerIndex in range(firstValueBelowSensor, len(depthList) + 1):
-                        # after passing the final layer, the ray distance is only limited by the
-                        # sensor's parameters, not the water layers
-                        if layerIndex == len(depthList):
-                            newRange = remainingDistance
-                        else:
-                            # else, determine the range until the next water layer
-                            newRange = (oldHeight - depthList[layerIndex][0]) / np.cos(angle)
+                # calculate distance with noise
+                noiseDistance = closestHit.distance + noise
+                
+                # calculate the direction vector with noise applied
+                noiseDirection =  direction.normalized() * noiseDistance
 
-                            oldHeight = depthList[layerIndex][0]
+                # calculate the noise location of the hit point
+                noiseLocation = noiseDirection + origin
 
-                            if debugOutput:
-                                print(sensorHeight, depthList[layerIndex][0], depthList[layerIndex][1], angle, remainingDistance, newRange)
-                            
-                        closestHit = castRay(targets, trees, internalOrigin, direction, min(remainingDistance, newRange), materialMappings, depsgraph, debugLines, debugOutput,
-                                        remainingSourceLevel, noiseLevel, directivityIndex, processingGain, receptionThreshold)
-                        
-                        if debugLines:
-                            generic.addLine(internalOrigin, internalOrigin + direction * min(remainingDistance, newRange))
-                            
-                        if closestHit is None:
-                            # no hit was found
-                            # decrease the scanning distance for next run
-                            remainingDistance -= newRange
-                            distanceTraveled += newRange
-
-                            # no scanning distance left or final layer reached, abort
-                            if remainingDistance < 0 or layerIndex == len(depthList):
-                                break
-                            
-                            if debugOutput:
-                                print("No hit from ", internalOrigin, " in direction ", direction, " within range of ", min(remainingDistance, newRange))
-                                print("Adding line from ", internalOrigin, " to ", internalOrigin + direction * min(remainingDistance, newRange) )
-                                                        
-                            # for the next ray we need to refract the current ray at the border
-                            # of the two adjacent layers
-
-                            # see: https://en.wikipedia.org/wiki/Snell%27s_law
-                            #      https://en.wikipedia.org/wiki/List_of_refractive_indices
-
-                            # as the water layers are not represented by Blender objects, we
-                            # need to define the normal manually as upwards (positive Z axis)
-                            normal = Vector((0.0, 0.0, 1.0)).normalized()
-
-                            # determine n by the refractive index of the layer above and below the border
-                            # https://en.wikipedia.org/wiki/Snell%27s_law
-                            # sin a1   v2   n1 
-                            # ------ = -- = --
-                            # sin a2   v1   n2
-
-                            # we now need to get n1 / n2, so we can also take v2 / v1
-                            v1 = depthList[layerIndex - 1][1]
-                            v2 = depthList[layerIndex][1]
-                            
-                            n = v2 / v1
-
-                            if debugOutput:
-                                print(v1, v2, n)
-
-                            # calculate new direction vector
-                            # see: http://www.starkeffects.com/snells-law-vector.shtml
-                            newDirection = n * (normal.cross(-normal.cross(direction))) - normal * np.sqrt(1 - (n**2) * (normal.cross(direction) @ normal.cross(direction)))
-
-                            incidentAngle = normal.angle(direction)
-                            refractionAngle = normal.angle(newDirection)
-
-                            if debugOutput:
-                                print(normal.normalized(), direction.normalized(), newDirection.normalized())
-                                print(incidentAngle, refractionAngle)
-
-                            # now we need to calculate how much of the waves energy is transmitted as some fraction is reflected away from the receiver
-                            # see: https://epic.awi.de/id/eprint/29175/1/Hat2009b.pdf, p. 38, 2.7.4 Schalltransmission
-                            p1 = depthList[layerIndex - 1][2]
-                            p2 = depthList[layerIndex][2]
-
-                            denominator = p2 * v2 * np.cos(incidentAngle) + p1 * v1 * np.cos(refractionAngle)
-                            transmission = (4 * p1 * v1 * p2 * v2 * np.cos(incidentAngle) * np.cos(refractionAngle)) / denominator**2 # equation (2.42)
-
-                            if debugOutput:
-                                print("density ", p1, p2, "transmission", transmission)
-                            
-                            # set ray parameters for next run
-                            internalOrigin = direction * newRange + internalOrigin
-                            direction = newDirection
-                            remainingSourceLevel *= transmission
-
-                            if debugOutput:
-                                print("New origin ", internalOrigin, ", new direction ", direction)
-                        else:
-                            break
-                    
-                    if closestHit is not None:
-                        # important: update the total distance, as currently it is set so the distance
-                        # between the hitpoint and water layer above!
-                        closestHit.distance = closestHit.distance + distanceTraveled                
-                else:
-                    closestHit = castRay(targets, trees, origin, direction, maxDistance, materialMappings, depsgraph, debugLines, debugOutput,
-                                     sourceLevel, noiseLevel, directivityIndex, processingGain, receptionThreshold)
-
-                # if location is None, no hit was found within the given range
-                if closestHit is not None:
-                    # set category/part id for that hit to enable segmentation
-                    if "partID" in closestHit.target:
-                        partIDIndex = closestHit.target["partID"]
+                if debugOutput:
+                    print("Noise Distance ", noiseDistance)
+                    print("Noise Location ", noiseLocation)
+                
+                closestHit.noiseLocation = noiseLocation
+                closestHit.noiseDistance = noiseDistance
+
+                if debugOutput:
+                    print("Location ", closestHit.location)
+                    print("Direction ", direction)
+                    print("Length ", closestHit.location.length)
+                    print("Noise ", noise)
+                    print("Distance ", closestHit.distance)     
+
+                if not sonarMode3D:
+                    # to simulate sonar, we have to move all values into one plane
+                    if sonarKeepRotation:
+                        closestHit.location = Vector((direction.x, direction.y, 0)).normalized() * closestHit.distance + origin
                     else:
-                        partIDIndex = closestHit.target.material_slots[materialMappings[closestHit.target][closestHit.faceIndex]].name
-
-                    closestHit.categoryID = categoryIDs[closestHit.target["categoryID"]]
-                    closestHit.partID = partIDs[partIDIndex]
-                    
-                    noise = noiseAbsoluteOffset + (closestHit.distance * noiseRelativeOffset / 100.0)
-
-                    if addNoise:
-                        # generate some noise
-                        # error model: https://github.com/mgschwan/blensor/blob/master/release/scripts/addons/blensor/gaussian_error_model.py#L21
-                        #              https://github.com/mgschwan/blensor/blob/0b6cca9f189b1e072cfd8aaa6360deeab0b96c61/release/scripts/addons/blensor/generic_lidar.py#L172
-                        noise += error_distribution.applyNoise(mu, sigma)
-
-                    # we can't simply move the hit location around by some random translation
-                    # instead, we have to move it along the ray direction
-
-                    # calculate distance with noise
-                    noiseDistance = closestHit.distance + noise
-                    
-                    # calculate the direction vector with noise applied
-                    noiseDirection =  direction.normalized() * noiseDistance
-
-                    # calculate the noise location of the hit point
-                    noiseLocation = noiseDirection + origin
-
-                    if debugOutput:
-                        print("Noise Distance ", noiseDistance)
-                        print("Noise Location ", noiseLocation)
-                    
-                    closestHit.noiseLocation = noiseLocation
-                    closestHit.noiseDistance = noiseDistance
-
-                    if debugOutput:
-                        print("Location ", closestHit.location)
-                        print("Direction ", direction)
-                        print("Length ", closestHit.location.length)
-                        print("Noise ", noise)
-                        print("Distance ", closestHit.distance)     
-
-                    if not sonarMode3D:
-                        # to simulate sonar, we have to move all values into one plane
-                        if sonarKeepRotation:
-                            closestHit.location = Vector((direction.x, direction.y, 0)).normalized() * closestHit.distance + origin
+                        if x > 0:
+                            closestHit.location.x = -closestHit.distance
                         else:
-                            if x > 0:
-                                closestHit.location.x = -closestHit.distance
-                            else:
-                                closestHit.location.x = closestHit.distance
-                            
-                            closestHit.location.y = traveledDistance
-                            closestHit.location.z = startLocation.z
-
-                    # save closest hit into array
-                    scannedValues[valueIndex] = closestHit
-
-                    valueIndex += 1
-                else:
-                    if debugOutput:
-                        print("NO HIT within range of %f" % maxDistance)
-                
-                indexY += 1
+                            closestHit.location.x = closestHit.distance
+                        
+                        closestHit.location.y = traveledDistance
+                        closestHit.location.z = startLocation.z
 
-                if singleRay:
-                    break
-            
-            indexX += 1
-            indexY = 0
+                # save closest hit into array
+                hit_info.storeHit(scannedValues, valueIndex, closestHit, targetIndices[closestHit.target])
 
-            if outputProgress:
-                percentage = (indexX * yRange.size) / totalNumberOfRays 
-                generic.updateProgress("Scanning scene", percentage)
+                valueIndex += 1
+            else:
+                if debugOutput:
+                    print("NO HIT within range of %f" % maxDistance)
 
-            if singleRay:
-                break
+        if outputProgress:
+            percentage = (frameNumber - firstFrame + 1) / (lastFrame - firstFrame + 1)
+            generic.updateProgress("Scanning scene", percentage)
 
     if measureTime:
         print("Loop: %s s" % (time.time() - startTime))
@@ -434,7 +465,7 @@ def performScan(context,
     if len(slicedScannedValues) > 0:
         # setup exporter with our data
         if exportLAS or exportHDF or exportCSV:
-            fileExporter = exporter.Exporter(dataFilePath, "%s_frame_%d" % (dataFileName, frameNumber), dataFileName, slicedScannedValues, targets, categoryIDs, partIDs, materialMappings, exportNoiseData, 0, 0)
+            fileExporter = exporter.Exporter(dataFilePath, "%s_frame_%d" % (dataFileName, frameNumber), dataFileName, slicedScannedValues, targets, categoryIDs, partIDs, materialMappings, exportNoiseData, 0, 0, noiseSeed=noiseGenerator.seed)
 
             # export to each format
             if exportLAS:
@@ -39,6 +39,7 @@ from bpy.utils import register_class, unregister_class
 
 from ..scanners import hit_info
 from ..scanners import generic
+from ..scanners import geometry_cache
 
 import time
 import os
@@ -789,6 +790,13 @@ class ScannerProperties(PropertyGroup):
         default = 0.01,
     )
 
+    noiseSeed: IntProperty(
+        name = "Seed",
+        description = "Seed of the noise generator, the same seed reproduces the same noise. 0 picks a random seed, which is printed and stored with the exported data (.hdf: noise_seed dataset, .las/.csv: <file name>_noise_seed.txt)",
+        default = 0,
+        min = 0,
+    )
+
 
     addConstantNoise: BoolProperty(
         name="Add constant offset",
@@ -875,6 +883,53 @@ class ScannerProperties(PropertyGroup):
 
 
 
+    # KINECT
+    simulateKinect: BoolProperty(
+        name="Simulate Kinect v1 depth",
+        description="Quantize the depth like the disparity measurement of a Kinect v1 and remove the returns at grazing angles",
+        default = False
+    )
+
+    kinectBaseline: FloatProperty(
+        name = "Baseline (m)",
+        description = "Distance between the infrared projector and the infrared camera in meter",
+        default = 0.075,
+        min = 0.0,
+        max = 10.0
+    )
+
+    kinectFocalLength: FloatProperty(
+        name = "Focal length (px)",
+        description = "Focal length of the infrared camera in pixels",
+        default = 580.0,
+        min = 1.0
+    )
+
+    kinectDisparitySteps: IntProperty(
+        name = "Disparity steps",
+        description = "Number of disparity steps per pixel (subpixel accuracy)",
+        default = 8,
+        min = 1
+    )
+
+    kinectMaxIncidenceAngle: FloatProperty(
+        name = "Max. incidence angle",
+        description = "Largest angle between ray and surface normal in degrees which still returns a depth",
+        default = 80.0,
+        min = 0.0,
+        max = 90.0
+    )
+
+    simulateProjectorShadows: BoolProperty(
+        name="Simulate projector shadows",
+        description="Remove the returns of surfaces which are hidden from the infrared projector, it is placed next to the camera at the distance of the baseline",
+        default = False
+    )
+
+
+
+
+
     # VISUALIZATION
     addMesh: BoolProperty(
         name="Add datapoint mesh",
@@ -984,6 +1039,43 @@ class ScannerProperties(PropertyGroup):
 
 
 
+    # PERFORMANCE
+    numberOfWorkers: IntProperty(
+        name = "Worker processes",
+        description = "Number of processes which cast the rays in parallel (1 = scan in Blender's process)",
+        default = 1,
+        min = 1,
+        max = 256,
+    )
+
+    tileSize: IntProperty(
+        name = "Tile size",
+        description = "Maximum number of rays each worker process casts at once, smaller scans are split evenly between the workers",
+        default = 4096,
+        min = 256,
+    )
+
+    cacheDirectory: StringProperty(
+        name="Cache",
+        description="Directory to store the ray direction tables and the mesh data of the scanned objects in, so other Blender sessions can reuse them, the least recently used entries are deleted once it needs more than 4 GB (leave empty to only keep them in memory)",
+        default="",
+        maxlen=2048,
+        subtype='DIR_PATH'
+    )
+
+    streamExport: BoolProperty(
+        name="Stream export",
+        description="Export the hits in chunks while scanning instead of keeping the hits of all frames in memory (only used if single frames are not exported)",
+        default = False
+    )
+
+    chunkSize: IntProperty(
+        name = "Chunk size",
+        description = "Number of hits which are kept in memory before they are written to disk",
+        default = 1000000,
+        min = 1000,
+    )
+
     # DEBUG
     debugLines: BoolProperty(
         name="Debug lines",
@@ -1401,6 +1493,8 @@ def scan_rotating(context,
         dataFilePath, dataFileName,
         
         debugLines, debugOutput, outputProgress, measureTime, singleRay, destinationObject, targetObject,
+
+        numberOfWorkers=1, tileSize=4096, streamExport=False, chunkSize=1000000, cacheDirectory="", noiseSeed=0,
 ):
 
     scene = context.scene
@@ -1454,6 +1548,13 @@ def scan_rotating(context,
     properties.destinationObject = destinationObject
     properties.targetObject = targetObject
 
+    properties.numberOfWorkers = numberOfWorkers
+    properties.tileSize = tileSize
+    properties.streamExport = streamExport
+    properties.chunkSize = chunkSize
+    properties.cacheDirectory = cacheDirectory
+    properties.noiseSeed = noiseSeed
+
     performScan(context, dependencies_installed, properties)
 
 def scan_sonar(context, 
@@ -1477,6 +1578,7 @@ def scan_sonar(context,
         dataFilePath, dataFileName,
         
         debugLines, debugOutput, outputProgress, measureTime, singleRay, destinationObject, targetObject,
+        noiseSeed=0,
 ):
 
     scene = context.scene
@@ -1532,6 +1634,8 @@ def scan_sonar(context,
     properties.destinationObject = destinationObject
     properties.targetObject = targetObject
 
+    properties.noiseSeed = noiseSeed
+
     performScan(context, dependencies_installed, properties)
 
 
@@ -1555,6 +1659,10 @@ def scan_static(context,
         dataFilePath, dataFileName,
         
         debugLines, debugOutput, outputProgress, measureTime, singleRay, destinationObject, targetObject,
+
+        numberOfWorkers=1, tileSize=4096, streamExport=False, chunkSize=1000000, cacheDirectory="", noiseSeed=0,
+
+        simulateKinect=False, kinectBaseline=0.075, kinectFocalLength=580.0, kinectDisparitySteps=8, kinectMaxIncidenceAngle=80.0, simulateProjectorShadows=False,
 ):
 
     scene = context.scene
@@ -1615,6 +1723,20 @@ def scan_static(context,
     properties.destinationObject = destinationObject
     properties.targetObject = targetObject
 
+    properties.numberOfWorkers = numberOfWorkers
+    properties.tileSize = tileSize
+    properties.streamExport = streamExport
+    properties.chunkSize = chunkSize
+    properties.cacheDirectory = cacheDirectory
+    properties.noiseSeed = noiseSeed
+
+    properties.simulateKinect = simulateKinect
+    properties.kinectBaseline = kinectBaseline
+    properties.kinectFocalLength = kinectFocalLength
+    properties.kinectDisparitySteps = kinectDisparitySteps
+    properties.kinectMaxIncidenceAngle = kinectMaxIncidenceAngle
+    properties.simulateProjectorShadows = simulateProjectorShadows
+
     performScan(context, dependencies_installed, properties)
 
 class WM_OT_GENERATE_POINT_CLOUDS(Operator):
@@ -2035,6 +2157,9 @@ class OBJECT_PT_NOISE_PANEL(MAIN_PANEL, Panel):
         verticalLayout.prop(properties, "sigma")
         column.enabled = properties.addNoise
 
+        # the seed is also used for the rain noise
+        layout.prop(properties, "noiseSeed")
+
 
 class OBJECT_PT_WEATHER_PANEL(MAIN_PANEL, Panel):
     bl_parent_id = "OBJECT_PT_MAIN_PANEL"
@@ -2062,6 +2187,35 @@ class OBJECT_PT_WEATHER_PANEL(MAIN_PANEL, Panel):
             layout.prop(properties, "dustCloudStart")
             layout.prop(properties, "dustCloudLength") 
 
+class OBJECT_PT_KINECT_PANEL(MAIN_PANEL, Panel):
+    bl_parent_id = "OBJECT_PT_MAIN_PANEL"
+    bl_label = "Kinect v1 depth model"
+
+    @classmethod
+    def poll(self,context):
+        return context.object is not None and context.scene.scannerProperties.scannerType == generic.ScannerType.static.name
+
+    def draw(self, context):
+        layout = self.layout
+        scene = context.scene
+        properties = scene.scannerProperties
+
+        layout.prop(properties, "simulateKinect")
+        column = layout.column()
+        column.prop(properties, "kinectFocalLength")
+        column.prop(properties, "kinectDisparitySteps")
+        column.prop(properties, "kinectMaxIncidenceAngle")
+        column.enabled = properties.simulateKinect
+
+        layout.prop(properties, "simulateProjectorShadows")
+
+        layout.separator()
+
+        # the baseline is used by the depth model and by the projector shadows
+        column = layout.column()
+        column.prop(properties, "kinectBaseline")
+        column.enabled = properties.simulateKinect or properties.simulateProjectorShadows
+
 class OBJECT_PT_VISUALIZATION_PANEL(MAIN_PANEL, Panel):
     bl_parent_id = "OBJECT_PT_MAIN_PANEL"
     bl_label = "Visualization"
@@ -2124,6 +2278,31 @@ class OBJECT_PT_EXPORT_PANEL(MAIN_PANEL, Panel):
         
 
 
+class OBJECT_PT_PERFORMANCE_PANEL(MAIN_PANEL, Panel):
+    bl_parent_id = "OBJECT_PT_MAIN_PANEL"
+    bl_label = "Performance"
+
+    @classmethod
+    def poll(self,context):
+        return context.object is not None
+
+    def draw(self, context):
+        layout = self.layout
+        scene = context.scene
+        properties = scene.scannerProperties
+
+        layout.prop(properties, "numberOfWorkers")
+        layout.prop(properties, "tileSize")
+        layout.prop(properties, "cacheDirectory")
+
+        layout.separator()
+
+        layout.prop(properties, "streamExport")
+        row = layout.row()
+        row.enabled = properties.streamExport
+        row.prop(properties, "chunkSize")
+
+
 class OBJECT_PT_DEBUG_PANEL(MAIN_PANEL, Panel):
     bl_parent_id = "OBJECT_PT_MAIN_PANEL"
     bl_label = "DEBUG"
@@ -2316,8 +2495,10 @@ classes = (
     OBJECT_PT_OBJECT_MODIFICATION_PANEL,
     OBJECT_PT_NOISE_PANEL,
     OBJECT_PT_WEATHER_PANEL,
+    OBJECT_PT_KINECT_PANEL,
     OBJECT_PT_VISUALIZATION_PANEL,
     OBJECT_PT_EXPORT_PANEL,
+    OBJECT_PT_PERFORMANCE_PANEL,
     OBJECT_PT_DEBUG_PANEL,
 
     CUSTOM_OT_addItem,
@@ -2342,6 +2523,9 @@ def register():
     bpy.types.Scene.scannerProperties = PointerProperty(type=ScannerProperties)
     bpy.types.Scene.custom = CollectionProperty(type=CUSTOM_objectCollection)
 
+    # keep the cached geometry in sync with the scene
+    geometry_cache.register()
+
     missingDependency = None
 
     try:
@@ -2379,3 +2563,5 @@ def unregister():
 
     del bpy.types.Scene.scannerProperties
     del bpy.types.Scene.custom
+
+    geometry_cache.unregister()
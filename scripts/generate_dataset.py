@@ -53,7 +53,11 @@ def kinect_v1(output_dir, filename):
             exportRenderedImage=False, exportSegmentedImage=False, exportPascalVoc=False, exportDepthmap=True, depthMinDistance=0.0, depthMaxDistance=5.0, 
             dataFilePath=output_dir, dataFileName=filename,
             
-            debugLines=False, debugOutput=False, outputProgress=False, measureTime=False, singleRay=False, destinationObject=None, targetObject=None
+            debugLines=False, debugOutput=False, outputProgress=False, measureTime=False, singleRay=False, destinationObject=None, targetObject=None,
+
+            numberOfWorkers=os.cpu_count() or 1,
+
+            simulateKinect=True, kinectBaseline=0.075, kinectFocalLength=580.0, kinectDisparitySteps=8, kinectMaxIncidenceAngle=80.0, simulateProjectorShadows=True,
         )
     except Exception as e:
         print(e)